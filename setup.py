@@ -47,9 +47,9 @@ setup(
     ]},
     entry_points="""
     [zc.buildout]
-    default = sact.recipe.postgresql:Recipe
+    default = sact.recipe.postgresql.recipe:Recipe
 
     [zc.buildout.uninstall]
-    default = sact.recipe.postgresql:uninstall_postgresql
+    default = sact.recipe.postgresql.recipe:uninstall_postgresql
     """,
     )
@@ -0,0 +1,142 @@
+"""Settings derived from the hardware, for a given workload profile.
+
+Each derived setting comes with a short explanation of how it was computed,
+which the recipe logs and writes next to the value in ``postgresql.conf``.
+The formulas follow the usual sizing advice for PostgreSQL: a quarter of the
+memory for the shared buffers, most of the rest counted as OS cache, and the
+per-operation memory split between the expected concurrent sorts.
+"""
+
+import math
+
+from sact.recipe.postgresql import system
+
+
+PROFILES = ('oltp', 'olap', 'mixed', 'ci')
+
+MB = 1024 * 1024
+
+# Concurrent sorts/hashes per connection used to split work_mem.
+WORK_MEM_SPLIT = {'oltp': 3.0, 'mixed': 2.0, 'olap': 0.5, 'ci': 3.0}
+
+# (min_wal_size, max_wal_size) in MB.
+WAL_SIZES = {'oltp': (2048, 8192), 'mixed': (1024, 4096), 'olap': (4096, 16384), 'ci': (80, 2048)}
+
+STATISTICS_TARGET = {'oltp': 100, 'mixed': 100, 'olap': 500, 'ci': 100}
+
+
+class Resources(object):
+    """What the host gives us to run the server."""
+
+    def __init__(self, cpus, memory, huge_pages=0, huge_page_size=0, rotational=None):
+        self.cpus = cpus
+        self.memory = memory
+        self.huge_pages = huge_pages
+        self.huge_page_size = huge_page_size
+        self.rotational = rotational
+
+    def __repr__(self):
+        return '<Resources %d CPUs, %dMB>' % (self.cpus, (self.memory or 0) // MB)
+
+
+def detect(datadir):
+    """Detect the resources of the host, datadir giving the storage to check."""
+
+    pages, page_size = system.huge_pages()
+    return Resources(cpus=system.available_cpus(),
+                     memory=system.total_memory(),
+                     huge_pages=pages,
+                     huge_page_size=page_size,
+                     rotational=system.is_rotational(datadir))
+
+
+def _mb(value):
+    return '%dMB' % max(int(value), 1)
+
+
+def tune(profile, resources, max_connections=100):
+    """Return a list of (name, value, explanation) for the profile.
+
+    Raises ValueError for unknown profiles.
+    """
+
+    if profile not in PROFILES:
+        raise ValueError("Unknown autotune profile %r, use one of %s" %
+                         (profile, ', '.join(PROFILES)))
+
+    settings = []
+
+    def setting(name, value, explanation):
+        settings.append((name, value, explanation))
+
+    cpus = resources.cpus
+
+    if resources.memory:
+        memory_mb = resources.memory // MB
+        if profile == 'ci':
+            shared_buffers = max(32, min(memory_mb // 16, 256))
+            setting('shared_buffers', _mb(shared_buffers),
+                    '1/16 of %dMB of memory, between 32MB and 256MB for CI' % memory_mb)
+            cache = memory_mb // 2
+            setting('effective_cache_size', _mb(cache), 'half of %dMB of memory' % memory_mb)
+            setting('maintenance_work_mem', _mb(64), 'fixed for CI')
+        else:
+            shared_buffers = memory_mb // 4
+            setting('shared_buffers', _mb(shared_buffers), '1/4 of %dMB of memory' % memory_mb)
+            cache = memory_mb * 3 // 4
+            setting('effective_cache_size', _mb(cache), '3/4 of %dMB of memory' % memory_mb)
+            maintenance = min(memory_mb // 16, 2048)
+            setting('maintenance_work_mem', _mb(maintenance),
+                    '1/16 of %dMB of memory, at most 2GB' % memory_mb)
+
+        split = WORK_MEM_SPLIT[profile]
+        gather = max(1, cpus // 2)
+        work_mem = max(4, (memory_mb - shared_buffers) / (max_connections * split) / gather)
+        setting('work_mem', _mb(work_mem),
+                '(%dMB memory - %dMB shared_buffers) / (%d max_connections * %g '
+                'operations) / %d parallel workers, at least 4MB' % (
+                    memory_mb, shared_buffers, max_connections, split, gather))
+
+        if shared_buffers >= 512:
+            setting('wal_buffers', _mb(16), 'maximum useful value, shared_buffers >= 512MB')
+
+        if resources.huge_pages:
+            pool = resources.huge_pages * resources.huge_page_size // MB
+            if pool >= shared_buffers:
+                setting('huge_pages', 'try',
+                        '%dMB of huge pages reserved, enough for shared_buffers' % pool)
+
+    min_wal, max_wal = WAL_SIZES[profile]
+    setting('min_wal_size', _mb(min_wal), 'sized for the %s profile' % profile)
+    setting('max_wal_size', _mb(max_wal), 'sized for the %s profile' % profile)
+    setting('checkpoint_completion_target', '0.9', 'spread checkpoint writes')
+    if profile == 'ci':
+        setting('checkpoint_timeout', '30min', 'avoid checkpoints during test runs')
+        setting('synchronous_commit', 'off', 'CI data does not need to survive a crash')
+
+    setting('default_statistics_target', str(STATISTICS_TARGET[profile]),
+            'planner statistics detail for the %s profile' % profile)
+
+    if resources.rotational is True:
+        setting('random_page_cost', '4.0', 'data directory on a rotational disk')
+        setting('effective_io_concurrency', '2', 'data directory on a rotational disk')
+    elif resources.rotational is False:
+        setting('random_page_cost', '1.1', 'data directory on a solid state disk')
+        setting('effective_io_concurrency', '200', 'data directory on a solid state disk')
+
+    setting('max_worker_processes', str(max(cpus, 8)), '%d CPUs available, at least 8' % cpus)
+    setting('max_parallel_workers', str(cpus), '%d CPUs available' % cpus)
+    if profile == 'olap':
+        per_gather = int(math.ceil(cpus / 2.0))
+        explanation = 'half of %d CPUs' % cpus
+    elif profile == 'ci':
+        per_gather = min(2, cpus // 2)
+        explanation = 'half of %d CPUs, at most 2' % cpus
+    else:
+        per_gather = min(4, cpus // 2)
+        explanation = 'half of %d CPUs, at most 4' % cpus
+    setting('max_parallel_workers_per_gather', str(per_gather), explanation)
+    setting('max_parallel_maintenance_workers', str(min(4, max(1, cpus // 2))),
+            'half of %d CPUs, at most 4' % cpus)
+
+    return settings
@@ -0,0 +1,266 @@
+"""Backups of the databases of a part, and their restore.
+
+The recipe generates ``bin/<part>-backup`` and ``bin/<part>-restore``, which
+call backup_main() and restore_main() with the paths of the first cluster.
+Each backup is a directory named after its date, holding the roles and
+tablespaces (``globals.sql``, from ``pg_dumpall --globals-only``), one
+directory-format dump per database, written by ``pg_dump --jobs`` with one
+job per available CPU, and a ``manifest.json`` recording the duration, the
+size and the throughput of each dump.
+
+Restores run ``pg_restore --jobs`` too. With ``--fresh``, the current data
+directory is moved aside and the databases are restored into a new cluster,
+created like the recipe creates them.
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import time
+
+from sact.recipe.postgresql import ctl
+from sact.recipe.postgresql.cache import tree_size
+from sact.recipe.postgresql.cluster import create_cluster
+from sact.recipe.postgresql.readiness import server_pid
+from sact.recipe.postgresql.system import available_cpus
+
+
+MANIFEST = 'manifest.json'
+GLOBALS = 'globals.sql'
+
+
+def archive_settings(directory):
+    """Settings archiving the WAL into directory, as (name, value, why)."""
+
+    why = 'WAL archiving to %s' % directory
+    return [
+        ('wal_level', 'replica', why),
+        ('archive_mode', 'on', why),
+        # Never overwrite an archived segment.
+        ('archive_command', 'test ! -f "%s/%%f" && cp "%%p" "%s/%%f"' % (directory, directory), why),
+    ]
+
+
+def dump_command(config, database, destination, jobs, compression=None):
+    cmd = [os.path.join(config['bin_dir'], 'pg_dump')] + _connection(config) + [
+        '--format=directory', '--jobs=%d' % jobs, '--file=%s' % destination]
+    if compression:
+        cmd.append('--compress=%s' % compression)
+    return cmd + [database]
+
+
+def restore_command(config, source, jobs, clean=False):
+    # --create connects to postgres first, then to the new database.
+    cmd = [os.path.join(config['bin_dir'], 'pg_restore')] + _connection(config) + [
+        '--create', '--exit-on-error', '--jobs=%d' % jobs, '--dbname=postgres']
+    if clean:
+        cmd.extend(['--clean', '--if-exists'])
+    return cmd + [source]
+
+
+def throughput(size, seconds):
+    """Return size bytes per seconds, in MB/s."""
+
+    if seconds <= 0:
+        return None
+    return round(size / 1024.0 / 1024.0 / seconds, 2)
+
+
+def _connection(config):
+    return ['-h', config['socketdir'].split(',')[0].strip(),
+            '-p', str(config['port']),
+            '-U', config['user']]
+
+
+def _psql(config, query, database='postgres'):
+    cmd = ([os.path.join(config['bin_dir'], 'psql')] + _connection(config) +
+           ['-X', '--no-align', '--quiet', '--tuples-only', '-c', query, database])
+    return subprocess.check_output(cmd, universal_newlines=True).strip()
+
+
+def _run(cmd):
+    """Run cmd, raising RuntimeError with its output when it fails."""
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError("%s failed with exit code %s:\n%s" %
+                           (os.path.basename(cmd[0]), proc.returncode, out))
+    return out
+
+
+def find_backup(directory, name):
+    """Return the path of the backup name, or of the latest one."""
+
+    if name != 'latest':
+        path = name if os.path.isabs(name) else os.path.join(directory, name)
+    else:
+        backups = sorted(entry for entry in os.listdir(directory)
+                         if os.path.exists(os.path.join(directory, entry, MANIFEST))) \
+            if os.path.isdir(directory) else []
+        if not backups:
+            raise ValueError("No backup in %s" % directory)
+        path = os.path.join(directory, backups[-1])
+    if not os.path.exists(os.path.join(path, MANIFEST)):
+        raise ValueError("%s is not a backup: it has no %s" % (path, MANIFEST))
+    return path
+
+
+def backup(config, databases, jobs, compression):
+    """Dump the globals and databases, returning the path of the backup."""
+
+    path = os.path.join(config['directory'], time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(path)
+    manifest = dict(started=time.time(), jobs=jobs, compression=compression or 'default',
+                    server_version=_psql(config, 'SHOW server_version'), databases=[])
+
+    start = time.time()
+    with open(os.path.join(path, GLOBALS), 'w') as fd:
+        fd.write(_run([os.path.join(config['bin_dir'], 'pg_dumpall')] + _connection(config) +
+                      ['--globals-only']))
+    manifest['globals_seconds'] = round(time.time() - start, 3)
+
+    for database in databases:
+        size = int(_psql(config, "SELECT pg_database_size('%s')" % database.replace("'", "''")))
+        print("Dumping %s (%.1f MB) with %d jobs" % (database, size / 1024.0 / 1024.0, jobs))
+        destination = os.path.join(path, database)
+        start = time.time()
+        _run(dump_command(config, database, destination, jobs, compression))
+        seconds = time.time() - start
+        dump_size = tree_size(destination)
+        manifest['databases'].append(dict(name=database,
+                                          seconds=round(seconds, 3),
+                                          database_bytes=size,
+                                          dump_bytes=dump_size,
+                                          throughput_mb_s=throughput(size, seconds)))
+        print("  %s dumped in %.1fs (%s MB/s, %.1f MB on disk)" % (
+            database, seconds, throughput(size, seconds), dump_size / 1024.0 / 1024.0))
+
+    manifest['finished'] = time.time()
+    manifest['seconds'] = round(manifest['finished'] - manifest['started'], 3)
+    with open(os.path.join(path, MANIFEST), 'w') as fd:
+        json.dump(manifest, fd, indent=1, sort_keys=True)
+    return path
+
+
+def fresh_cluster(config):
+    """Move the data directory aside and create a new cluster in its place."""
+
+    if ctl.stop(config) != 0:
+        raise RuntimeError("Unable to stop PostgreSQL")
+    datadir = config['datadir'].rstrip(os.sep)
+    aside = '%s.%s' % (datadir, time.strftime('%Y%m%d-%H%M%S'))
+    os.rename(datadir, aside)
+    print("Moved the data directory to %s" % aside)
+    create_cluster(config['bin_dir'], datadir, config['user'], config['initdb_args'],
+                   template_cache=config['cluster_cache'])
+    if ctl.start(config) != 0:
+        raise RuntimeError("Unable to start the new cluster")
+
+
+def restore(config, path, databases, jobs, clean=False):
+    """Restore databases from the backup in path, returning their timings."""
+
+    with open(os.path.join(path, MANIFEST)) as fd:
+        manifest = json.load(fd)
+    available = [entry['name'] for entry in manifest['databases']]
+    unknown = [database for database in databases if database not in available]
+    if unknown:
+        raise ValueError("%s not in the backup %s" % (', '.join(unknown), path))
+
+    timings = []
+    for entry in manifest['databases']:
+        if databases and entry['name'] not in databases:
+            continue
+        print("Restoring %s with %d jobs" % (entry['name'], jobs))
+        start = time.time()
+        _run(restore_command(config, os.path.join(path, entry['name']), jobs, clean))
+        seconds = time.time() - start
+        timings.append((entry['name'], seconds))
+        print("  %s restored in %.1fs (%s MB/s)" % (
+            entry['name'], seconds, throughput(entry['database_bytes'], seconds)))
+    return timings
+
+
+def restore_globals(config, path):
+    """Replay the roles of the backup; existing ones are reported and kept."""
+
+    cmd = ([os.path.join(config['bin_dir'], 'psql')] + _connection(config) +
+           ['-X', '--quiet', '-f', os.path.join(path, GLOBALS), 'postgres'])
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    out = proc.communicate()[0]
+    for line in out.splitlines():
+        if 'ERROR' in line:
+            print("  %s" % line)
+
+
+def user_databases(config):
+    """Return the names of the databases to back up by default."""
+
+    out = _psql(config, "SELECT datname FROM pg_database "
+                "WHERE datallowconn AND NOT datistemplate AND datname <> 'postgres' "
+                "ORDER BY datname")
+    return [name for name in out.split('\n') if name]
+
+
+def _jobs(value):
+    return value or available_cpus()
+
+
+def backup_main(config, args=None):
+    parser = optparse.OptionParser(usage="%prog [options] [DATABASE...]")
+    parser.add_option('-j', '--jobs', type='int', default=config['jobs'],
+                      help="parallel dump jobs [default: one per CPU]")
+    parser.add_option('-Z', '--compress', default=config['compression'],
+                      help="pg_dump compression, e.g. 0, 9, lz4 or zstd:3")
+    options, databases = parser.parse_args(args)
+
+    if server_pid(config['datadir']) is None:
+        print("PostgreSQL is not running on %s" % config['datadir'])
+        return 2
+
+    try:
+        if not databases:
+            databases = config['databases'] or user_databases(config)
+        if not databases:
+            print("Nothing to back up: there is no user database")
+            return 0
+        path = backup(config, databases, _jobs(options.jobs), options.compress)
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        print(str(e))
+        return 1
+    print("Backup written to %s" % path)
+    return 0
+
+
+def restore_main(config, args=None):
+    parser = optparse.OptionParser(usage="%prog [options] BACKUP|latest [DATABASE...]")
+    parser.add_option('-j', '--jobs', type='int', default=config['jobs'],
+                      help="parallel restore jobs [default: one per CPU]")
+    parser.add_option('--clean', action='store_true',
+                      help="drop the databases before restoring them")
+    parser.add_option('--fresh', action='store_true',
+                      help="restore into a new cluster, moving the current one aside")
+    options, args = parser.parse_args(args)
+    if not args:
+        parser.print_usage()
+        return 2
+
+    try:
+        path = find_backup(config['directory'], args[0])
+        if options.fresh:
+            fresh_cluster(config)
+            restore_globals(config, path)
+        elif server_pid(config['datadir']) is None:
+            print("PostgreSQL is not running on %s" % config['datadir'])
+            return 2
+        start = time.time()
+        restore(config, path, args[1:], _jobs(options.jobs), options.clean)
+    except (ValueError, RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        print(str(e))
+        return 1
+    print("Restored %s in %.1fs" % (path, time.time() - start))
+    return 0
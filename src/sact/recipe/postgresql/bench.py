@@ -0,0 +1,324 @@
+"""pgbench workloads against the cluster of a part, compared to a baseline.
+
+The recipe generates ``bin/<part>-bench``, which calls main() with the paths
+and the workloads of the part. Each run initializes the pgbench tables if
+needed, runs every workload at every client count, and stores the TPS, the
+latency percentiles and the effective settings of the server in a JSON file
+of the results directory. The run is then compared to the baseline, if any:
+the script exits with status 1 when a workload got slower than the threshold
+allows, so that CI jobs catch performance drops.
+"""
+
+import glob
+import json
+import math
+import optparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from sact.recipe.postgresql.readiness import server_pid
+from sact.recipe.postgresql.system import available_cpus
+
+
+# pgbench builtin scripts, with the switch older versions (before 9.6) know.
+BUILTIN_WORKLOADS = {
+    'tpcb-like': [],
+    'simple-update': ['-N'],
+    'select-only': ['-S'],
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Relative width of the latency histogram buckets.
+BUCKET_RATIO = 1.01
+
+TPS_LINE = re.compile(r'^tps = ([0-9.]+)', re.MULTILINE)
+
+
+def workload_arguments(workload):
+    """Return the pgbench arguments of a builtin workload or custom script.
+
+    pgbench runs in a temporary directory: scripts are passed by absolute path.
+    """
+
+    if workload in BUILTIN_WORKLOADS:
+        return BUILTIN_WORKLOADS[workload]
+    if os.path.isfile(workload):
+        return ['-f', os.path.abspath(workload)]
+    raise ValueError("Unknown workload %r: use one of %s, or the path of an SQL script" %
+                     (workload, ', '.join(sorted(BUILTIN_WORKLOADS))))
+
+
+class LatencyHistogram(object):
+    """Latencies counted in buckets BUCKET_RATIO wide, in bounded memory.
+
+    Percentiles are accurate to the width of a bucket; the count, average,
+    minimum and maximum are exact.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, latency):
+        bucket = int(math.floor(math.log(max(latency, 0.001)) / math.log(BUCKET_RATIO)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = latency if self.max is None else max(self.max, latency)
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, rank):
+        """Return the rank-th percentile, the middle of its bucket."""
+
+        if not self.count:
+            return None
+        position = int(round(rank / 100.0 * (self.count - 1)))
+        if position == 0:
+            return self.min
+        if position == self.count - 1:
+            return self.max
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > position:
+                middle = BUCKET_RATIO ** (bucket + 0.5)
+                return min(max(middle, self.min), self.max)
+
+
+def read_latencies(directory):
+    """Read the per-transaction logs pgbench -l wrote in directory.
+
+    Returns a LatencyHistogram of the latencies in milliseconds. Skipped or
+    failed transactions (newer pgbench versions log them) are left out.
+    """
+
+    histogram = LatencyHistogram()
+    for path in glob.glob(os.path.join(directory, 'pgbench_log.*')):
+        with open(path) as fd:
+            for line in fd:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2].isdigit():
+                    histogram.add(int(fields[2]) / 1000.0)
+    return histogram
+
+
+class Bench(object):
+    """Run pgbench workloads against the cluster described by config."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def _connection(self):
+        return ['-h', self.config['socketdir'].split(',')[0].strip(),
+                '-p', str(self.config['port']),
+                '-U', self.config['user']]
+
+    def psql(self, query, database='template1'):
+        cmd = ([os.path.join(self.config['bin_dir'], 'psql')] + self._connection() +
+               ['-X', '--no-align', '--quiet', '--tuples-only',
+                '--field-separator', '\x1f', '-c', query, database])
+        return subprocess.check_output(cmd, universal_newlines=True).strip()
+
+    def pgbench(self, args, cwd=None):
+        cmd = ([os.path.join(self.config['bin_dir'], 'pgbench')] + self._connection() +
+               args + [self.config['database']])
+        proc = subprocess.Popen(cmd, cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        out = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise RuntimeError("pgbench failed with exit code %s:\n%s" % (proc.returncode, out))
+        return out
+
+    def prepare(self, force=False):
+        """Create the benchmark database and its tables, unless they exist."""
+
+        database = self.config['database']
+        exists = self.psql("SELECT 1 FROM pg_database WHERE datname = '%s'" %
+                           database.replace("'", "''"))
+        if not exists:
+            self.psql('CREATE DATABASE "%s"' % database.replace('"', '""'))
+
+        initialized = self.psql("SELECT 1 FROM pg_class WHERE relname = 'pgbench_accounts'",
+                                database)
+        if force or not initialized:
+            print("Initializing pgbench tables at scale %s" % self.config['scale'])
+            self.pgbench(['-i', '-q', '-s', str(self.config['scale'])])
+
+    def settings(self):
+        """Return the effective settings of the server, and its version."""
+
+        out = self.psql("SELECT name, setting FROM pg_settings ORDER BY name")
+        settings = dict(line.split('\x1f', 1) for line in out.split('\n') if line)
+        return settings.get('server_version'), settings
+
+    def run_one(self, workload, clients, duration):
+        """Run a workload and return its results as a dict."""
+
+        jobs = max(1, min(clients, available_cpus()))
+        args = (workload_arguments(workload) +
+                ['-n', '-l', '-c', str(clients), '-j', str(jobs), '-T', str(duration)])
+
+        log_dir = tempfile.mkdtemp(prefix='pgbench-')
+        try:
+            out = self.pgbench(args, cwd=log_dir)
+            latencies = read_latencies(log_dir)
+        finally:
+            shutil.rmtree(log_dir)
+
+        # Older versions print the TPS with and without the connection time,
+        # the last one is the one without.
+        tps = TPS_LINE.findall(out)
+        result = {
+            'workload': workload,
+            'clients': clients,
+            'duration': duration,
+            'transactions': latencies.count,
+            'tps': float(tps[-1]) if tps else None,
+            'latency': {},
+        }
+        if latencies.count:
+            result['latency']['avg'] = latencies.average
+            for rank in PERCENTILES:
+                result['latency']['p%d' % rank] = latencies.percentile(rank)
+        return result
+
+    def run(self, workloads, clients, duration):
+        version, settings = self.settings()
+        report = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': version,
+            'scale': self.config['scale'],
+            'settings': settings,
+            'results': [],
+        }
+        for workload in workloads:
+            for count in clients:
+                result = self.run_one(workload, count, duration)
+                print("%-20s %4d clients: %10.1f tps, p95 %s ms" % (
+                    workload, count, result['tps'] or 0,
+                    format_ms(result['latency'].get('p95'))))
+                report['results'].append(result)
+        return report
+
+
+def format_ms(value):
+    if value is None:
+        return '-'
+    return '%.2f' % value
+
+
+def compare(report, baseline, threshold):
+    """Compare the results of report with the ones of baseline.
+
+    Returns the list of the regressions, as human readable strings: a
+    workload regresses when its TPS dropped, or its 95th percentile latency
+    rose, by more than threshold (a ratio).
+    """
+
+    previous = dict(((result['workload'], result['clients']), result)
+                    for result in baseline['results'])
+    regressions = []
+    for result in report['results']:
+        reference = previous.get((result['workload'], result['clients']))
+        if reference is None:
+            continue
+        label = '%s with %d clients' % (result['workload'], result['clients'])
+
+        if reference['tps'] and result['tps'] is not None:
+            change = result['tps'] / reference['tps'] - 1
+            print("%-35s tps %+.1f%%" % (label, change * 100))
+            if change < -threshold:
+                regressions.append('%s: %.1f tps, baseline %.1f tps' %
+                                   (label, result['tps'], reference['tps']))
+
+        latency = result['latency'].get('p95')
+        reference_latency = reference['latency'].get('p95')
+        if latency is not None and reference_latency:
+            if latency / reference_latency - 1 > threshold:
+                regressions.append('%s: p95 latency %.2f ms, baseline %.2f ms' %
+                                   (label, latency, reference_latency))
+
+    changed = sorted(name for name, value in report['settings'].items()
+                     if baseline.get('settings', {}).get(name, value) != value)
+    for name in changed:
+        print("setting %s: %s -> %s" % (name, baseline['settings'][name], report['settings'][name]))
+    if baseline.get('version') != report['version']:
+        print("version: %s -> %s" % (baseline.get('version'), report['version']))
+
+    return regressions
+
+
+def main(config, args=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-w', '--workload', action='append', dest='workloads',
+                      help="workload to run (repeatable): %s or an SQL script" %
+                      ', '.join(sorted(BUILTIN_WORKLOADS)))
+    parser.add_option('-c', '--clients', action='append', type='int',
+                      help="number of clients (repeatable)")
+    parser.add_option('-T', '--duration', type='int', default=config['duration'],
+                      help="duration of each run in seconds [default: %default]")
+    parser.add_option('--threshold', type='float', default=config['threshold'],
+                      help="tolerated slowdown ratio [default: %default]")
+    parser.add_option('--baseline', default=config['baseline'],
+                      help="baseline to compare with [default: %default]")
+    parser.add_option('--save-baseline', action='store_true',
+                      help="store this run as the new baseline")
+    parser.add_option('--init', action='store_true',
+                      help="initialize the pgbench tables again")
+    options = parser.parse_args(args)[0]
+
+    if server_pid(config['datadir']) is None:
+        print("PostgreSQL is not running on %s" % config['datadir'])
+        return 2
+
+    bench = Bench(config)
+    try:
+        for workload in options.workloads or config['workloads']:
+            workload_arguments(workload)
+        bench.prepare(force=options.init)
+        report = bench.run(options.workloads or config['workloads'],
+                           options.clients or config['clients'],
+                           options.duration)
+    except (ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(str(e))
+        return 2
+
+    if not os.path.isdir(config['results']):
+        os.makedirs(config['results'])
+    path = os.path.join(config['results'], 'bench-%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(path, 'w') as fd:
+        json.dump(report, fd, indent=1, sort_keys=True)
+    print("Results written to %s" % path)
+
+    if options.save_baseline:
+        shutil.copy(path, options.baseline)
+        print("Baseline saved to %s" % options.baseline)
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print("No baseline to compare with, use --save-baseline to store one")
+        return 0
+
+    with open(options.baseline) as fd:
+        baseline = json.load(fd)
+    regressions = compare(report, baseline, options.threshold)
+    if regressions:
+        print("Performance regressions (threshold %d%%):" % (options.threshold * 100))
+        for regression in regressions:
+            print("  %s" % regression)
+        return 1
+    return 0
@@ -0,0 +1,188 @@
+"""Relocatable binary bundles, produced from source builds.
+
+A bundle is a compressed tarball of an installation, usable as ``url-bin``
+on any host of the same machine type. PostgreSQL already finds its share and
+lib directories relative to its binaries; what ties a build to its prefix is
+the run path of the executables and libraries, which we rewrite relative to
+``$ORIGIN`` with ``patchelf``. Binaries are stripped to save space.
+
+Each bundle carries a manifest, ``.sact-bundle.json`` at its root and next to
+the tarball, listing the version, the machine type, the hash of the build
+options and the sha256 of every file, which the recipe checks after
+extracting a bundle.
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from sact.recipe.postgresql.cache import copy_tree, hash_file
+from sact.recipe.postgresql.timing import Timings
+
+
+MANIFEST = '.sact-bundle.json'
+
+FORMAT = 1
+
+# Run paths of the installed ELF files, relative to the directory they are in.
+RPATHS = (
+    ('bin', '$ORIGIN/../lib'),
+    ('lib/postgresql', '$ORIGIN/..'),
+    ('lib', '$ORIGIN'),
+)
+
+
+class BundleError(Exception):
+    """A bundle could not be made, or does not match its manifest."""
+
+
+def is_elf(path):
+    try:
+        with open(path, 'rb') as fd:
+            return fd.read(4) == b'\x7fELF'
+    except (IOError, OSError):
+        return False
+
+
+def _walk_files(root):
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if not os.path.islink(path):
+                yield path
+
+
+def _run(cmd, timings):
+    """Run cmd, timed, returning its output or raising BundleError."""
+
+    try:
+        retcode, out, err = timings.communicate(os.path.basename(cmd[0]), cmd,
+                                                stdout=subprocess.PIPE,
+                                                stderr=subprocess.STDOUT,
+                                                universal_newlines=True)
+    except OSError as e:
+        raise BundleError("Unable to run %s: %s" % (cmd[0], e))
+    if retcode != 0:
+        raise BundleError("%s failed: %s" % (' '.join(cmd), out.strip()))
+    return out
+
+
+def server_version(location, timings=None):
+    """Return the version of the postgres binary of location (e.g. 15.3)."""
+
+    out = _run([os.path.join(location, 'bin', 'postgres'), '--version'],
+               timings or Timings(None, None))
+    return out.split()[-1]
+
+
+def can_relocate():
+    """Tell whether patchelf, which rewrites the run paths, is available."""
+
+    return any(os.access(os.path.join(directory, 'patchelf'), os.X_OK)
+               for directory in os.environ.get('PATH', '').split(os.pathsep) if directory)
+
+
+def make_relocatable(root, strip=True, timings=None):
+    """Strip the ELF files of root and make their run paths relative."""
+
+    timings = timings or Timings(None, None)
+    for path in _walk_files(root):
+        if not is_elf(path):
+            continue
+        relative = os.path.relpath(os.path.dirname(path), root)
+        if strip:
+            _run(['strip', '--strip-unneeded', path], timings)
+        for prefix, rpath in RPATHS:
+            if relative == prefix:
+                _run(['patchelf', '--set-rpath', rpath, path], timings)
+                break
+
+
+def manifest(root, version, build_key):
+    files = {}
+    for path in _walk_files(root):
+        relative = os.path.relpath(path, root)
+        if relative == MANIFEST:
+            continue
+        files[relative] = dict(sha256=hash_file(path), size=os.path.getsize(path))
+    return dict(format=FORMAT, version=version, machine=platform.machine(),
+                build=build_key, created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                files=files)
+
+
+def bundle_name(version, build_key):
+    return 'postgresql-%s-%s-%s' % (version, platform.machine(), build_key[:12])
+
+
+def export(location, destination, build_key, strip=True, log=None, timings=None):
+    """Package the installation of location as a bundle in destination.
+
+    Returns the path of the tarball. The installation itself is left
+    untouched: the binaries are stripped and patched in a copy.
+    """
+
+    version = server_version(location, timings)
+    name = bundle_name(version, build_key)
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+
+    staging = tempfile.mkdtemp(prefix='sact-bundle-')
+    try:
+        root = os.path.join(staging, name)
+        copy_tree(location, root)
+        for name_to_skip in ('.sact-recipe-postgresql.json', MANIFEST):
+            if os.path.exists(os.path.join(root, name_to_skip)):
+                os.remove(os.path.join(root, name_to_skip))
+        make_relocatable(root, strip=strip, timings=timings)
+
+        content = manifest(root, version, build_key)
+        with open(os.path.join(root, MANIFEST), 'w') as fd:
+            json.dump(content, fd, indent=1, sort_keys=True)
+
+        tarball = os.path.join(destination, name + '.tar.gz')
+        with tarfile.open(tarball + '.tmp', 'w:gz') as tar:
+            # Files at the top of the archive, like url-bin expects them.
+            for entry in sorted(os.listdir(root)):
+                tar.add(os.path.join(root, entry), arcname=entry)
+        os.rename(tarball + '.tmp', tarball)
+        shutil.copy(os.path.join(root, MANIFEST), os.path.join(destination, name + '.json'))
+    finally:
+        shutil.rmtree(staging)
+
+    if log is not None:
+        log.info('Exported %d files to %s', len(content['files']), tarball)
+    return tarball
+
+
+def verify(location):
+    """Check an extracted bundle against its manifest.
+
+    Returns the manifest, or None when location does not come from a bundle.
+    Raises BundleError when a file is missing or differs.
+    """
+
+    path = os.path.join(location, MANIFEST)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as fd:
+        content = json.load(fd)
+    if content.get('format') != FORMAT:
+        raise BundleError("Unsupported bundle format %r" % content.get('format'))
+    if content['machine'] != platform.machine():
+        raise BundleError("The bundle was built for %s, not %s" %
+                          (content['machine'], platform.machine()))
+
+    for relative, expected in sorted(content['files'].items()):
+        path = os.path.join(location, relative)
+        if not os.path.exists(path):
+            raise BundleError("%s is missing from the bundle" % relative)
+        if os.path.getsize(path) != expected['size'] or hash_file(path) != expected['sha256']:
+            raise BundleError("%s does not match the bundle manifest" % relative)
+    return content
@@ -0,0 +1,292 @@
+"""Content-addressed caches shared between buildouts.
+
+A cache is a plain directory holding one sub-directory per entry, named by a
+key (usually a sha256 hex digest of the inputs that produced it). Each entry
+comes with a ``<key>.json`` metadata file whose modification time records the
+last use of the entry, which is what the LRU eviction relies on.
+
+Entries are immutable once published: they are assembled in a temporary
+directory inside the cache and renamed into place, so a concurrent reader
+never sees a half-written tree. Writers serialize on a per-key ``flock`` so
+parallel buildouts on the same host build a given entry only once.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value):
+    """Convert a human readable size such as ``10G`` or ``512MB`` to bytes.
+
+    An empty value means "no limit" and returns None.
+    """
+
+    value = value.strip()
+    if not value:
+        return None
+
+    match = re.match(r'^(\d+)\s*([kmgt]?)b?$', value, re.IGNORECASE)
+    if match is None:
+        raise ValueError("Invalid size: %r" % value)
+
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+
+def hash_inputs(*parts):
+    """Return a sha256 hex digest identifying the given input strings."""
+
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        digest.update(part)
+        # Separate the parts, so ("ab", "c") and ("a", "bc") differ.
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file content."""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_size(path):
+    """Return the apparent size in bytes of all the files below path."""
+
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def copy_tree(source, destination, hardlink=False):
+    """Copy the source tree into destination, which may already exist.
+
+    If hardlink is true, regular files are hard linked instead of copied when
+    both trees live on the same filesystem; we fall back on a plain copy
+    otherwise. Symbolic links are recreated as is.
+    """
+
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative = os.path.relpath(dirpath, source)
+        target_dir = os.path.normpath(os.path.join(destination, relative))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+            shutil.copymode(dirpath, target_dir)
+
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(target_dir, name)
+
+            if os.path.islink(src):
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                os.symlink(os.readlink(src), dst)
+                if name in dirnames:
+                    # os.walk does not descend into symlinked directories
+                    # either, the link itself is all we need.
+                    continue
+            elif name in dirnames:
+                continue
+            else:
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                if hardlink:
+                    try:
+                        os.link(src, dst)
+                        continue
+                    except OSError:
+                        # Cross-device link or filesystem without hardlink
+                        # support: copy the file instead.
+                        hardlink = False
+                shutil.copy2(src, dst)
+
+
+def remove_tree(path):
+    """Remove a directory tree, ignoring it if it is already gone."""
+
+    try:
+        shutil.rmtree(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class CacheDirectory(object):
+    """A directory of immutable trees addressed by a key."""
+
+    def __init__(self, root, max_size=None, log=None):
+        self.root = root
+        self.max_size = max_size
+        self.log = log or logging.getLogger(__name__)
+
+        for directory in (self.root, os.path.join(self.root, '.locks')):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, key + '.json')
+
+    def _lock_path(self, key):
+        return os.path.join(self.root, '.locks', key + '.lock')
+
+    @contextmanager
+    def lock(self, key):
+        """Hold an exclusive lock on key for the duration of the block."""
+
+        fd = open(self._lock_path(key), 'a')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            fd.close()
+
+    def _is_locked(self, key):
+        fd = open(self._lock_path(key), 'a')
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        finally:
+            fd.close()
+
+    def lookup(self, key):
+        """Return the path of the entry for key, or None on a cache miss.
+
+        A hit refreshes the last use time of the entry.
+        """
+
+        path = self.path(key)
+        meta = self._meta_path(key)
+        if not (os.path.isdir(path) and os.path.exists(meta)):
+            return None
+
+        try:
+            os.utime(meta, None)
+        except OSError:
+            # Evicted between the check and now.
+            return None
+        return path
+
+    def publish(self, key, source, **info):
+        """Atomically add a copy of the source tree as the entry for key.
+
+        Extra keyword arguments are stored in the entry metadata. Returns the
+        path of the published entry.
+        """
+
+        existing = self.lookup(key)
+        if existing is not None:
+            return existing
+
+        # Leftover of an interrupted removal, without its metadata.
+        self.remove(key)
+
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            os.chmod(staging, 0o755)
+            copy_tree(source, staging)
+            info.update(key=key, size=tree_size(staging), created=time.time())
+
+            fd, meta_tmp = tempfile.mkstemp(prefix='.tmp-', dir=self.root)
+            with os.fdopen(fd, 'w') as meta_fd:
+                json.dump(info, meta_fd)
+
+            os.rename(staging, self.path(key))
+            os.rename(meta_tmp, self._meta_path(key))
+        except:
+            remove_tree(staging)
+            raise
+
+        self.log.info("Published %s into the cache %s", key[:12], self.root)
+        self.evict(keep=key)
+        return self.path(key)
+
+    def remove(self, key):
+        """Drop the entry for key; readers see either all of it or nothing."""
+
+        try:
+            os.unlink(self._meta_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        path = self.path(key)
+        if os.path.isdir(path):
+            trash = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+            os.rename(path, os.path.join(trash, key))
+            remove_tree(trash)
+
+    def entries(self):
+        """Return (last_use, size, key) for every entry, oldest first."""
+
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json') or name.startswith('.'):
+                continue
+            key = name[:-len('.json')]
+            meta = self._meta_path(key)
+            try:
+                last_use = os.stat(meta).st_mtime
+                with open(meta) as fd:
+                    size = json.load(fd).get('size', 0)
+            except (OSError, IOError, ValueError):
+                continue
+            entries.append((last_use, size, key))
+
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until under max_size."""
+
+        if self.max_size is None:
+            return
+
+        entries = self.entries()
+        total = sum(size for last_use, size, key in entries)
+
+        for last_use, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep or self._is_locked(key):
+                continue
+
+            self.log.info("Evicting %s from the cache %s", key[:12], self.root)
+            with self.lock(key):
+                self.remove(key)
+            total -= size
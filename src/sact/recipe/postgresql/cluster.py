@@ -0,0 +1,158 @@
+"""Creation of PostgreSQL database clusters.
+
+Running ``initdb`` is slow: it bootstraps the catalogs in single-user mode and
+fsyncs everything. Since the result only depends on the binaries and on the
+initdb arguments, we keep a pristine copy of each cluster we create in a
+template cache and clone it into new data directories afterwards.
+
+A clone keeps the ``system_identifier`` of its template, which streaming
+replication and backup tools use to tell clusters apart. With PostgreSQL 17
+and later, ``pg_resetwal --system-identifier`` gives each clone its own
+identifier; with older versions, clusters cloned from one template share it.
+"""
+
+import logging
+import os
+import random
+import subprocess
+import time
+
+from sact.recipe.postgresql.cache import CacheDirectory, copy_tree, hash_file, hash_inputs
+from sact.recipe.postgresql.timing import Timings
+
+
+# Variables initdb reads the default locale and encoding from.
+LOCALE_VARIABLES = ('LC_ALL', 'LC_COLLATE', 'LC_CTYPE', 'LC_MESSAGES',
+                    'LC_MONETARY', 'LC_NUMERIC', 'LC_TIME', 'LANG')
+
+
+def initdb_arguments(options):
+    """Build the initdb arguments from the recipe options."""
+
+    args = []
+    if options.get('locale'):
+        args.append('--locale=%s' % options['locale'])
+    if options.get('encoding'):
+        args.append('--encoding=%s' % options['encoding'])
+    if options.get('data-checksums', '').lower() in ('yes', 'true', '1', 'on'):
+        args.append('--data-checksums')
+    if options.get('wal-segsize'):
+        args.append('--wal-segsize=%s' % options['wal-segsize'])
+    if options.get('no-sync', '').lower() in ('yes', 'true', '1', 'on') or \
+            options.get('ephemeral', '').lower() in ('yes', 'true', '1', 'on'):
+        args.append('--no-sync')
+    args.extend(options.get('initdb-options', '').split())
+    return args
+
+
+def template_key(bin_dir, admin, initdb_args):
+    """Identify the clusters initdb would produce for these inputs."""
+
+    environment = ''
+    if not any(arg.startswith('--locale') for arg in initdb_args):
+        environment = ' '.join('%s=%s' % (name, os.environ.get(name, ''))
+                               for name in LOCALE_VARIABLES)
+
+    return hash_inputs(hash_file(os.path.join(bin_dir, 'postgres')),
+                       hash_file(os.path.join(bin_dir, 'initdb')),
+                       admin,
+                       ' '.join(initdb_args),
+                       environment)
+
+
+def clone_cluster(source, datadir, timings=None):
+    """Copy a cluster, sharing blocks with the source where possible.
+
+    Hard links are not an option here since the server modifies its files in
+    place, but copy-on-write reflinks are, so we try ``cp --reflink=auto``
+    before falling back on a plain copy.
+    """
+
+    timings = timings or Timings(None, None)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            retcode = timings.call('cp clone', ['cp', '-a', '--reflink=auto',
+                                                source + '/.', datadir],
+                                   stderr=devnull)
+    except OSError:
+        retcode = 1
+
+    if retcode != 0:
+        copy_tree(source, datadir)
+
+
+def create_cluster(bin_dir, datadir, admin, initdb_args=(), template_cache=None, log=None,
+                   timings=None):
+    """Create a new database cluster in datadir.
+
+    If template_cache is the path of a directory, the cluster is cloned from
+    a matching template when there is one, and saved as a template otherwise.
+    The commands are recorded in timings, if given.
+    """
+
+    log = log or logging.getLogger(__name__)
+    timings = timings or Timings(None, None)
+    initdb_args = list(initdb_args)
+
+    os.makedirs(datadir)
+    os.chmod(datadir, 0o700)
+
+    def initdb():
+        cmd = [os.path.join(bin_dir, 'initdb'), '-D', datadir, '-U', admin] + initdb_args
+        retcode = timings.call('initdb', cmd)
+        if retcode != 0:
+            raise RuntimeError("initdb failed with exit code %s" % retcode)
+
+    if not template_cache:
+        initdb()
+        return
+
+    cache = CacheDirectory(template_cache, log=log)
+    key = template_key(bin_dir, admin, initdb_args)
+
+    with cache.lock(key):
+        template = cache.lookup(key)
+        if template is None:
+            initdb()
+            cache.publish(key, datadir, admin=admin, initdb=initdb_args)
+        else:
+            log.info('Cloning the cluster template %s', key[:12])
+            clone_cluster(template, datadir, timings)
+            reset_system_identifier(bin_dir, datadir, log, timings)
+
+
+def new_system_identifier():
+    """Make a system identifier the way initdb does: seconds, then noise."""
+
+    return (int(time.time()) << 32) | random.SystemRandom().getrandbits(32)
+
+
+def reset_system_identifier(bin_dir, datadir, log=None, timings=None):
+    """Give a cloned cluster its own system identifier, where supported.
+
+    Only ``pg_resetwal`` from PostgreSQL 17 and later can change it: with
+    older versions the clone keeps the identifier of its template. Return
+    whether the identifier was changed.
+    """
+
+    log = log or logging.getLogger(__name__)
+    timings = timings or Timings(None, None)
+    pg_resetwal = os.path.join(bin_dir, 'pg_resetwal')
+    if not os.path.exists(pg_resetwal):
+        return False
+
+    retcode, out, err = timings.communicate('pg_resetwal --help', [pg_resetwal, '--help'],
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            universal_newlines=True)
+    if retcode != 0 or '--system-identifier' not in out:
+        log.debug('pg_resetwal cannot change the system identifier, '
+                  'the clone shares the one of its template')
+        return False
+
+    cmd = [pg_resetwal, '--system-identifier=%d' % new_system_identifier(), '-D', datadir]
+    retcode, out, err = timings.communicate('pg_resetwal', cmd,
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            universal_newlines=True)
+    if retcode != 0:
+        raise RuntimeError("pg_resetwal failed with exit code %s: %s" % (retcode, err.strip()))
+    return True
@@ -0,0 +1,147 @@
+"""Control script of a PostgreSQL cluster of a part.
+
+The recipe generates ``bin/<part>-ctl`` (``bin/<part>-<instance>-ctl`` for
+named instances), which calls main() with the paths of the cluster. Status
+checks only read ``postmaster.pid`` and probe the postmaster with
+``kill(pid, 0)``, so they return in a few milliseconds; start and stop wait
+for the pid file to change, through inotify when available, instead of
+polling with ``psql``.
+"""
+
+import optparse
+import os
+import signal
+import subprocess
+import time
+
+from sact.recipe.postgresql.readiness import (
+    DirectoryWatcher, NotReady, pid_file_status, server_pid, wait_until_ready)
+
+
+COMMANDS = ('start', 'stop', 'restart', 'reload', 'status', 'promote')
+
+# Shutdown modes, as signals sent to the postmaster (see pg_ctl).
+STOP_SIGNALS = {
+    'smart': signal.SIGTERM,
+    'fast': signal.SIGINT,
+    'immediate': signal.SIGQUIT,
+}
+
+# pg_ctl exit status when the server is not running.
+NOT_RUNNING = 3
+
+
+def _pg_ctl(config, *args):
+    return [os.path.join(config['bin_dir'], 'pg_ctl'), '-D', config['datadir']] + list(args)
+
+
+def _tail(path, lines=10):
+    try:
+        with open(path) as fd:
+            return ''.join(fd.readlines()[-lines:])
+    except (IOError, OSError):
+        return ''
+
+
+def status(config):
+    pid = server_pid(config['datadir'])
+    if pid is None:
+        print("PostgreSQL is not running")
+        return NOT_RUNNING
+    print("PostgreSQL is running (pid %d, %s)" % (pid, pid_file_status(config['datadir']) or 'up'))
+    return 0
+
+
+def start(config):
+    if server_pid(config['datadir']) is not None:
+        print("PostgreSQL is already running")
+        return 0
+
+    # Let pg_ctl launch the postmaster, we wait for it ourselves.
+    with open(os.devnull, 'w') as devnull:
+        retcode = subprocess.call(_pg_ctl(config, '-o', '-c config_file=%s' % config['config_file'],
+                                          '-l', config['log_file'], '-W', 'start'),
+                                  stdout=devnull)
+    if retcode != 0:
+        print("pg_ctl failed with exit code %d:\n%s" % (retcode, _tail(config['log_file'])))
+        return retcode
+
+    try:
+        wait_until_ready(config['datadir'], config['socketdir'], config['port'], config['user'],
+                         timeout=config['timeout'],
+                         initial_delay=config['poll_interval'],
+                         max_delay=config['poll_max'])
+    except NotReady as e:
+        print("PostgreSQL did not start (%s):\n%s" % (e, _tail(config['log_file'])))
+        return 1
+    print("PostgreSQL started")
+    return 0
+
+
+def stop(config, mode='fast'):
+    pid = server_pid(config['datadir'])
+    if pid is None:
+        print("PostgreSQL is not running")
+        return 0
+
+    os.kill(pid, STOP_SIGNALS[mode])
+
+    deadline = time.time() + config['timeout']
+    delay = config['poll_interval']
+    watcher = DirectoryWatcher(config['datadir'])
+    try:
+        # The postmaster removes its pid file last thing before exiting.
+        while server_pid(config['datadir']) == pid:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print("PostgreSQL did not stop in %ds" % config['timeout'])
+                return 1
+            watcher.wait(min(delay, remaining))
+            delay = min(delay * 2, config['poll_max'])
+    finally:
+        watcher.close()
+    print("PostgreSQL stopped")
+    return 0
+
+
+def reload(config):
+    pid = server_pid(config['datadir'])
+    if pid is None:
+        print("PostgreSQL is not running")
+        return NOT_RUNNING
+    os.kill(pid, signal.SIGHUP)
+    print("PostgreSQL reloaded its configuration")
+    return 0
+
+
+def promote(config):
+    if server_pid(config['datadir']) is None:
+        print("PostgreSQL is not running")
+        return NOT_RUNNING
+    # pg_ctl knows how each version expects to be promoted.
+    return subprocess.call(_pg_ctl(config, '-w', '-t', str(int(config['timeout'])), 'promote'))
+
+
+def main(config, args=None):
+    parser = optparse.OptionParser(usage="%%prog %s [options]" % '|'.join(COMMANDS))
+    parser.add_option('-m', '--mode', default='fast', choices=sorted(STOP_SIGNALS),
+                      help="shutdown mode for stop and restart: smart, fast or "
+                      "immediate [default: %default]")
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1 or args[0] not in COMMANDS:
+        parser.print_usage()
+        return 2
+
+    command = args[0]
+    if command == 'start':
+        return start(config)
+    if command == 'stop':
+        return stop(config, options.mode)
+    if command == 'restart':
+        return stop(config, options.mode) or start(config)
+    if command == 'reload':
+        return reload(config)
+    if command == 'promote':
+        return promote(config)
+    return status(config)
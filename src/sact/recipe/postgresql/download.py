@@ -0,0 +1,300 @@
+"""Verified, resumable downloads of the binary archives.
+
+Archives are stored in a content-addressed cache, ``sha256/<hex digest>``,
+so that once an archive with the declared hash was fetched, later installs on
+the same host never touch the network. Downloads are written to a partial
+file first and resumed with HTTP range requests when interrupted; large
+archives can be fetched as several ranges in parallel, whose layout is
+recorded so that partial ranges are only resumed with the same size and
+number of chunks. When several mirrors
+are given, they are tried in order until one of them delivers an archive
+matching the declared hash.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:  # Python 2
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+from sact.recipe.postgresql.cache import CacheDirectory, hash_inputs
+
+
+BLOCK_SIZE = 1024 * 1024
+
+# Below this size, fetching ranges in parallel is not worth it.
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+
+RETRIES = 3
+
+
+class DownloadError(Exception):
+    """No mirror could deliver the archive."""
+
+
+def mirror_urls(value, arch):
+    """Parse a list of mirror URLs, expanding ``%(arch)s`` in each one."""
+
+    return [url % {'arch': arch} for url in value.split()]
+
+
+def declared_hash(value, arch):
+    """Return the sha256 declared for arch, or None.
+
+    value is either a single digest, or lines of ``<arch> <digest>``.
+    """
+
+    words = value.split()
+    if len(words) == 1:
+        return words[0].lower()
+    hashes = dict(zip(words[::2], words[1::2]))
+    if arch in hashes:
+        return hashes[arch].lower()
+    return None
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for block in iter(lambda: fd.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _open(url, timeout, start=None, end=None):
+    request = Request(url)
+    if start is not None:
+        request.add_header('Range', 'bytes=%d-%s' % (start, '' if end is None else end))
+    return urlopen(request, timeout=timeout)
+
+
+def _status(response):
+    return getattr(response, 'status', None) or response.getcode()
+
+
+def fetch_range(url, path, timeout, start=0, end=None):
+    """Fetch bytes start to end (included) of url into path, resuming.
+
+    Whatever path already holds is taken as the beginning of the range and
+    is not fetched again. Returns once the range is complete.
+    """
+
+    for attempt in range(RETRIES):
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if end is not None and start + offset > end:
+            return
+
+        begin = start + offset
+        try:
+            if begin or end is not None:
+                response = _open(url, timeout, begin, end)
+            else:
+                response = _open(url, timeout)
+            mode = 'ab'
+            if (begin or end is not None) and _status(response) != 206:
+                # No range support: start over from the beginning.
+                if start:
+                    raise DownloadError("%s does not support range requests" % url)
+                mode = 'wb'
+
+            with open(path, mode) as fd:
+                for block in iter(lambda: response.read(BLOCK_SIZE), b''):
+                    fd.write(block)
+            response.close()
+            return
+        except HTTPError as e:
+            if e.code == 416:
+                # The partial file already holds the whole range.
+                return
+            if e.code < 500:
+                raise DownloadError("%s: HTTP error %s" % (url, e.code))
+            error = e
+        except (URLError, IOError, OSError) as e:
+            error = e
+        time.sleep(2 ** attempt * 0.5)
+
+    raise DownloadError("%s: %s" % (url, error))
+
+
+def remote_size(url, timeout):
+    """Return the size of url if the server supports range requests, else None."""
+
+    try:
+        response = _open(url, timeout, 0, 0)
+    except (HTTPError, URLError, IOError, OSError):
+        return None
+    try:
+        content_range = response.headers.get('Content-Range', '')
+        if _status(response) == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                return int(total)
+        return None
+    finally:
+        response.close()
+
+
+def _read_layout(path):
+    try:
+        with open(path + '.layout') as fd:
+            return fd.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def discard_partials(path):
+    """Remove the partial ranges of path, and their layout."""
+
+    directory, name = os.path.split(path)
+    for entry in os.listdir(directory):
+        if entry.startswith(name + '.'):
+            os.remove(os.path.join(directory, entry))
+
+
+def fetch_chunked(url, path, timeout, chunks):
+    """Fetch url into path as chunks ranges fetched in parallel.
+
+    Each range goes to its own partial file, so that an interrupted download
+    is resumed range by range. The ranges are only resumed when the archive
+    size and the number of chunks did not change, they are discarded
+    otherwise. Falls back on a single stream when the server does not give
+    the size of the archive.
+    """
+
+    size = remote_size(url, timeout) if chunks > 1 else None
+    if size is None or size < MIN_CHUNK_SIZE:
+        if _read_layout(path) is not None:
+            discard_partials(path)
+        fetch_range(url, path, timeout)
+        return
+
+    layout = '%d %d' % (size, chunks)
+    if _read_layout(path) != layout:
+        discard_partials(path)
+        if os.path.exists(path):
+            os.remove(path)
+        with open(path + '.layout', 'w') as fd:
+            fd.write(layout)
+
+    step = -(-size // chunks)
+    ranges = [(index, start, min(start + step, size) - 1)
+              for index, start in enumerate(range(0, size, step))]
+    errors = []
+
+    def run(index, start, end):
+        try:
+            fetch_range(url, '%s.%d' % (path, index), timeout, start, end)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=item) for item in ranges]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    with open(path, 'wb') as fd:
+        for index, start, end in ranges:
+            with open('%s.%d' % (path, index), 'rb') as part:
+                shutil.copyfileobj(part, fd, BLOCK_SIZE)
+    discard_partials(path)
+
+
+class ArchiveCache(object):
+    """Content-addressed cache of downloaded archives."""
+
+    def __init__(self, root, log=None):
+        self.root = root
+        self.log = log or logging.getLogger(__name__)
+        # Only used for its locks, shared with concurrent buildouts.
+        self._locks = CacheDirectory(root, log=self.log)
+
+    def _path(self, *parts):
+        path = os.path.join(self.root, *parts)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return path
+
+    def lookup(self, sha256=None, urls=()):
+        """Return the cached archive with this hash, or fetched from urls."""
+
+        if sha256 is None:
+            # Without a declared hash, remember what each URL gave us.
+            for url in urls:
+                index = os.path.join(self.root, 'urls', hash_inputs(url))
+                if os.path.exists(index):
+                    with open(index) as fd:
+                        sha256 = fd.read().strip()
+                    break
+        if sha256 is None:
+            return None
+
+        path = os.path.join(self.root, 'sha256', sha256)
+        if os.path.exists(path):
+            os.utime(path, None)
+            return path
+        return None
+
+    def fetch(self, urls, sha256=None, chunks=1, timeout=30):
+        """Return the path of the archive, downloading it if needed.
+
+        Mirrors are tried in order. Raises DownloadError if none of them
+        delivered an archive matching sha256.
+        """
+
+        path = self.lookup(sha256, urls)
+        if path is not None:
+            self.log.info('Using cached archive %s', path)
+            return path
+
+        errors = []
+        for url in urls:
+            with self._locks.lock(hash_inputs(url)):
+                # Another buildout may have fetched it while we waited.
+                path = self.lookup(sha256, [url])
+                if path is None:
+                    path = self._fetch(url, sha256, chunks, timeout, errors)
+            if path is not None:
+                return path
+
+        raise DownloadError("Unable to download the archive:\n  %s" % '\n  '.join(errors))
+
+    def _fetch(self, url, sha256, chunks, timeout, errors):
+        partial = self._path('partial', hash_inputs(url))
+        self.log.info('Downloading %s', url)
+        start = time.time()
+        try:
+            fetch_chunked(url, partial, timeout, chunks)
+        except DownloadError as e:
+            self.log.warning('%s', e)
+            errors.append(str(e))
+            return None
+
+        digest = sha256_file(partial)
+        if sha256 is not None and digest != sha256:
+            os.remove(partial)
+            message = '%s: sha256 is %s, expected %s' % (url, digest, sha256)
+            self.log.warning('%s', message)
+            errors.append(message)
+            return None
+
+        size = os.path.getsize(partial)
+        self.log.info('Downloaded %dMB in %.1fs', size // (1024 * 1024), time.time() - start)
+        if sha256 is None:
+            self.log.warning('No sha256 declared for %s, it is %s', url, digest)
+
+        path = self._path('sha256', digest)
+        os.rename(partial, path)
+        with open(self._path('urls', hash_inputs(url)), 'w') as fd:
+            fd.write(digest)
+        return path
@@ -0,0 +1,72 @@
+"""Throwaway clusters living in memory, for tests and CI.
+
+An ephemeral cluster keeps its data directory on a tmpfs and runs with every
+durability guarantee turned off: nothing is ever forced to disk, since the
+data does not survive a reboot anyway. This is only safe on memory-backed
+filesystems, so the recipe refuses to run the profile anywhere else.
+"""
+
+import os
+
+from sact.recipe.postgresql import system
+from sact.recipe.postgresql.cache import hash_inputs
+
+
+VOLATILE_FILESYSTEMS = ('tmpfs', 'ramfs')
+
+MB = 1024 * 1024
+
+
+def default_directory(part, location):
+    """Directory of the ephemeral clusters of a part, unique per buildout."""
+
+    return os.path.join('/dev/shm', 'sact.recipe.postgresql',
+                        '%s-%s' % (part, hash_inputs(location)[:8]))
+
+
+def check_volatile(path):
+    """Raise ValueError unless path lives on a memory-backed filesystem."""
+
+    fstype = system.filesystem_type(path)
+    if fstype is None:
+        raise ValueError("Unable to check that %s is on a tmpfs, refusing to "
+                         "turn durability off there" % path)
+    if fstype not in VOLATILE_FILESYSTEMS:
+        raise ValueError("%s is on persistent storage (%s): ephemeral mode "
+                         "needs a tmpfs data directory" % (path, fstype))
+
+
+def check_room(path, size):
+    """Raise ValueError if the filesystem of path has less than size bytes free."""
+
+    available = system.free_space(path)
+    if available < size:
+        raise ValueError("Only %dMB free on the tmpfs of %s, %dMB requested" %
+                         (available // MB, path, size // MB))
+
+
+def durability_settings(size=None, replication=False):
+    """Settings of the durability-off profile, as (name, value, why).
+
+    size is the room the cluster may use in memory, if known: the WAL is kept
+    under a quarter of it. Replication needs WAL records, so the WAL level is
+    left alone when there are replicas.
+    """
+
+    settings = [
+        ('fsync', 'off', 'ephemeral: nothing needs to survive a crash'),
+        ('synchronous_commit', 'off', 'ephemeral: do not wait for WAL flushes'),
+        ('full_page_writes', 'off', 'ephemeral: no torn pages to recover from'),
+        ('wal_writer_delay', '10000ms', 'ephemeral: flush WAL as rarely as possible'),
+        ('checkpoint_timeout', '1d', 'ephemeral: checkpoints only protect from crashes'),
+        ('archive_mode', 'off', 'ephemeral: no WAL archive'),
+    ]
+    if not replication:
+        settings.extend([
+            ('wal_level', 'minimal', 'ephemeral: no replication, minimal WAL'),
+            ('max_wal_senders', '0', 'ephemeral: required by wal_level = minimal'),
+        ])
+    if size:
+        settings.append(('max_wal_size', '%dMB' % max(size // 4 // MB, 32),
+                         'ephemeral: a quarter of the %dMB tmpfs budget' % (size // MB)))
+    return settings
@@ -0,0 +1,134 @@
+"""Contrib modules and third-party extensions built against the server.
+
+Extensions are built out of tree with PGXS, using the ``pg_config`` of the
+installed server, and installed into a staging directory first, so that the
+result can be published in the build cache. Their cache key includes the
+hash of the ``postgres`` binary: an extension built for other binaries is
+never reused.
+"""
+
+import os
+
+from sact.recipe.postgresql.cache import hash_inputs
+
+
+# Libraries which only work when loaded at server start.
+PRELOAD_LIBRARIES = frozenset([
+    'auto_explain', 'citus', 'pg_cron', 'pg_partman_bgw', 'pg_qualstats',
+    'pg_squeeze', 'pg_stat_kcache', 'pg_stat_statements', 'pg_wait_sampling',
+    'pgaudit', 'timescaledb',
+])
+
+
+def merge_libraries(value, libraries):
+    """Add libraries to a shared_preload_libraries value of postgresql.conf.
+
+    Returns the list of the libraries, those of value first.
+    """
+
+    merged = [name.strip().strip('"') for name in value.split(',') if name.strip()]
+    for name in libraries:
+        if name not in merged:
+            merged.append(name)
+    return merged
+
+
+class Extension(object):
+    """An extension to build, from contrib when it has no url."""
+
+    def __init__(self, name, url=None, preload=None):
+        self.name = name
+        self.url = url
+        if preload is None:
+            preload = name in PRELOAD_LIBRARIES
+        self.preload = preload
+
+    @property
+    def contrib(self):
+        return self.url is None
+
+    def __repr__(self):
+        return '<Extension %s>' % self.name
+
+
+def parse_extensions(value):
+    """Parse the ``extensions`` option.
+
+    Each line holds the name of an extension, optionally followed by the URL
+    of its source archive (contrib modules are built from the PostgreSQL
+    sources otherwise) and by ``preload`` or ``no-preload`` to override
+    whether it is added to ``shared_preload_libraries``.
+    """
+
+    extensions = []
+    for line in value.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        name, url, preload = words[0], None, None
+        for word in words[1:]:
+            if word == 'preload':
+                preload = True
+            elif word == 'no-preload':
+                preload = False
+            elif '://' in word or os.path.isabs(word):
+                url = word
+            else:
+                raise ValueError("Invalid extension line: %r" % line.strip())
+        extensions.append(Extension(name, url, preload))
+    return extensions
+
+
+def has_control_file(location, extension):
+    """Extensions without a control file (auto_explain) are only libraries."""
+
+    # Installation directories get a postgresql sub-directory unless the
+    # prefix already mentions postgres or pgsql.
+    return any(os.path.exists(os.path.join(location, share, 'extension', extension.name + '.control'))
+               for share in ('share', os.path.join('share', 'postgresql')))
+
+
+def is_installed(location, extension):
+    """Tell whether the files of extension are in the installation."""
+
+    if has_control_file(location, extension):
+        return True
+    return any(os.path.exists(os.path.join(location, lib, extension.name + '.so'))
+               for lib in ('lib', os.path.join('lib', 'postgresql')))
+
+
+def build_key(binary_hash, extension, source=''):
+    return hash_inputs('extension', binary_hash, extension.name, extension.url or 'contrib', source)
+
+
+def make_commands(make, pg_config, jobs, destdir):
+    """Return the commands building and installing an extension with PGXS."""
+
+    variables = 'USE_PGXS=1 PG_CONFIG="%s"' % pg_config
+    return [
+        ('make', '%s -j%d %s' % (make, jobs, variables)),
+        ('make install', '%s %s DESTDIR="%s" install' % (make, variables, destdir)),
+    ]
+
+
+def create_sql(location, extensions):
+    """SQL creating the extensions which have a control file."""
+
+    return ''.join('CREATE EXTENSION IF NOT EXISTS "%s";\n' % extension.name.replace('"', '""')
+                   for extension in extensions if has_control_file(location, extension))
+
+
+def observability_settings(threshold):
+    """Settings of pg_stat_statements and auto_explain, as (name, value, why)."""
+
+    why = 'observability'
+    return [
+        ('pg_stat_statements.max', '10000', '%s: statements tracked' % why),
+        ('pg_stat_statements.track', 'all', '%s: include nested statements' % why),
+        ('track_io_timing', 'on', '%s: I/O time of the statements' % why),
+        ('auto_explain.log_min_duration', threshold, '%s: plans of the slow queries' % why),
+        ('auto_explain.log_analyze', 'on', '%s: actual rows and loops' % why),
+        ('auto_explain.log_buffers', 'on', '%s: buffer usage of the slow queries' % why),
+        ('auto_explain.log_timing', 'off', '%s: per-node timing costs too much' % why),
+        ('auto_explain.log_nested_statements', 'on', '%s: include functions' % why),
+    ]
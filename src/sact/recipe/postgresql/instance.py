@@ -0,0 +1,86 @@
+"""The PostgreSQL clusters managed by one part of the recipe.
+
+A part manages a single cluster by default, configured by the
+``postgresql.conf`` option. With the ``instances`` option, it manages several
+clusters sharing the same binaries: each one gets its own data directory,
+socket directory and port, derived from the base configuration, plus the
+settings of its ``postgresql.conf-<name>`` option.
+"""
+
+import os
+
+
+class Instance(object):
+    """One cluster of the part and the paths it lives in."""
+
+    def __init__(self, name, conf_text, pgconf, conf_dir, log_file, primary=None):
+        self.name = name
+        self.primary = primary
+        self.conf_text = conf_text
+        self.pgconf = pgconf
+        self.conf_dir = conf_dir
+        self.log_file = log_file
+
+        self.datadir = pgconf['data_directory'].strip("'")
+        self.socketdir = pgconf.get('unix_socket_directories',
+                                    pgconf.get('unix_socket_directory', '')).strip("'")
+        self.port = pgconf.get('port', '5432').strip("'")
+
+    @property
+    def label(self):
+        return self.name or 'main'
+
+    @property
+    def config_file(self):
+        return os.path.join(self.conf_dir, 'postgresql.conf')
+
+    def __repr__(self):
+        return '<Instance %s on port %s>' % (self.label, self.port)
+
+
+def instance_names(value):
+    """Parse the ``instances`` option.
+
+    It is either a number of instances, named ``1`` to ``N``, or a list of
+    names. An empty value means the single, unnamed, default instance.
+    """
+
+    value = value.strip()
+    if not value:
+        return [None]
+    if value.isdigit():
+        return [str(index) for index in range(1, int(value) + 1)]
+    return value.split()
+
+
+def instance_conf(base_text, base_pgconf, name, index, overrides='', datadir=None, socketdir=None):
+    """Return the postgresql.conf content of a named instance.
+
+    Settings appended at the end of the file win over the ones of the base
+    configuration: unless given, the data and socket directories get a
+    sub-directory named after the instance, and the port is incremented by
+    the instance index.
+    """
+
+    socket_key = 'unix_socket_directories'
+    if 'unix_socket_directory' in base_pgconf:
+        socket_key = 'unix_socket_directory'
+
+    base_socketdir = base_pgconf.get(socket_key, '').strip("'")
+    if datadir is None:
+        datadir = os.path.join(base_pgconf['data_directory'].strip("'"), name)
+    if socketdir is None and base_socketdir:
+        socketdir = os.path.join(base_socketdir, name)
+    port = int(base_pgconf.get('port', '5432').strip("'")) + index
+
+    lines = [base_text.rstrip('\n'),
+             '',
+             '# Instance %s' % name,
+             "data_directory = '%s'" % datadir,
+             'port = %d' % port]
+    if socketdir:
+        lines.append("%s = '%s'" % (socket_key, socketdir))
+    if overrides.strip():
+        lines.append(overrides.strip('\n'))
+
+    return '\n'.join(lines) + '\n'
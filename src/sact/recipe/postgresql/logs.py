@@ -0,0 +1,441 @@
+"""Streaming analysis of the CSV logs of a cluster.
+
+With the ``log-analysis`` option, the server writes CSV logs with the
+duration of the statements, the checkpoints, the temporary files, the lock
+waits and the autovacuum runs, and the recipe generates ``bin/<part>-logs``,
+which calls main() with the log directory of the first cluster.
+
+The analyzer reads the files one record at a time, so that its memory does
+not depend on their size: statements are reduced to fingerprints (their
+text without constants), and each fingerprint gets a histogram with fixed
+buckets. The position reached in each file is saved with the statistics in
+a state file, so that the next run only reads what the server logged since,
+including the files rotated in between; ``--follow`` keeps reading as the
+server writes.
+"""
+
+import csv
+import hashlib
+import json
+import optparse
+import os
+import re
+import sys
+import time
+
+
+# Upper bounds of the latency buckets, in milliseconds.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+           1000, 2500, 5000, 10000, 30000, 60000, float('inf'))
+
+# Fingerprints beyond this count are accounted as a single "other" entry.
+MAX_FINGERPRINTS = 5000
+MAX_TABLES = 1000
+OTHER = 'other'
+
+# Columns of the csvlog format (stable since PostgreSQL 9.0).
+DATABASE, MESSAGE, QUERY = 2, 13, 19
+
+DURATION = re.compile(r'^duration: ([\d.]+) ms\s+(statement|execute [^:]*|parse [^:]*|bind [^:]*):\s(.*)$',
+                      re.DOTALL)
+CHECKPOINT_START = re.compile(r'^(?:checkpoint|restartpoint) starting: (.*)$')
+CHECKPOINT_END = re.compile(r'^(?:checkpoint|restartpoint) complete: wrote (\d+) buffers.*?'
+                            r'write=([\d.]+) s, sync=([\d.]+) s, total=([\d.]+) s', re.DOTALL)
+TEMP_FILE = re.compile(r'^temporary file: path ".*", size (\d+)$')
+LOCK_WAIT = re.compile(r'^process \d+ (still waiting|acquired) .* after ([\d.]+) ms')
+AUTOVACUUM = re.compile(r'^automatic (vacuum|analyze) of table "([^"]*)".*?elapsed: ([\d.]+) s',
+                        re.DOTALL)
+
+# Constants of statements, replaced by ? in fingerprints.
+COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+STRINGS = re.compile(r"[eE]?'(?:[^']|'')*'")
+NUMBERS = re.compile(r'(?<![\w$."])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+PARAMETERS = re.compile(r'\$\d+')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+VALUES = re.compile(r'(values\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+', re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+
+SORT_KEYS = {
+    'total': lambda stat: stat['total'],
+    'calls': lambda stat: stat['calls'],
+    'mean': lambda stat: stat['total'] / stat['calls'] if stat['calls'] else 0,
+    'max': lambda stat: stat['max'],
+    'temp': lambda stat: stat['temp_bytes'],
+}
+
+
+def analysis_settings(min_duration):
+    """Settings logging what the analyzer reads, as (name, value, why)."""
+
+    why = 'log-analysis'
+    return [
+        ('logging_collector', 'on', '%s: write the logs to files' % why),
+        ('log_destination', 'csvlog', '%s: machine-readable logs' % why),
+        ('log_directory', 'log', '%s: in the data directory' % why),
+        ('log_min_duration_statement', min_duration, '%s: duration of the statements' % why),
+        ('log_lock_waits', 'on', '%s: lock waits longer than deadlock_timeout' % why),
+        ('log_checkpoints', 'on', '%s: checkpoint statistics' % why),
+        ('log_temp_files', '0', '%s: every temporary file' % why),
+        ('log_autovacuum_min_duration', '0', '%s: every autovacuum run' % why),
+    ]
+
+
+def fingerprint(query):
+    """Return the statement without its constants, normalized."""
+
+    text = COMMENTS.sub(' ', query)
+    text = STRINGS.sub('?', text)
+    text = PARAMETERS.sub('?', text)
+    text = NUMBERS.sub('?', text)
+    text = SPACES.sub(' ', text).strip().rstrip(';').strip()
+    text = LISTS.sub('(...)', text)
+    return VALUES.sub(r'\1', text)
+
+
+def bucket(duration):
+    for index, bound in enumerate(BUCKETS):
+        if duration <= bound:
+            return index
+    return len(BUCKETS) - 1
+
+
+def histogram_percentile(histogram, rank):
+    """Upper bound of the bucket holding the rank-th percentile."""
+
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = rank / 100.0 * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= threshold:
+            return BUCKETS[index]
+    return BUCKETS[-1]
+
+
+def _decode(data):
+    # The csv module of Python 2 only reads bytes.
+    if str is bytes:
+        return data
+    return data.decode('utf-8', 'replace')
+
+
+def read_records(fd):
+    """Yield the (offset after the record, fields) of the CSV records of fd.
+
+    fd is a file opened in binary mode. A record may span several lines
+    (statements with newlines); a record the server is still writing, at the
+    end of the file, is left for the next read.
+    """
+
+    offset = fd.tell()
+    pending = []
+    quotes = 0
+    while True:
+        line = fd.readline()
+        if not line.endswith(b'\n'):
+            # End of file, or a line the server is writing.
+            return
+        pending.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2:
+            # A quoted field goes on on the next line.
+            continue
+        offset += sum(len(part) for part in pending)
+        for fields in csv.reader([_decode(b''.join(pending))]):
+            yield offset, fields
+        pending = []
+        quotes = 0
+
+
+class Analyzer(object):
+    """Statistics of the log records fed to it, in bounded memory."""
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.statements = state.get('statements', {})
+        self.checkpoints = state.get('checkpoints', dict(count=0, reasons={}, buffers=0,
+                                                         write=0.0, sync=0.0, total=0.0, max=0.0))
+        self.temp_files = state.get('temp_files', dict(count=0, bytes=0, max=0))
+        self.locks = state.get('locks', dict(waits=0, acquired=0, wait_ms=0.0, max_ms=0.0,
+                                             deadlocks=0))
+        self.autovacuum = state.get('autovacuum', dict(vacuum=0, analyze=0, elapsed=0.0, tables={}))
+        self.records = state.get('records', 0)
+
+    def state(self):
+        return dict(statements=self.statements, checkpoints=self.checkpoints,
+                    temp_files=self.temp_files, locks=self.locks,
+                    autovacuum=self.autovacuum, records=self.records)
+
+    def _statement(self, query, database):
+        text = fingerprint(query)
+        data = '%s\0%s' % (database, text)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        key = hashlib.sha1(data).hexdigest()[:16]
+        stat = self.statements.get(key)
+        if stat is None:
+            if len(self.statements) >= MAX_FINGERPRINTS:
+                key, text, database = OTHER, '(other statements)', ''
+                stat = self.statements.get(key)
+            if stat is None:
+                stat = self.statements[key] = dict(query=text, database=database, calls=0,
+                                                   total=0.0, max=0.0,
+                                                   histogram=[0] * len(BUCKETS),
+                                                   temp_files=0, temp_bytes=0)
+        return stat
+
+    def feed(self, fields):
+        """Account one CSV log record."""
+
+        if len(fields) <= QUERY:
+            return
+        self.records += 1
+        message = fields[MESSAGE]
+
+        match = DURATION.match(message)
+        if match is not None:
+            # Extended protocol: the execute message accounts for the query.
+            if match.group(2).startswith(('parse', 'bind')):
+                return
+            duration = float(match.group(1))
+            stat = self._statement(match.group(3), fields[DATABASE])
+            stat['calls'] += 1
+            stat['total'] += duration
+            stat['max'] = max(stat['max'], duration)
+            stat['histogram'][bucket(duration)] += 1
+            return
+
+        match = TEMP_FILE.match(message)
+        if match is not None:
+            size = int(match.group(1))
+            self.temp_files['count'] += 1
+            self.temp_files['bytes'] += size
+            self.temp_files['max'] = max(self.temp_files['max'], size)
+            if fields[QUERY]:
+                stat = self._statement(fields[QUERY], fields[DATABASE])
+                stat['temp_files'] += 1
+                stat['temp_bytes'] += size
+            return
+
+        match = CHECKPOINT_START.match(message)
+        if match is not None:
+            for reason in match.group(1).split():
+                self.checkpoints['reasons'][reason] = self.checkpoints['reasons'].get(reason, 0) + 1
+            return
+
+        match = CHECKPOINT_END.match(message)
+        if match is not None:
+            total = float(match.group(4))
+            self.checkpoints['count'] += 1
+            self.checkpoints['buffers'] += int(match.group(1))
+            self.checkpoints['write'] += float(match.group(2))
+            self.checkpoints['sync'] += float(match.group(3))
+            self.checkpoints['total'] += total
+            self.checkpoints['max'] = max(self.checkpoints['max'], total)
+            return
+
+        match = LOCK_WAIT.match(message)
+        if match is not None:
+            waited = float(match.group(2))
+            if match.group(1) == 'acquired':
+                # The total wait is only known once the lock is acquired.
+                self.locks['acquired'] += 1
+                self.locks['wait_ms'] += waited
+            else:
+                self.locks['waits'] += 1
+            self.locks['max_ms'] = max(self.locks['max_ms'], waited)
+            return
+
+        if message.startswith('deadlock detected'):
+            self.locks['deadlocks'] += 1
+            return
+
+        match = AUTOVACUUM.match(message)
+        if match is not None:
+            kind, table, elapsed = match.group(1), match.group(2), float(match.group(3))
+            self.autovacuum[kind] += 1
+            self.autovacuum['elapsed'] += elapsed
+            tables = self.autovacuum['tables']
+            if table in tables or len(tables) < MAX_TABLES:
+                runs = tables.setdefault(table, [0, 0.0])
+                runs[0] += 1
+                runs[1] += elapsed
+
+    def top(self, sort='total', limit=10):
+        stats = [dict(stat, fingerprint=key) for key, stat in self.statements.items()
+                 if stat['calls'] or sort == 'temp']
+        return sorted(stats, key=SORT_KEYS[sort], reverse=True)[:limit]
+
+
+def log_files(directory):
+    """Return the CSV logs of directory, oldest first."""
+
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.csv')]
+    except OSError:
+        return []
+    paths = [os.path.join(directory, name) for name in names]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def read_new(analyzer, directory, positions):
+    """Feed analyzer with what was logged since positions, and update them.
+
+    positions maps the path of each log to its (inode, offset). A file
+    whose inode changed, or which shrank, is read from its start. Returns
+    the number of records read.
+    """
+
+    count = 0
+    for path in log_files(directory):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        inode, offset = positions.get(path, (None, 0))
+        if inode != stat.st_ino or stat.st_size < offset:
+            offset = 0
+        if stat.st_size == offset:
+            continue
+        with open(path, 'rb') as fd:
+            fd.seek(offset)
+            for offset, fields in read_records(fd):
+                analyzer.feed(fields)
+                count += 1
+        positions[path] = (stat.st_ino, offset)
+
+    # Forget the files the server removed.
+    for path in list(positions):
+        if not os.path.exists(path):
+            del positions[path]
+    return count
+
+
+def format_duration(value):
+    if value == float('inf'):
+        return 'inf'
+    if value >= 1000:
+        return '%gs' % (value / 1000.0)
+    return '%gms' % value
+
+
+def format_histogram(histogram):
+    """The non empty buckets of a histogram, as text."""
+
+    return '  '.join('<=%s:%d' % (format_duration(BUCKETS[index]), count)
+                     for index, count in enumerate(histogram) if count)
+
+
+def report(analyzer, sort='total', limit=10, width=80):
+    lines = ['%d records' % analyzer.records, '',
+             'Top %d statements by %s:' % (limit, sort)]
+    for stat in analyzer.top(sort, limit):
+        query = stat['query']
+        if len(query) > width:
+            query = query[:width - 3] + '...'
+        calls = stat['calls']
+        lines.append('  %s [%s] %s' % (stat['fingerprint'], stat['database'], query))
+        lines.append('    calls %d, total %.1fms, mean %.2fms, p50 <= %s, p95 <= %s, p99 <= %s, '
+                     'max %.1fms, temp %d files, %.1fMB' % (
+                         calls, stat['total'], stat['total'] / calls if calls else 0,
+                         format_duration(histogram_percentile(stat['histogram'], 50) or 0),
+                         format_duration(histogram_percentile(stat['histogram'], 95) or 0),
+                         format_duration(histogram_percentile(stat['histogram'], 99) or 0),
+                         stat['max'], stat['temp_files'], stat['temp_bytes'] / 1024.0 / 1024.0))
+        if calls:
+            lines.append('    %s' % format_histogram(stat['histogram']))
+
+    checkpoints = analyzer.checkpoints
+    lines.extend(['', 'Checkpoints: %d, %d buffers written, %.1fs total (max %.1fs, write %.1fs, '
+                  'sync %.1fs), started by %s' % (
+                      checkpoints['count'], checkpoints['buffers'], checkpoints['total'],
+                      checkpoints['max'], checkpoints['write'], checkpoints['sync'],
+                      ', '.join('%s: %d' % item for item in sorted(checkpoints['reasons'].items()))
+                      or 'nothing')])
+    temp = analyzer.temp_files
+    lines.append('Temporary files: %d, %.1fMB total, %.1fMB max' % (
+        temp['count'], temp['bytes'] / 1024.0 / 1024.0, temp['max'] / 1024.0 / 1024.0))
+    locks = analyzer.locks
+    lines.append('Lock waits: %d logged, %d acquired after %.1fms in total, longest %.1fms, '
+                 '%d deadlocks' % (locks['waits'], locks['acquired'], locks['wait_ms'],
+                                   locks['max_ms'], locks['deadlocks']))
+    autovacuum = analyzer.autovacuum
+    busiest = sorted(autovacuum['tables'].items(), key=lambda item: item[1][1], reverse=True)[:5]
+    lines.append('Autovacuum: %d vacuums, %d analyzes, %.1fs in total%s' % (
+        autovacuum['vacuum'], autovacuum['analyze'], autovacuum['elapsed'],
+        '; busiest: ' + ', '.join('%s (%d runs, %.1fs)' % (table, runs[0], runs[1])
+                                  for table, runs in busiest) if busiest else ''))
+    return '\n'.join(lines)
+
+
+def load_state(path):
+    try:
+        with open(path) as fd:
+            state = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}, {}
+    positions = dict((path, tuple(position)) for path, position in state.get('positions', {}).items())
+    return state.get('analysis', {}), positions
+
+
+def save_state(path, analyzer, positions):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as fd:
+        json.dump(dict(analysis=analyzer.state(), positions=positions), fd)
+    os.rename(path + '.tmp', path)
+
+
+def main(config, args=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-s', '--sort', default='total', choices=sorted(SORT_KEYS),
+                      help="ranking: %s [default: %%default]" % ', '.join(sorted(SORT_KEYS)))
+    parser.add_option('-n', '--limit', type='int', default=10,
+                      help="number of statements to show [default: %default]")
+    parser.add_option('-f', '--follow', action='store_true',
+                      help="keep reading the logs, printing a report every INTERVAL")
+    parser.add_option('-i', '--interval', type='float', default=60,
+                      help="seconds between reports with --follow [default: %default]")
+    parser.add_option('--state', default=config['state'],
+                      help="file keeping the positions and statistics [default: %default]")
+    parser.add_option('--reset', action='store_true',
+                      help="forget the state, and read the logs from their start")
+    parser.add_option('--json', action='store_true', help="print JSON")
+    options = parser.parse_args(args)[0]
+
+    analysis, positions = ({}, {}) if options.reset else load_state(options.state)
+    analyzer = Analyzer(analysis)
+
+    def output():
+        if options.json:
+            json.dump(dict(analyzer.state(), top=analyzer.top(options.sort, options.limit)),
+                      sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write('\n')
+        else:
+            print(report(analyzer, options.sort, options.limit))
+        sys.stdout.flush()
+
+    if not os.path.isdir(config['log_dir']):
+        print("No log directory %s: is log-analysis enabled?" % config['log_dir'])
+        return 1
+
+    read_new(analyzer, config['log_dir'], positions)
+    save_state(options.state, analyzer, positions)
+    output()
+    if not options.follow:
+        return 0
+
+    last_report = time.time()
+    try:
+        while True:
+            time.sleep(1)
+            if read_new(analyzer, config['log_dir'], positions):
+                save_state(options.state, analyzer, positions)
+            if time.time() - last_report >= options.interval:
+                output()
+                last_report = time.time()
+    except KeyboardInterrupt:
+        output()
+    return 0
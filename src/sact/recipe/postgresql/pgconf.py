@@ -0,0 +1,236 @@
+"""Parsing, validation and comparison of postgresql.conf files.
+
+The parser follows the grammar of the server (``guc-file.l``): a setting is
+``name [=] value`` where the value is a quoted string (with ``''`` or
+backslash escapes) or a bare word such as ``128MB``, optionally followed by
+a comment. Values are validated against the settings catalog, and compared
+with the ones of a running server once converted to the base unit of their
+setting, so that ``128MB`` and ``16384`` (8kB pages) are the same
+``shared_buffers``.
+
+Changes are then classified by the context of their setting: the server
+applies ``sighup``, ``superuser``, ``user`` and ``backend`` settings on
+reload, while ``postmaster`` settings need a restart.
+"""
+
+import re
+
+
+class ConfigError(ValueError):
+    """The configuration file is not valid."""
+
+
+LINE = re.compile(r"""^\s*
+    (?P<name>[A-Za-z_][\w$]*(?:\.[A-Za-z_][\w$]*)?)
+    \s*=?\s*
+    (?P<value>'(?:[^'\\\n]|\\.|'')*'|[^\s#']+)?
+    \s*(?:\#.*)?$""", re.VERBOSE)
+
+ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+NUMBER = re.compile(r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([A-Za-z]*)\s*$')
+
+# Units of the memory settings, in kB, and of the time settings, in ms.
+MEMORY_UNITS = {'B': 1.0 / 1024, 'kB': 1, 'MB': 1024, 'GB': 1024 ** 2, 'TB': 1024 ** 3}
+TIME_UNITS = {'us': 0.001, 'ms': 1, 's': 1000, 'min': 60000, 'h': 3600000, 'd': 86400000}
+
+TRUE_WORDS = ('on', 'true', 'yes', '1', 't', 'y')
+FALSE_WORDS = ('off', 'false', 'no', '0', 'f', 'n')
+
+INCLUDE_DIRECTIVES = ('include', 'include_dir', 'include_if_exists')
+
+# Contexts whose settings the server applies on reload.
+RELOAD_CONTEXTS = ('sighup', 'superuser', 'user', 'backend', 'superuser-backend')
+
+
+def unquote(value):
+    if not value.startswith("'"):
+        return value
+
+    chars = []
+    body = value[1:-1]
+    index = 0
+    while index < len(body):
+        char = body[index]
+        if char == "'":
+            # Doubled quote.
+            index += 1
+        elif char == '\\' and index + 1 < len(body):
+            index += 1
+            char = body[index]
+            if char in ESCAPES:
+                char = ESCAPES[char]
+            elif char in '01234567':
+                digits = re.match('[0-7]{1,3}', body[index:]).group(0)
+                char = chr(int(digits, 8))
+                index += len(digits) - 1
+        chars.append(char)
+        index += 1
+    return ''.join(chars)
+
+
+def parse(text):
+    """Parse the content of a postgresql.conf file.
+
+    Returns a list of (name, value, line number) in file order, names being
+    lower case (the server ignores their case). Include directives are
+    returned as any other entry. Raises ConfigError on syntax errors.
+    """
+
+    entries = []
+    for lineno, line in enumerate(text.split('\n'), 1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+
+        match = LINE.match(line)
+        if match is None or match.group('value') is None:
+            raise ConfigError("syntax error in postgresql.conf, line %d: %s" % (lineno, stripped))
+        entries.append((match.group('name').lower(), unquote(match.group('value')), lineno))
+    return entries
+
+
+def settings_dict(entries):
+    """Return the effective settings of parsed entries: the last one wins."""
+
+    return dict((name, value) for name, value, lineno in entries
+                if name not in INCLUDE_DIRECTIVES)
+
+
+def _unit_scale(unit):
+    """Return (family, factor) of a unit such as ``kB``, ``8kB`` or ``ms``."""
+
+    match = re.match(r'^(\d*)\s*([A-Za-z]+)$', unit or '')
+    if match is None:
+        return None, 1
+    count = int(match.group(1) or 1)
+    if match.group(2) in MEMORY_UNITS:
+        return 'memory', count * MEMORY_UNITS[match.group(2)]
+    if match.group(2) in TIME_UNITS:
+        return 'time', count * TIME_UNITS[match.group(2)]
+    return None, 1
+
+
+def normalize(value, vartype, unit=None):
+    """Convert value to the representation pg_settings uses.
+
+    Booleans become ``on`` or ``off``, numbers are converted to the unit of
+    their setting, enums are lower cased. Raises ConfigError for values the
+    server would reject.
+    """
+
+    if vartype == 'bool':
+        lower = value.strip().lower()
+        if lower in TRUE_WORDS:
+            return 'on'
+        if lower in FALSE_WORDS:
+            return 'off'
+        raise ConfigError("%r is not a boolean" % value)
+
+    if vartype in ('integer', 'real'):
+        match = NUMBER.match(value)
+        if match is None:
+            raise ConfigError("%r is not a number" % value)
+        number, value_unit = float(match.group(1)), match.group(2)
+        if value_unit:
+            family, factor = _unit_scale(value_unit)
+            if family is None:
+                raise ConfigError("invalid unit %r" % value_unit)
+            if unit is not None:
+                setting_family, setting_factor = _unit_scale(unit)
+                if setting_family != family:
+                    raise ConfigError("unit %r does not apply to this setting" % value_unit)
+                number = number * factor / setting_factor
+        if vartype == 'integer':
+            return int(round(number))
+        return number
+
+    if vartype == 'enum':
+        return value.strip().lower()
+
+    return value
+
+
+def validate(entries, catalog):
+    """Check parsed entries against catalog, a list of settings.Setting.
+
+    Returns a list of error messages. Settings with a dot in their name are
+    placeholders of extensions and are not checked.
+    """
+
+    known = dict((setting.name, setting) for setting in catalog)
+    errors = []
+    for name, value, lineno in entries:
+        if name in INCLUDE_DIRECTIVES or '.' in name:
+            continue
+        setting = known.get(name)
+        if setting is None:
+            errors.append("line %d: unknown setting %s" % (lineno, name))
+            continue
+
+        try:
+            normalized = normalize(value, setting.vartype, setting.unit)
+        except ConfigError as e:
+            errors.append("line %d: %s: %s" % (lineno, name, e))
+            continue
+
+        if setting.vartype in ('integer', 'real'):
+            # Without the unit of the setting, a value with a unit can not
+            # be compared with the bounds.
+            if setting.unit is None and NUMBER.match(value).group(2):
+                continue
+            for bound, outside in ((setting.min, lambda b: normalized < b),
+                                   (setting.max, lambda b: normalized > b)):
+                if bound is not None and outside(float(bound)):
+                    errors.append("line %d: %s = %s is out of range [%s, %s]" % (
+                        lineno, name, value, setting.min, setting.max))
+                    break
+        elif setting.vartype == 'enum' and setting.enumvals:
+            if normalized not in [val.lower() for val in setting.enumvals]:
+                errors.append("line %d: %s = %s is not one of %s" % (
+                    lineno, name, value, ', '.join(setting.enumvals)))
+    return errors
+
+
+def same_value(value, current, setting):
+    """Tell whether the file value equals the current one of the server."""
+
+    try:
+        new = normalize(value, setting.vartype, setting.unit)
+        old = normalize(current, setting.vartype, setting.unit)
+    except ConfigError:
+        return value == current
+    if setting.vartype == 'real':
+        return abs(new - old) <= 1e-9 * max(abs(new), abs(old), 1)
+    return new == old
+
+
+def diff(settings, running, from_file=()):
+    """Compare the settings of a file with the ones of a running server.
+
+    settings maps names to file values, running maps names to the
+    settings.Setting of the server, ``default`` holding the current value.
+    from_file lists the settings the server currently reads from its
+    configuration file: those missing from settings go back to their default.
+    Returns a list of (name, old value, new value, context), new being None
+    for a reset.
+    """
+
+    changes = []
+    for name, value in sorted(settings.items()):
+        setting = running.get(name)
+        if setting is None or '.' in name:
+            continue
+        if not same_value(value, setting.default, setting):
+            changes.append((name, setting.default, value, setting.context))
+
+    for name in sorted(from_file):
+        if name not in settings and name in running:
+            changes.append((name, running[name].default, None, running[name].context))
+    return changes
+
+
+def needs_restart(changes):
+    """Return the names of the changed settings only a restart applies."""
+
+    return [name for name, old, new, context in changes if context not in RELOAD_CONTEXTS]
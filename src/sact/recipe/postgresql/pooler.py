@@ -0,0 +1,157 @@
+"""Control script of the pgbouncer connection pooler of a part.
+
+The recipe generates ``bin/<part>-pgbouncer``, which calls main() with the
+paths of the pooler. ``start`` and ``restart`` only return once pgbouncer
+answers on its Unix socket.
+
+The recipe also builds the authentication files of the pooler from the
+declared roles with auth_file() and client_hba(), and the pg_hba.conf entries
+the pooler logs in to the cluster with from server_hba().
+"""
+
+import errno
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from sact.recipe.postgresql.readiness import NotReady, socket_path, wait_for_socket
+
+
+USAGE = "usage: %s start|stop|restart|reload|status"
+
+# Addresses of the TCP entries of the pooler hba file.
+ANY_ADDRESS = ('0.0.0.0/0', '::/0')
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def auth_file(roles):
+    """Return the content of the pgbouncer auth file for roles.
+
+    Passwords are written in clear text: pgbouncer needs them to log in to
+    servers storing SCRAM verifiers. The file must only be readable by its
+    owner.
+    """
+
+    return ''.join('%s %s\n' % (_quote(role.name), _quote(role.password or ''))
+                   for role in roles if role.login)
+
+
+def client_hba(roles, admin):
+    """Return the pgbouncer hba entries, as (type, user, address, method).
+
+    Roles with a password authenticate with it, on the socket and over TCP.
+    The admin, trusted on the socket of the cluster, is only trusted on the
+    socket of the pooler. Other roles without a password are not let in: the
+    cluster would not let the pooler log in as them.
+    """
+
+    entries = []
+    for role in roles:
+        if not role.login:
+            continue
+        if role.password is not None:
+            entries.append(('local', role.name, '', 'md5'))
+            entries.extend(('host', role.name, address, 'md5') for address in ANY_ADDRESS)
+        elif role.name == admin:
+            entries.append(('local', role.name, '', 'trust'))
+    return entries
+
+
+def server_hba(roles):
+    """Return the roles whose logins on the socket of the cluster check passwords.
+
+    pgbouncer logs in on the socket as the client role, but as its own Unix
+    user: the ident method of the other local entries would refuse it.
+    """
+
+    return [role.name for role in roles if role.login and role.password is not None]
+
+
+def read_pid(pidfile):
+    """Return the pid of the running pooler, or None."""
+
+    try:
+        with open(pidfile) as fd:
+            pid = int(fd.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            return None
+    return pid
+
+
+def start(config):
+    if read_pid(config['pidfile']) is not None:
+        print("pgbouncer is already running")
+        return 0
+
+    retcode = subprocess.call([config['binary'], '-d', config['ini']])
+    if retcode != 0:
+        return retcode
+
+    try:
+        wait_for_socket(socket_path(config['socketdir'], config['port']),
+                        config['user'], timeout=config['timeout'])
+    except NotReady as e:
+        print("pgbouncer did not start: %s" % e)
+        return 1
+    return 0
+
+
+def stop(config):
+    pid = read_pid(config['pidfile'])
+    if pid is None:
+        return 0
+
+    # SIGINT is the "safe shutdown": pgbouncer waits for the running queries.
+    os.kill(pid, signal.SIGINT)
+    deadline = time.time() + config['timeout']
+    while read_pid(config['pidfile']) is not None:
+        if time.time() > deadline:
+            print("pgbouncer did not stop")
+            return 1
+        time.sleep(0.05)
+    return 0
+
+
+def main(config, args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    if len(args) != 1:
+        print(USAGE % os.path.basename(sys.argv[0]))
+        return 2
+
+    command = args[0]
+    if command == 'start':
+        return start(config)
+    if command == 'stop':
+        return stop(config)
+    if command == 'restart':
+        return stop(config) or start(config)
+    if command == 'reload':
+        pid = read_pid(config['pidfile'])
+        if pid is None:
+            print("pgbouncer is not running")
+            return 1
+        os.kill(pid, signal.SIGHUP)
+        return 0
+    if command == 'status':
+        pid = read_pid(config['pidfile'])
+        if pid is None:
+            print("pgbouncer is not running")
+            return 3
+        print("pgbouncer is running (pid %d)" % pid)
+        return 0
+
+    print(USAGE % os.path.basename(sys.argv[0]))
+    return 2
@@ -0,0 +1,228 @@
+"""Detection of a PostgreSQL server being ready to accept connections.
+
+Instead of launching ``psql`` in a loop, we watch the ``postmaster.pid`` file
+of the cluster, which the postmaster updates with its status (``starting``,
+``ready``, ``standby``...) since PostgreSQL 10, and then confirm with a bare
+protocol handshake on the Unix socket. Changes of the pid file are noticed
+through inotify on Linux, and through polling with an exponential backoff
+elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import time
+
+
+# Lines of postmaster.pid, see src/include/miscadmin.h
+LOCK_FILE_LINE_PID = 0
+LOCK_FILE_LINE_DATA_DIR = 1
+LOCK_FILE_LINE_START_TIME = 2
+LOCK_FILE_LINE_PORT = 3
+LOCK_FILE_LINE_SOCKET_DIR = 4
+LOCK_FILE_LINE_LISTEN_ADDR = 5
+LOCK_FILE_LINE_SHMEM_KEY = 6
+LOCK_FILE_LINE_PM_STATUS = 7
+
+READY_STATUSES = ('ready', 'standby')
+
+PROTOCOL_VERSION = 196608  # 3.0
+CANNOT_CONNECT_NOW = b'57P03'
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class NotReady(Exception):
+    """The server did not become ready before the deadline."""
+
+
+def read_pid_file(datadir):
+    """Return the lines of postmaster.pid as a list, or None if missing."""
+
+    try:
+        with open(os.path.join(datadir, 'postmaster.pid')) as fd:
+            return fd.read().split('\n')
+    except (IOError, OSError):
+        return None
+
+
+def server_pid(datadir):
+    """Return the pid of the postmaster running on datadir, or None."""
+
+    lines = read_pid_file(datadir)
+    if not lines:
+        return None
+
+    try:
+        pid = int(lines[LOCK_FILE_LINE_PID])
+    except ValueError:
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            # Stale pid file, left by a crashed server.
+            return None
+    return pid
+
+
+def pid_file_status(datadir):
+    """Return the postmaster status from its pid file.
+
+    None means that there is no pid file, or that it does not contain a
+    status line yet, which is always the case before PostgreSQL 10.
+    """
+
+    lines = read_pid_file(datadir)
+    if lines and len(lines) > LOCK_FILE_LINE_PM_STATUS:
+        return lines[LOCK_FILE_LINE_PM_STATUS].strip() or None
+    return None
+
+
+def socket_path(socketdir, port):
+    # unix_socket_directories may hold a list; the first one is enough.
+    socketdir = socketdir.split(',')[0].strip()
+    return os.path.join(socketdir, '.s.PGSQL.%d' % int(port))
+
+
+def probe_socket(path, user, database='template1', timeout=1.0):
+    """Send a startup packet on a Unix socket and report readiness.
+
+    Returns True if the server accepts connections: it answered with an
+    authentication request, or with any error other than "the database system
+    is starting up". This costs one round trip and no backend query.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            return False
+
+        params = b''
+        for key, value in (('user', user), ('database', database)):
+            params += key.encode('utf-8') + b'\0' + value.encode('utf-8') + b'\0'
+        params += b'\0'
+        sock.sendall(struct.pack('!ii', 8 + len(params), PROTOCOL_VERSION) + params)
+
+        try:
+            response = sock.recv(4096)
+        except socket.error:
+            return False
+
+        if response[:1] == b'R':
+            try:
+                # Terminate message, to spare the server a log entry.
+                sock.sendall(b'X' + struct.pack('!i', 4))
+            except socket.error:
+                pass
+            return True
+
+        if response[:1] == b'E':
+            return b'C' + CANNOT_CONNECT_NOW not in response
+
+        return False
+    finally:
+        sock.close()
+
+
+class DirectoryWatcher(object):
+    """Wait for changes in a directory, with inotify if available."""
+
+    def __init__(self, path):
+        self.fd = None
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return
+
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, path.encode('utf-8'), mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout):
+        """Block until something changes in the directory, or timeout."""
+
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except OSError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def wait_until_ready(datadir, socketdir, port, user, timeout=60.0,
+                     initial_delay=0.01, max_delay=0.5, factor=2.0):
+    """Wait for the server running on datadir to accept connections.
+
+    Between two checks we wait for the pid file to change, at most for a delay
+    starting at initial_delay and multiplied by factor (up to max_delay) each
+    time nothing happens. Raises NotReady after timeout seconds.
+    """
+
+    deadline = time.time() + timeout
+    delay = initial_delay
+    path = socket_path(socketdir, port)
+    watcher = DirectoryWatcher(datadir)
+    try:
+        while True:
+            status = pid_file_status(datadir)
+            if status in READY_STATUSES or (status is None and os.path.exists(path)):
+                if probe_socket(path, user):
+                    return
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise NotReady("server status: %s" % (status or 'unknown'))
+
+            watcher.wait(min(delay, remaining))
+            delay = min(delay * factor, max_delay)
+    finally:
+        watcher.close()
+
+
+def wait_for_socket(path, user, timeout=60.0, initial_delay=0.01, max_delay=0.5, factor=2.0):
+    """Wait for a server (PostgreSQL or a pooler) to answer on a Unix socket.
+
+    Raises NotReady after timeout seconds.
+    """
+
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while not probe_socket(path, user):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise NotReady("nothing answers on %s" % path)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
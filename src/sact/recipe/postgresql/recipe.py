@@ -0,0 +1,1845 @@
+import zc.buildout
+import logging
+import subprocess
+import os
+import sys
+import platform
+import shutil
+import time
+import tempfile
+import textwrap
+import json
+import threading
+
+from sact.recipe.postgresql import autotune
+from sact.recipe.postgresql import backup
+from sact.recipe.postgresql import bench
+from sact.recipe.postgresql import bundle
+from sact.recipe.postgresql import download
+from sact.recipe.postgresql import extensions
+from sact.recipe.postgresql import logs
+from sact.recipe.postgresql import pgconf
+from sact.recipe.postgresql import pooler
+from sact.recipe.postgresql import ephemeral
+from sact.recipe.postgresql.cache import CacheDirectory, copy_tree, hash_file, hash_inputs, parse_size
+from sact.recipe.postgresql.cluster import create_cluster, initdb_arguments
+from sact.recipe.postgresql.instance import Instance, instance_conf, instance_names
+from sact.recipe.postgresql.readiness import NotReady, server_pid, wait_until_ready
+from sact.recipe.postgresql import replication
+from sact.recipe.postgresql import seeding
+from sact.recipe.postgresql.roles import Role, parse_roles, provisioning_sql
+from sact.recipe.postgresql.settings import Setting, load_catalog
+from sact.recipe.postgresql.system import available_cpus
+from sact.recipe.postgresql.timing import Timings
+
+
+TRUE_VALUES = ('yes', 'true', '1', 'on')
+
+if sys.version_info[0] >= 3:
+    def _reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+else:
+    # The three arguments raise is a syntax error on Python 3.
+    exec("def _reraise(exc_info):\n    raise exc_info[0], exc_info[1], exc_info[2]\n")
+
+# Derived settings which are merged with the value of postgresql.conf, instead
+# of giving way to it.
+MERGED_SETTINGS = ('shared_preload_libraries',)
+
+
+current_dir = os.path.dirname(__file__)
+
+
+class Recipe:
+    """zc.buildout recipe for Postgresql"""
+
+    def __init__(self, buildout, name, options):
+        self.options = options
+        self.buildout = buildout
+        self.name = name
+        self.log = logging.getLogger(self.name)
+        self._derived = {}
+        self._downloaded_sources = {}
+        self.instances = []
+        self.replicas = []
+
+        self.options['location'] = os.path.join(buildout['buildout']['parts-directory'], self.name)
+        self.options['bin-dir'] = os.path.join(self.options['location'], "bin")
+
+        self.options['admin'] = options.get("admin", "postgres")
+        self.options['superusers'] = options.get("superusers", "root")
+        self.options['users'] = options.get("users", "")
+        self.options['roles'] = options.get("roles", "")
+        self.options['url'] = options.get("url", "")
+        self.options['url-bin'] = options.get("url-bin", "")
+        self.options['url-bin-sha256'] = options.get("url-bin-sha256", "")
+        self.options['download-chunks'] = options.get("download-chunks", "1")
+        self.options['download-timeout'] = options.get("download-timeout", "30")
+        self.options['prefetch'] = options.get("prefetch", "true")
+        self.options['conf-dir'] = options.get("conf-dir", self.options['location'])
+        self.options['postgresql.conf'] = options.get('postgresql.conf', "")
+        self.options['verbose-conf'] = options.get('verbose-conf', "")
+        self.options['config-apply'] = options.get('config-apply', "auto")
+        self.options['extensions'] = options.get('extensions', "")
+        self.options['extension-databases'] = options.get('extension-databases', "template1")
+        self.options['databases'] = options.get('databases', "")
+        self.options['connection-file'] = options.get('connection-file', os.path.join(
+            self.options['location'], 'connection.json'))
+        self.options['observability'] = options.get('observability', "false")
+        self.options['slow-query-threshold'] = options.get('slow-query-threshold', "500ms")
+        self.options['log-analysis'] = options.get('log-analysis', "false")
+        self.options['log-min-duration'] = options.get('log-min-duration', "0")
+        self.options['autotune'] = options.get('autotune', "")
+        self.options['instances'] = options.get('instances', "")
+        self.options['replicas'] = options.get('replicas', "")
+        self.options['replication'] = options.get('replication', "async")
+        self.options['replication-user'] = options.get('replication-user', "replicator")
+        self.options['pgbouncer'] = options.get('pgbouncer', "false")
+        self.options['pgbouncer-binary'] = options.get('pgbouncer-binary', "pgbouncer")
+        self.options['pgbouncer-listen'] = options.get('pgbouncer-listen', "127.0.0.1")
+        self.options['pgbouncer-port'] = options.get('pgbouncer-port', "6432")
+        self.options['pool-mode'] = options.get('pool-mode', "transaction")
+        self.options['pool-size'] = options.get('pool-size', "20")
+        self.options['max-client-conn'] = options.get('max-client-conn', "1000")
+        self.options['bench-workloads'] = options.get('bench-workloads', "select-only tpcb-like")
+        self.options['bench-clients'] = options.get('bench-clients', "1 4 16")
+        self.options['bench-duration'] = options.get('bench-duration', "30")
+        self.options['bench-scale'] = options.get('bench-scale', "10")
+        self.options['bench-database'] = options.get('bench-database', "pgbench")
+        self.options['bench-threshold'] = options.get('bench-threshold', "0.05")
+        self.options['bench-results'] = options.get('bench-results', os.path.join(
+            buildout['buildout']['directory'], 'var', 'bench', self.name))
+        self.options['backup-dir'] = options.get('backup-dir', os.path.join(
+            buildout['buildout']['directory'], 'var', 'backups', self.name))
+        self.options['backup-databases'] = options.get('backup-databases', "")
+        self.options['backup-jobs'] = options.get('backup-jobs', "auto")
+        self.options['backup-compression'] = options.get('backup-compression', "")
+        self.options['wal-archive'] = options.get('wal-archive', "")
+        self.options['ephemeral'] = options.get('ephemeral', "false")
+        self.options['ephemeral-dir'] = options.get('ephemeral-dir', ephemeral.default_directory(
+            self.name, self.options['location']))
+        self.options['ephemeral-size'] = options.get('ephemeral-size', "")
+        self.options['timings-file'] = options.get('timings-file', os.path.join(
+            buildout['buildout']['directory'], 'var', 'log', '%s-timings.jsonl' % self.name))
+        self.options['startup-timeout'] = options.get('startup-timeout', "60")
+        self.options['startup-poll-interval'] = options.get('startup-poll-interval', "0.01")
+        self.options['startup-poll-max'] = options.get('startup-poll-max', "0.5")
+        self.options['build-cache'] = options.get('build-cache', self._default_cache_dir('builds'))
+        self.options['build-cache-size'] = options.get('build-cache-size', "")
+        self.options['build-cache-link'] = options.get('build-cache-link', "true")
+        self.options['build-mode'] = options.get('build-mode', "cmmi")
+        self.options['build-jobs'] = options.get('build-jobs', "auto")
+        self.options['build-contrib'] = options.get('build-contrib', "true")
+        self.options['ccache'] = options.get('ccache', "false")
+        self.options['bundle-dir'] = options.get('bundle-dir', "")
+        self.options['bundle-strip'] = options.get('bundle-strip', "true")
+        self.options['cluster-cache'] = options.get('cluster-cache', self._default_cache_dir('clusters') or
+                                                    self.options['location'] + '__clusters__')
+        self.options['settings-cache'] = options.get('settings-cache', self._default_cache_dir('settings') or
+                                                     self.options['location'] + '__settings__')
+        self.options['ccache-dir'] = options.get('ccache-dir', self._default_cache_dir('ccache') or
+                                                 self.options['location'] + '__ccache__')
+        self.options['archive-cache'] = options.get('archive-cache', self._default_cache_dir('archives') or
+                                                    self.options['location'] + '__archives__')
+
+        self.timings = Timings(self.options['timings-file'], self.name, log=self.log)
+
+        # Download the archive while buildout installs the parts before this one.
+        self._prefetch = None
+        if self.options['prefetch'].lower() in TRUE_VALUES:
+            self._prefetch = threading.Thread(target=self._prefetch_archive)
+            self._prefetch.daemon = True
+            self._prefetch.start()
+
+    def _default_cache_dir(self, kind):
+        """Shared caches live next to the buildout download cache, if any."""
+
+        download_cache = self.buildout['buildout'].get('download-cache', '')
+        if not download_cache:
+            return ""
+        return os.path.join(download_cache, 'sact.recipe.postgresql', kind)
+
+    def install(self):
+        try:
+            with self.timings.phase('install'):
+                self._join_prefetch()
+                scripts = self._execute(self._plan({}))
+        finally:
+            self._log_timings()
+        return [self.options['location']] + scripts
+
+    def update(self):
+        """Only run the steps whose inputs changed since the last run.
+
+        Returns the paths the steps created, buildout adds them to the ones
+        of the previous runs.
+        """
+
+        try:
+            with self.timings.phase('update'):
+                self._join_prefetch()
+                with self.timings.phase('plan'):
+                    plan = self._plan(self._read_fingerprint())
+                if not plan:
+                    self.log.info('PostgreSQL is up to date')
+                    return None
+                scripts = self._execute(plan)
+        finally:
+            self._log_timings()
+        return [self.options['location']] + scripts
+
+    def _prefetch_archive(self):
+        """Download the archive of ``url`` or ``url-bin`` ahead of install().
+
+        Runs on the thread started by __init__. The source archive goes to the
+        buildout download cache, under the name hexagonit.recipe.cmmi and
+        hexagonit.recipe.download look it up with; the binary archive goes to
+        the archive cache. Errors are only logged: install() downloads the
+        archive again, and reports them.
+        """
+
+        buildout = self.buildout['buildout']
+        if os.path.exists(os.path.join(self.options['bin-dir'], 'postgres')) or \
+                buildout.get('offline', 'false').lower() in TRUE_VALUES:
+            return
+
+        try:
+            with self.timings.phase('prefetch'):
+                if self.options['url-bin']:
+                    self._fetch_binaries()
+                elif self.options['url'] and buildout.get('download-cache'):
+                    if self.options['build-cache'] and \
+                            CacheDirectory(self.options['build-cache']).lookup(self._build_key()):
+                        return
+                    import zc.buildout.download
+                    self.log.info('Prefetching %s', self.options['url'])
+                    download = zc.buildout.download.Download(buildout, hash_name=True)
+                    download(self.options['url'], md5sum=self.options.get('md5sum'))
+        except Exception as e:
+            self.log.warning('Unable to prefetch the PostgreSQL archive: %s', e)
+
+    def _join_prefetch(self):
+        if self._prefetch is not None:
+            with self.timings.phase('prefetch wait'):
+                self._prefetch.join()
+            self._prefetch = None
+
+    def _log_timings(self):
+        summary = self.timings.summary()
+        if summary:
+            self.log.info('Timings of %s:\n%s', self.name, summary)
+
+    def _execute(self, plan):
+        """Run the steps of plan, returning the paths of the created scripts."""
+
+        self.log.info('Running steps: %s', ', '.join(plan))
+
+        phase = self.timings.phase
+        # Servers already running are reconfigured in place, and left running.
+        running = [instance for instance in self.instances + self.replicas
+                   if server_pid(instance.datadir) is not None]
+
+        if 'binaries' in plan:
+            self.log.info('No Postgresql found')
+            with phase('binaries'):
+                if self.options['url-bin']:
+                    self._install_compiled_pg()
+                else:
+                    self._install_cmmi_pg()
+                    if self.options['bundle-dir']:
+                        with phase('bundle'):
+                            self._export_bundle()
+
+        if 'extensions' in plan:
+            with phase('extensions'):
+                self._install_extensions()
+
+        if 'cluster' in plan:
+            def create(instance):
+                with phase('cluster %s' % instance.label):
+                    self._create_cluster(instance)
+            self._parallel(create, self.instances)
+
+        scripts = []
+        if 'config' in plan:
+            with phase('config'):
+                verbose = [self._make_pg_config(instance) for instance in self.instances
+                           if instance.primary is None]
+                if all(verbose):
+                    # The defaults were read from the binaries, no need for a server.
+                    plan = [step for step in plan if step != 'verbose-conf']
+                elif self._is_ephemeral() and 'verbose-conf' in plan:
+                    self.log.warning("Ephemeral mode: the defaults can not be read from "
+                                     "the binaries, skipping verbose-conf")
+                    plan = [step for step in plan if step != 'verbose-conf']
+                scripts = self._install_scripts()
+                self._write_connection_info()
+
+            for instance in running:
+                if instance.primary is None:
+                    with phase('apply %s' % instance.label):
+                        self._apply_pg_config(instance)
+
+        if self.options['pgbouncer'].lower() in TRUE_VALUES and \
+                ('config' in plan or 'roles' in plan):
+            with phase('pooler'):
+                self._make_pooler_config()
+
+        if set(plan) & set(['roles', 'extensions', 'databases', 'verbose-conf', 'replicas']):
+            started = []
+
+            def start(instance):
+                if instance in running:
+                    return
+                with phase('start %s' % instance.label):
+                    self._pg_ctl(instance, 'start')
+                    started.append(instance)
+                    self._wait_for_startup(instance)
+
+            def prepare(instance):
+                start(instance)
+
+                if 'roles' in plan:
+                    with phase('roles %s' % instance.label):
+                        self._provision_roles(instance)
+
+                if 'extensions' in plan:
+                    with phase('create extensions %s' % instance.label):
+                        self._create_extensions(instance)
+
+                if 'databases' in plan:
+                    with phase('databases %s' % instance.label):
+                        self._seed_databases(instance)
+
+                if 'verbose-conf' in plan:
+                    with phase('verbose-conf %s' % instance.label):
+                        self._update_pg_config(instance)
+
+            def seed(replica):
+                with phase('seed %s' % replica.label):
+                    self._create_replica(replica)
+                    self._make_pg_config(replica)
+                start(replica)
+
+            def stop(instance):
+                with phase('stop %s' % instance.label):
+                    self._pg_ctl(instance, 'stop')
+
+            try:
+                self._parallel(prepare, self.instances)
+                if 'replicas' in plan:
+                    self._parallel(seed, self.replicas)
+                    with phase('catchup'):
+                        self._wait_for_catchup(self.instances[0], self.replicas)
+            finally:
+                # Replicas first, a primary waits for its replicas on shutdown.
+                replicas = [instance for instance in started if instance.primary is not None]
+                self._parallel(stop, replicas)
+                self._parallel(stop, [instance for instance in started if instance not in replicas])
+
+        with phase('fingerprint'):
+            self._write_fingerprint(self._fingerprint(self._read_fingerprint()))
+        return scripts
+
+    def _parallel(self, func, instances):
+        """Call func for each instance, concurrently if there are several.
+
+        At most one thread per available CPU runs at the same time. The first
+        exception raised by func, if any, is raised again with its traceback
+        once every call finished.
+        """
+
+        instances = list(instances)
+        if len(instances) <= 1:
+            for instance in instances:
+                func(instance)
+            return
+
+        slots = threading.BoundedSemaphore(available_cpus())
+        errors = []
+
+        def run(instance):
+            with slots:
+                try:
+                    func(instance)
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=run, args=(instance,)) for instance in instances]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            _reraise(errors[0])
+
+    def _fingerprint_path(self):
+        return os.path.join(self.options['location'], '.sact-recipe-postgresql.json')
+
+    def _read_fingerprint(self):
+        try:
+            with open(self._fingerprint_path()) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_fingerprint(self, fingerprint):
+        path = self._fingerprint_path()
+        with open(path + '.tmp', 'w') as fd:
+            json.dump(fingerprint, fd, indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def _binary_hash(self, previous):
+        """Return the hash of the postgres binary and its stat signature.
+
+        The binary is only hashed again when its size, mtime or inode changed
+        since the previous fingerprint. Returns (None, None) if PostgreSQL is
+        not installed.
+        """
+
+        postgres = os.path.join(self.options['bin-dir'], 'postgres')
+        try:
+            stat = os.stat(postgres)
+        except OSError:
+            return None, None
+
+        binary_stat = [stat.st_size, stat.st_mtime, stat.st_ino]
+        if previous.get('binary-stat') == binary_stat and previous.get('binaries'):
+            return previous['binaries'], binary_stat
+        return hash_file(postgres), binary_stat
+
+    def _fingerprint(self, previous):
+        """Hash the effective inputs of the recipe."""
+
+        binaries, binary_stat = self._binary_hash(previous)
+        databases, seed_stat = self._database_hashes(previous)
+
+        templates_dir = os.path.join(current_dir, 'templates')
+        templates = hash_inputs(*[open(os.path.join(templates_dir, name)).read()
+                                  for name in sorted(os.listdir(templates_dir))])
+
+        return {
+            'options': hash_inputs(*['%s=%s' % item for item in sorted(self.options.items())]),
+            'templates': templates,
+            'binaries': binaries,
+            'binary-stat': binary_stat,
+            'roles': hash_inputs(repr([sorted(vars(role).items())
+                                       for role in self._roles()])),
+            'extensions': hash_inputs(repr([sorted(vars(extension).items())
+                                            for extension in self._extensions()]),
+                                      ' '.join(self.options['extension-databases'].split())),
+            'databases': databases,
+            'seed-stat': seed_stat,
+            'derived': hash_inputs(repr([self._derived_settings(instance)
+                                         for instance in self.instances + self.replicas])),
+        }
+
+    def _plan(self, previous):
+        """Return the list of the steps to run to bring the part up to date.
+
+        The steps are, in order: ``binaries``, ``cluster``, ``config``,
+        ``roles``, ``extensions``, ``databases``, ``verbose-conf`` and
+        ``replicas``. An empty
+        plan means that nothing changed since the fingerprint previous was
+        taken.
+        """
+
+        self.instances = self._instances()
+        self.replicas = self._replicas()
+        if self._is_ephemeral():
+            self._check_ephemeral()
+
+        current = self._fingerprint(previous)
+        changed = set(key for key in ('options', 'templates', 'binaries', 'roles', 'extensions',
+                                      'databases', 'derived')
+                      if previous.get(key) != current[key])
+        plan = []
+
+        if current['binaries'] is None:
+            plan.append('binaries')
+
+        if not all(os.path.exists(instance.datadir) for instance in self.instances):
+            plan.append('cluster')
+
+        conf_files = [os.path.join(instance.conf_dir, name)
+                      for instance in self.instances
+                      for name in ('postgresql.conf', 'pg_hba.conf')]
+        if plan or changed & set(['options', 'templates', 'binaries', 'derived']) or \
+                not all(os.path.exists(path) for path in conf_files):
+            plan.append('config')
+
+        if 'cluster' in plan or changed & set(['roles', 'binaries']):
+            plan.append('roles')
+
+        if self._extensions() and \
+                ('cluster' in plan or changed & set(['extensions', 'binaries'])):
+            plan.append('extensions')
+
+        if current['databases'] and ('cluster' in plan or 'databases' in changed):
+            plan.append('databases')
+
+        if 'config' in plan and self.options['verbose-conf']:
+            plan.append('verbose-conf')
+
+        if self.replicas and ('config' in plan or 'roles' in plan or
+                              not all(os.path.exists(replica.datadir) for replica in self.replicas)):
+            plan.append('replicas')
+
+        return plan
+
+    def _parse_pg_conf(self, text):
+        # Read the postgreSQL configuration from the Buildout recipe.
+        # Extract data_directory and unix_socket_{directory|directories}
+
+        try:
+            parsed_conf = pgconf.settings_dict(pgconf.parse(text))
+        except pgconf.ConfigError as e:
+            raise zc.buildout.UserError(str(e))
+
+        datadir = parsed_conf.get('data_directory')
+        socketdir = parsed_conf.get('unix_socket_directories',
+                                    parsed_conf.get('unix_socket_directory'))
+
+        if datadir is None:
+            self.log.error('data_directory option in postgresql.conf not found')
+            sys.exit(1)
+
+        if datadir is None and socketdir is None:
+            self.log.error('unix_socket_directory (PG < 9.0) or unix_socket_directories (PG 9+) option not found')
+            sys.exit(1)
+
+        return parsed_conf
+
+    def _is_ephemeral(self):
+        return self.options['ephemeral'].lower() in TRUE_VALUES
+
+    def _ephemeral_conf(self, text):
+        """Put the data and socket directories in ephemeral-dir, unless set."""
+
+        try:
+            names = set(pgconf.settings_dict(pgconf.parse(text)))
+        except pgconf.ConfigError as e:
+            raise zc.buildout.UserError(str(e))
+        lines = [text.rstrip('\n')]
+        if 'data_directory' not in names:
+            lines.append("data_directory = '%s'" % os.path.join(self.options['ephemeral-dir'], 'data'))
+        if not names & set(['unix_socket_directories', 'unix_socket_directory']):
+            lines.append("unix_socket_directories = '%s'" % os.path.join(self.options['ephemeral-dir'],
+                                                                         'run'))
+        return '\n'.join(lines).lstrip('\n') + '\n'
+
+    def _check_ephemeral(self):
+        """Refuse to turn durability off for clusters on persistent storage."""
+
+        try:
+            size = parse_size(self.options['ephemeral-size'])
+            for instance in self.instances + self.replicas:
+                ephemeral.check_volatile(instance.datadir)
+            if size and not all(os.path.exists(instance.datadir)
+                                for instance in self.instances + self.replicas):
+                ephemeral.check_room(self.instances[0].datadir,
+                                     size * len(self.instances + self.replicas))
+        except ValueError as e:
+            raise zc.buildout.UserError(str(e))
+
+    def _instances(self):
+        """Build the instances of the part from the options."""
+
+        base_text = self.options['postgresql.conf']
+        if self._is_ephemeral():
+            base_text = self._ephemeral_conf(base_text)
+        base_pgconf = self._parse_pg_conf(base_text)
+
+        instances = []
+        for index, name in enumerate(instance_names(self.options['instances'])):
+            if name is None:
+                instances.append(Instance(None, base_text, base_pgconf,
+                                          self.options['conf-dir'],
+                                          os.path.join(self.options['location'], 'postgresql.log')))
+                continue
+
+            text = instance_conf(base_text, base_pgconf, name, index,
+                                 self.options.get('postgresql.conf-%s' % name, ''))
+            instances.append(Instance(name, text, self._parse_pg_conf(text),
+                                      os.path.join(self.options['conf-dir'], name),
+                                      os.path.join(self.options['location'], 'postgresql-%s.log' % name)))
+
+        return instances
+
+    def _replicas(self):
+        """Build the replicas of the first instance from the options."""
+
+        names = replication.replica_names(self.options['replicas'])
+        if not names:
+            return []
+
+        primary = self.instances[0]
+        replicas = []
+        for index, name in enumerate(names):
+            text = instance_conf(primary.conf_text, primary.pgconf, name,
+                                 len(self.instances) + index,
+                                 self.options.get('postgresql.conf-%s' % name, ''),
+                                 datadir='%s-%s' % (primary.datadir, name),
+                                 socketdir=primary.socketdir)
+            replicas.append(Instance(name, text, self._parse_pg_conf(text),
+                                     os.path.join(self.options['conf-dir'], name),
+                                     os.path.join(self.options['location'], 'postgresql-%s.log' % name),
+                                     primary=primary))
+        return replicas
+
+    def _roles(self):
+        """Return the roles to provision, including the replication one."""
+
+        roles = parse_roles(self.options)
+        if self.options['replicas'].strip() not in ('', '0'):
+            roles.append(Role(self.options['replication-user'], replication=True))
+        return roles
+
+    def _install_scripts(self):
+        """Create a bin/<part>[-<instance>]-ctl script for each instance.
+
+        The scripts know the data directory, configuration file and socket
+        of their instance, e.g. ``bin/pg-ctl start``.
+        """
+
+        paths = []
+        for instance in self.instances + self.replicas:
+            if instance.name is None:
+                name = '%s-ctl' % self.name
+            else:
+                name = '%s-%s-ctl' % (self.name, instance.name)
+
+            paths.extend(self._python_script(name, 'sact.recipe.postgresql.ctl',
+                                             dict(bin_dir=self.options['bin-dir'],
+                                                  datadir=instance.datadir,
+                                                  config_file=instance.config_file,
+                                                  log_file=instance.log_file,
+                                                  socketdir=instance.socketdir,
+                                                  port=int(instance.port),
+                                                  user=self.options['admin'],
+                                                  timeout=float(self.options['startup-timeout']),
+                                                  poll_interval=float(self.options['startup-poll-interval']),
+                                                  poll_max=float(self.options['startup-poll-max']))))
+
+        if self.options['pgbouncer'].lower() in TRUE_VALUES:
+            conf_dir = self.options['conf-dir']
+            paths.extend(self._python_script('%s-pgbouncer' % self.name,
+                                             'sact.recipe.postgresql.pooler',
+                                             dict(binary=self.options['pgbouncer-binary'],
+                                                  ini=os.path.join(conf_dir, 'pgbouncer.ini'),
+                                                  pidfile=os.path.join(self.options['location'],
+                                                                       'pgbouncer.pid'),
+                                                  socketdir=self.instances[0].socketdir,
+                                                  port=int(self.options['pgbouncer-port']),
+                                                  user=self.options['admin'],
+                                                  timeout=float(self.options['startup-timeout']))))
+
+        primary = self.instances[0]
+        if self._is_observable():
+            paths.extend(self._python_script('%s-top' % self.name,
+                                             'sact.recipe.postgresql.top',
+                                             dict(bin_dir=self.options['bin-dir'],
+                                                  socketdir=primary.socketdir,
+                                                  port=int(primary.port),
+                                                  user=self.options['admin'],
+                                                  database=self.options['extension-databases'].split()[0])))
+
+        if self.options['log-analysis'].lower() in TRUE_VALUES:
+            log_dir = primary.pgconf.get('log_directory', 'log').strip("'")
+            paths.extend(self._python_script('%s-logs' % self.name,
+                                             'sact.recipe.postgresql.logs',
+                                             dict(log_dir=os.path.join(primary.datadir, log_dir),
+                                                  state=os.path.join(
+                                                      self.buildout['buildout']['directory'], 'var',
+                                                      'log', '%s-log-analysis.json' % self.name))))
+
+        results = self.options['bench-results']
+        paths.extend(self._python_script('%s-bench' % self.name,
+                                         'sact.recipe.postgresql.bench',
+                                         dict(bin_dir=self.options['bin-dir'],
+                                              datadir=primary.datadir,
+                                              socketdir=primary.socketdir,
+                                              port=int(primary.port),
+                                              user=self.options['admin'],
+                                              database=self.options['bench-database'],
+                                              scale=int(self.options['bench-scale']),
+                                              workloads=self._bench_workloads(),
+                                              clients=[int(clients) for clients in
+                                                       self.options['bench-clients'].split()],
+                                              duration=int(self.options['bench-duration']),
+                                              threshold=float(self.options['bench-threshold']),
+                                              results=results,
+                                              baseline=os.path.join(results, 'baseline.json'))))
+
+        backup_config = dict(bin_dir=self.options['bin-dir'],
+                             datadir=primary.datadir,
+                             config_file=primary.config_file,
+                             log_file=primary.log_file,
+                             socketdir=primary.socketdir,
+                             port=int(primary.port),
+                             user=self.options['admin'],
+                             timeout=float(self.options['startup-timeout']),
+                             poll_interval=float(self.options['startup-poll-interval']),
+                             poll_max=float(self.options['startup-poll-max']),
+                             initdb_args=initdb_arguments(self.options),
+                             cluster_cache=self.options['cluster-cache'],
+                             directory=self.options['backup-dir'],
+                             databases=self.options['backup-databases'].split(),
+                             jobs=0 if self.options['backup-jobs'] == 'auto' else int(self.options['backup-jobs']),
+                             compression=self.options['backup-compression'] or None)
+        for command in ('backup', 'restore'):
+            paths.extend(self._python_script('%s-%s' % (self.name, command),
+                                             'sact.recipe.postgresql.backup',
+                                             backup_config, '%s_main' % command))
+
+        return paths
+
+    def _write_connection_info(self):
+        """Write how to reach the first instance, for sact.recipe.postgresql.testdb."""
+
+        primary = self.instances[0]
+        info = dict(bin_dir=self.options['bin-dir'],
+                    host=primary.socketdir,
+                    port=int(primary.port),
+                    user=self.options['admin'],
+                    database='postgres',
+                    templates=[database.name for database in self._databases()
+                               if database.template])
+        path = self.options['connection-file']
+        with open(path + '.tmp', 'w') as fd:
+            json.dump(info, fd, indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def _python_script(self, name, module, config, function='main'):
+        """Generate bin/<name>, calling module.<function>(config).
+
+        The script runs with the Python of buildout, and with this package and
+        its dependencies on its path.
+        """
+
+        import zc.buildout.easy_install
+
+        buildout = self.buildout['buildout']
+        working_set = zc.buildout.easy_install.working_set(
+            ['sact.recipe.postgresql'], sys.executable,
+            [buildout['develop-eggs-directory'], buildout['eggs-directory']])
+        return zc.buildout.easy_install.scripts([(name, module, function)],
+                                                working_set, sys.executable,
+                                                buildout['bin-directory'],
+                                                arguments=repr(config))
+
+    def _bench_workloads(self):
+        """Return the bench workloads, custom scripts relative to the buildout."""
+
+        directory = self.buildout['buildout']['directory']
+        return [workload if workload in bench.BUILTIN_WORKLOADS else os.path.join(directory, workload)
+                for workload in self.options['bench-workloads'].split()]
+
+    def _make_pooler_config(self):
+        """Write pgbouncer.ini and its auth files next to pg_hba.conf.
+
+        The pooler fronts the first instance; see pooler.client_hba() for
+        the roles it lets in.
+        """
+
+        from jinja2 import Template
+
+        self.log.info("Creating pgbouncer configuration")
+        conf_dir = self.options['conf-dir']
+        primary = self.instances[0]
+
+        roles = [Role(self.options['admin'])] + self._roles()
+        auth_file = os.path.join(conf_dir, 'userlist.txt')
+        # Create it private, it holds the passwords.
+        with os.fdopen(os.open(auth_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fd:
+            fd.write(pooler.auth_file(roles))
+        os.chmod(auth_file, 0o600)
+
+        # A single auth_type would either ask the admin for a password, or
+        # let anyone in as the roles with a password.
+        hba_file = os.path.join(conf_dir, 'pgbouncer_hba.conf')
+        template_file = os.path.join(current_dir, 'templates', 'pgbouncer_hba.conf.tmpl')
+        with open(template_file) as fd:
+            template = Template(fd.read())
+        with open(hba_file, 'w') as fd:
+            fd.write(template.render(entries=pooler.client_hba(roles, self.options['admin'])))
+
+        template_file = os.path.join(current_dir, 'templates', 'pgbouncer.ini.tmpl')
+        with open(template_file) as fd:
+            template = Template(fd.read())
+        with open(os.path.join(conf_dir, 'pgbouncer.ini'), 'w') as fd:
+            fd.write(template.render(socketdir=primary.socketdir.split(',')[0].strip(),
+                                     port=primary.port,
+                                     listen_addr=self.options['pgbouncer-listen'],
+                                     listen_port=self.options['pgbouncer-port'],
+                                     auth_file=auth_file,
+                                     auth_hba_file=hba_file,
+                                     admin=self.options['admin'],
+                                     pool_mode=self.options['pool-mode'],
+                                     pool_size=self.options['pool-size'],
+                                     max_client_conn=self.options['max-client-conn'],
+                                     pidfile=os.path.join(self.options['location'], 'pgbouncer.pid'),
+                                     logfile=os.path.join(self.options['location'], 'pgbouncer.log')))
+
+    def _build_environment(self):
+        """Environment variables the build runs with (cmmi ``environment``)."""
+
+        env = os.environ.copy()
+        for variable in self.options.get('environment', '').splitlines():
+            if '=' in variable:
+                key, value = variable.split('=', 1)
+                env[key.strip()] = value.strip() % os.environ
+        return env
+
+    def _compiler_version(self):
+        cc = self._build_environment().get('CC', 'cc')
+        try:
+            out = self.timings.communicate('cc --version', cc.split() + ['--version'],
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT,
+                                           universal_newlines=True)[1]
+        except OSError:
+            return ""
+        return out.strip()
+
+    def _build_key(self):
+        """Identify a source build by everything that changes its output."""
+
+        return hash_inputs(self.options['url'],
+                           ' '.join(self.options.get('configure-options', '').split()),
+                           ' '.join(self.options.get('make-options', '').split()),
+                           ' '.join(self.options.get('patches', '').split()),
+                           self.options.get('environment', '').strip(),
+                           self.options['build-mode'],
+                           self.options['build-contrib'] if self.options['build-mode'] == 'parallel' else '',
+                           self._compiler_version(),
+                           platform.machine())
+
+    def _install_cmmi_pg(self):
+        """Build PostgreSQL from source, going through the build cache.
+
+        PostgreSQL computes its share and lib directories relative to the
+        binaries, but the run path of the executables points to the lib
+        directory of the build: the tree is made relocatable with patchelf
+        before it is published, so that any other buildout can reuse it.
+        Without patchelf, the location is part of the cache key.
+        """
+
+        if self.options['build-mode'] == 'parallel':
+            build = self._build_parallel_pg
+        else:
+            build = self._build_cmmi_pg
+
+        if not self.options['build-cache']:
+            build()
+            return
+
+        cache = CacheDirectory(self.options['build-cache'],
+                               max_size=parse_size(self.options['build-cache-size']),
+                               log=self.log)
+        relocatable = bundle.can_relocate()
+        key = self._build_key()
+        if not relocatable:
+            key = hash_inputs(key, self.options['location'])
+
+        with cache.lock(key):
+            entry = cache.lookup(key)
+            if entry is None:
+                build()
+                if relocatable:
+                    try:
+                        with self.timings.phase('relocate'):
+                            bundle.make_relocatable(self.options['location'], strip=False,
+                                                    timings=self.timings)
+                    except bundle.BundleError as e:
+                        raise zc.buildout.UserError("Unable to make the build relocatable: %s" % e)
+                cache.publish(key, self.options['location'], url=self.options['url'])
+            else:
+                self.log.info('Using cached build %s from %s', key[:12], cache.root)
+                hardlink = self.options['build-cache-link'].lower() in TRUE_VALUES
+                copy_tree(entry, self.options['location'], hardlink=hardlink)
+
+    def _build_cmmi_pg(self):
+        try:
+            self.log.info('Compiling PostgreSQL')
+            import hexagonit.recipe.cmmi
+            opt = self.options.copy()  # Mutable object, updated by hexagonit
+            cmmi = hexagonit.recipe.cmmi.Recipe(self.buildout, self.name, opt)
+            with self.timings.phase('cmmi'):
+                cmmi.install()
+        except:
+            raise zc.buildout.UserError("Unable to install source version of postgresql")
+
+    def _build_jobs(self):
+        jobs = self.options['build-jobs'].strip()
+        if jobs == 'auto':
+            return available_cpus()
+        return int(jobs)
+
+    def _run_stage(self, stage, cmd, cwd, env):
+        """Run one step of the build and report its wall and CPU time."""
+
+        self.log.info('%s: %s', stage, cmd)
+        retcode = self.timings.call(stage, cmd, shell=True, cwd=cwd, env=env)
+        record = self.timings.last_record()
+        self.log.info('%s took %.1fs wall, %.1fs CPU', stage, record['wall'], record['cpu'])
+
+        if retcode != 0:
+            raise zc.buildout.UserError('%s failed with exit code %s' % (stage, retcode))
+
+    def _build_parallel_pg(self):
+        """Build PostgreSQL (and contrib) using every available CPU.
+
+        Unlike hexagonit.recipe.cmmi, the number of make jobs is computed from
+        the CPUs we are allowed to use, the compiler can go through ccache, and
+        each of the configure, make and make install stages is timed.
+        """
+
+        self.log.info('Compiling PostgreSQL in parallel mode')
+        env = self._build_environment()
+
+        if self.options['ccache'].lower() in TRUE_VALUES:
+            env['CC'] = 'ccache %s' % env.get('CC', 'gcc')
+            env['CCACHE_DIR'] = self.options['ccache-dir']
+            env.setdefault('CCACHE_BASEDIR', self.options['location'] + '__compile__')
+            if not os.path.isdir(self.options['ccache-dir']):
+                os.makedirs(self.options['ccache-dir'])
+
+        compile_dir = self.options['location'] + '__compile__'
+        if os.path.exists(compile_dir):
+            self.log.warning('Removing already existing directory %s', compile_dir)
+            shutil.rmtree(compile_dir)
+
+        import hexagonit.recipe.download
+        opt = self.options.copy()
+        opt['destination'] = compile_dir
+        opt['strip-top-level-dir'] = 'true'
+        with self.timings.phase('download'):
+            hexagonit.recipe.download.Recipe(self.buildout, self.name + '-hexagonit.download',
+                                             opt).install()
+
+        for patch in self.options.get('patches', '').split():
+            self._run_stage('patch', '%s %s < %s' % (self.options.get('patch-binary', 'patch'),
+                                                      self.options.get('patch-options', '-p0'),
+                                                      patch),
+                            compile_dir, env)
+
+        make = self.options.get('make-binary', 'make')
+        make_options = ' '.join(self.options.get('make-options', '').split())
+        if '-j' not in make_options and '--jobs' not in make_options:
+            make_options = ('-j%d %s' % (self._build_jobs(), make_options)).strip()
+        with_contrib = self.options['build-contrib'].lower() in TRUE_VALUES
+
+        configure_options = ' '.join(self.options.get('configure-options', '').split())
+        self._run_stage('configure', './configure --prefix="%s" %s' % (self.options['location'],
+                                                                       configure_options),
+                        compile_dir, env)
+
+        # PostgreSQL 13+ builds the server and contrib in a single make, so
+        # that contrib does not wait for the slowest server objects.
+        with open(os.path.join(compile_dir, 'GNUmakefile')) as fd:
+            world_bin = with_contrib and 'world-bin:' in fd.read()
+
+        if world_bin:
+            self._run_stage('make', '%s %s world-bin' % (make, make_options), compile_dir, env)
+            self._run_stage('make install', '%s %s install-world-bin' % (make, make_options),
+                            compile_dir, env)
+        else:
+            cmd = '%s %s' % (make, make_options)
+            if with_contrib:
+                cmd += ' && %s %s -C contrib' % (make, make_options)
+            self._run_stage('make', cmd, compile_dir, env)
+
+            cmd = '%s %s install' % (make, make_options)
+            if with_contrib:
+                cmd += ' && %s %s -C contrib install' % (make, make_options)
+            self._run_stage('make install', cmd, compile_dir, env)
+
+        if self.options.get('keep-compile-dir', '').lower() not in TRUE_VALUES:
+            shutil.rmtree(compile_dir)
+
+    def _fetch_binaries(self):
+        """Return the path of the binary archive, from the archive cache.
+
+        The mirrors of ``url-bin`` are tried in order, and the archive is
+        checked against ``url-bin-sha256``.
+        """
+
+        arch = platform.machine()
+        urls = download.mirror_urls(self.options['url-bin'], arch)
+        sha256 = None
+        if self.options['url-bin-sha256'].strip():
+            sha256 = download.declared_hash(self.options['url-bin-sha256'], arch)
+            if sha256 is None:
+                raise zc.buildout.UserError("No sha256 declared for %s in url-bin-sha256" % arch)
+
+        cache = download.ArchiveCache(self.options['archive-cache'], log=self.log)
+        try:
+            with self.timings.phase('download'):
+                return cache.fetch(urls, sha256,
+                                   chunks=int(self.options['download-chunks']),
+                                   timeout=float(self.options['download-timeout']))
+        except download.DownloadError as e:
+            raise zc.buildout.UserError(str(e))
+
+    def _install_compiled_pg(self):
+        """Extract the binaries using hexagonit.recipe.download"""
+
+        archive = self._fetch_binaries()
+        try:
+            import hexagonit.recipe.download
+            opt = self.options.copy()
+            opt['url'] = archive
+            self.log.info("Will extract %s", opt['url'])
+            opt['destination'] = self.options['location']
+            name = self.name + '-hexagonit.download'
+            with self.timings.phase('extract'):
+                hexagonit.recipe.download.Recipe(self.buildout, name, opt).install()
+        except:
+            raise zc.buildout.UserError("Unable to download binaries version of postgresql")
+
+        try:
+            with self.timings.phase('verify'):
+                manifest = bundle.verify(self.options['location'])
+        except bundle.BundleError as e:
+            raise zc.buildout.UserError("Invalid binary bundle: %s" % e)
+        if manifest is not None:
+            self.log.info('Verified %d files of the PostgreSQL %s bundle',
+                          len(manifest['files']), manifest['version'])
+
+    def _export_bundle(self):
+        """Package the source build as a relocatable bundle for url-bin."""
+
+        self.log.info('Exporting a binary bundle to %s', self.options['bundle-dir'])
+        try:
+            bundle.export(self.options['location'], self.options['bundle-dir'],
+                          self._build_key(),
+                          strip=self.options['bundle-strip'].lower() in TRUE_VALUES,
+                          log=self.log, timings=self.timings)
+        except (bundle.BundleError, subprocess.CalledProcessError, OSError) as e:
+            raise zc.buildout.UserError("Unable to export the binary bundle: %s" % e)
+
+    def _pg_ctl(self, instance, action):
+        """Start or stop the server, waiting for the operation to complete."""
+
+        cmd = [os.path.join(self.options['bin-dir'], 'pg_ctl'),
+               '-D', instance.datadir,
+               '-o', '-c config_file=%s' % instance.config_file,
+               '-w', '-t', str(int(float(self.options['startup-timeout'])))]
+        if action in ('start', 'restart'):
+            cmd += ['-l', instance.log_file]
+        if action in ('stop', 'restart'):
+            cmd += ['-m', 'fast']
+        cmd.append(action)
+
+        retcode, out, err = self.timings.communicate('pg_ctl %s' % action, cmd,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.STDOUT,
+                                                     universal_newlines=True)
+        if retcode != 0:
+            raise zc.buildout.UserError("Unable to %s PostgreSQL %s:\n%s" % (action, instance.label, out))
+
+    def _wait_for_startup(self, instance):
+        """Wait for the database to accept connections.
+
+        The status line of postmaster.pid is watched (through inotify when
+        available) until the server reports itself as ready, and a startup
+        packet is then sent on the Unix socket to confirm it. Checks are
+        spaced with an exponential backoff, up to ``startup-timeout`` seconds.
+        """
+
+        self.log.info("Wait for the database %s to startup...", instance.label)
+        try:
+            wait_until_ready(instance.datadir, instance.socketdir,
+                             instance.port,
+                             self.options['admin'],
+                             timeout=float(self.options['startup-timeout']),
+                             initial_delay=float(self.options['startup-poll-interval']),
+                             max_delay=float(self.options['startup-poll-max']))
+        except NotReady as e:
+            # Stop the buildout, we have waited too much time and it means their
+            # should be some kind of problem.
+            raise zc.buildout.UserError("Unable to communicate with PostgreSQL: %s" % e)
+
+    def _provision_roles(self, instance):
+        """Create or update all the declared roles in one transaction."""
+
+        try:
+            roles = self._roles()
+        except ValueError as e:
+            raise zc.buildout.UserError(str(e))
+
+        if not roles:
+            return
+
+        self.log.info('Provisioning %d roles in %s', len(roles), instance.label)
+        cmd = [os.path.join(self.options['bin-dir'], 'psql'),
+               '-h', instance.socketdir,
+               '-p', instance.port,
+               '-U', self.options['admin'],
+               '-X', '--quiet', '--no-align', '--tuples-only',
+               '-v', 'ON_ERROR_STOP=1',
+               # psql only wraps -c and -f in the transaction, not plain stdin.
+               '--single-transaction', '-f', '-',
+               'template1']
+
+        verifiers = {}
+        for line in self._query(instance, "SELECT rolname || chr(31) || coalesce(rolpassword, '') "
+                                          "FROM pg_authid").split('\n'):
+            if not line:
+                continue
+            name, verifier = line.split(chr(31), 1)
+            verifiers[name] = verifier
+        sql = provisioning_sql(roles, verifiers)
+        retcode, out, err = self.timings.communicate('psql roles', cmd, sql,
+                                                     env=self._psql_environment(),
+                                                     stdin=subprocess.PIPE,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.PIPE,
+                                                     universal_newlines=True)
+        if retcode != 0:
+            raise zc.buildout.UserError("Unable to provision roles: %s" % err)
+
+        report = dict(created=0, altered=0, unchanged=0)
+        for line in out.split():
+            status, count = line.split('|')
+            report[status] = int(count)
+        report['instance'] = instance.label
+        self.log.info('Roles of %(instance)s: %(created)d created, %(altered)d altered, '
+                      '%(unchanged)d unchanged', report)
+
+    def _create_cluster(self, instance):
+        """Create a new PostgreSQL cluster into the data directory."""
+
+        if os.path.exists(instance.datadir):
+            self.log.warning("Cluster directory already exists, skipping "
+                             "cluster initialization...")
+            return
+
+        self.log.info('Initializing a new PostgreSQL database cluster for %s', instance.label)
+        try:
+            create_cluster(self.options['bin-dir'], instance.datadir, self.options['admin'],
+                           initdb_arguments(self.options),
+                           template_cache=self.options['cluster-cache'],
+                           log=self.log, timings=self.timings)
+        except RuntimeError as e:
+            raise zc.buildout.UserError("Unable to create the cluster: %s" % e)
+
+    def _create_replica(self, replica):
+        """Seed the data directory of a replica from its primary."""
+
+        user = self.options['replication-user']
+        if not os.path.exists(replica.datadir):
+            self.log.info('Seeding the replica %s from %s', replica.label, replica.primary.label)
+            # A slot left by a previous incarnation of the replica.
+            self._query(replica.primary,
+                        "SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots "
+                        "WHERE slot_name = '%s'" % replication.slot_name(replica.name))
+            cmd = replication.basebackup_command(self.options['bin-dir'], replica.primary,
+                                                 replica.datadir, replica.name, user)
+            retcode, out, err = self.timings.communicate('pg_basebackup', cmd,
+                                                         stdout=subprocess.PIPE,
+                                                         stderr=subprocess.STDOUT,
+                                                         universal_newlines=True)
+            if retcode != 0:
+                raise zc.buildout.UserError("Unable to seed the replica %s:\n%s" % (replica.label, out))
+            os.chmod(replica.datadir, 0o700)
+
+        version = int(self._read_pg_version(replica).split('.')[0])
+        replication.mark_standby(replica.datadir, version, replica.primary, replica.name, user)
+
+    def _psql_environment(self):
+        """Environment of the psql sessions of the recipe.
+
+        With synchronous replication, commits wait for a replica, and the
+        recipe runs its own statements before the replicas are seeded or
+        while they are stopped: its sessions only wait for the local flush.
+        """
+
+        env = os.environ.copy()
+        env['PGOPTIONS'] = ('%s -c synchronous_commit=local' % env.get('PGOPTIONS', '')).strip()
+        return env
+
+    def _query(self, instance, query, database='template1'):
+        """Run a query on instance and return its output."""
+
+        cmd = [os.path.join(self.options['bin-dir'], 'psql'),
+               '-h', instance.socketdir,
+               '-p', instance.port,
+               '-U', self.options['admin'],
+               '-X', '--no-align', '--quiet', '--tuples-only',
+               '-c', query, database]
+        retcode, out, err = self.timings.communicate('psql', cmd,
+                                                     env=self._psql_environment(),
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.PIPE,
+                                                     universal_newlines=True)
+        if retcode != 0:
+            raise zc.buildout.UserError("Query on %s failed: %s" % (instance.label, err))
+        return out.strip()
+
+    def _wait_for_catchup(self, primary, replicas):
+        """Wait until every replica replayed the current WAL of the primary."""
+
+        version = int(self._read_pg_version(primary).split('.')[0])
+        current_lsn, replayed = replication.lsn_queries(version)
+        lsn = self._query(primary, current_lsn)
+        self.log.info('Waiting for the replicas to reach %s', lsn)
+
+        deadline = time.time() + float(self.options['startup-timeout'])
+        delay = float(self.options['startup-poll-interval'])
+        pending = list(replicas)
+        while pending:
+            pending = [replica for replica in pending
+                       if self._query(replica, replayed % ("'%s'" % lsn)) != 't']
+            if not pending:
+                break
+            if time.time() > deadline:
+                raise zc.buildout.UserError("Replicas %s did not catch up with %s" %
+                                            (', '.join(replica.label for replica in pending), lsn))
+            time.sleep(delay)
+            delay = min(delay * 2, float(self.options['startup-poll-max']))
+
+    def _read_pg_version(self, instance):
+        try:
+            version = open(os.path.join(instance.datadir,
+                                        'PG_VERSION')).read()
+        except IOError:
+            version = None
+
+        return version
+
+    def _is_observable(self):
+        return self.options['observability'].lower() in TRUE_VALUES
+
+    def _extensions(self):
+        try:
+            declared = extensions.parse_extensions(self.options['extensions'])
+        except ValueError as e:
+            raise zc.buildout.UserError(str(e))
+
+        if self._is_observable():
+            names = [extension.name for extension in declared]
+            declared.extend(extensions.Extension(name, preload=True)
+                            for name in ('pg_stat_statements', 'auto_explain')
+                            if name not in names)
+        return declared
+
+    def _preload_libraries(self):
+        """Libraries to load at server start, in shared_preload_libraries."""
+
+        return [extension.name for extension in self._extensions() if extension.preload]
+
+    def _install_extensions(self):
+        """Build the missing extensions in parallel and install them.
+
+        Contrib modules are built from the sources of ``url``, others from
+        their own archive, all of them with PGXS against our pg_config. The
+        builds go through the build cache, keyed by the postgres binary.
+        """
+
+        location = self.options['location']
+        missing = [extension for extension in self._extensions()
+                   if not extensions.is_installed(location, extension)]
+        if not missing:
+            return
+
+        self.log.info('Building extensions: %s', ', '.join(extension.name for extension in missing))
+        binary_hash = self._binary_hash({})[0]
+        jobs = max(1, available_cpus() // len(missing))
+        cache = None
+        if self.options['build-cache']:
+            cache = CacheDirectory(self.options['build-cache'],
+                                   max_size=parse_size(self.options['build-cache-size']),
+                                   log=self.log)
+
+        contrib = [extension for extension in missing if extension.contrib]
+        if contrib:
+            if not self.options['url']:
+                raise zc.buildout.UserError("The contrib extensions %s are not installed, and "
+                                            "building them needs the PostgreSQL sources (url)" %
+                                            ', '.join(extension.name for extension in contrib))
+
+        def source_dir(extension):
+            if extension.contrib:
+                return os.path.join(self._download_source(self.options['url'], 'contrib'),
+                                    'contrib', extension.name)
+            return self._download_source(extension.url, extension.name)
+
+        def build_and_install(extension):
+            staging = tempfile.mkdtemp(prefix='.tmp-extension-', dir=os.path.dirname(location))
+            try:
+                installed = self._build_extension(extension, source_dir(extension), jobs, staging)
+                if cache is not None:
+                    cache.publish(extensions.build_key(binary_hash, extension), installed,
+                                  extension=extension.name)
+                copy_tree(installed, location)
+            finally:
+                shutil.rmtree(staging)
+
+        def build(extension):
+            if cache is None:
+                build_and_install(extension)
+                return
+
+            key = extensions.build_key(binary_hash, extension)
+            with cache.lock(key):
+                entry = cache.lookup(key)
+                if entry is None:
+                    build_and_install(extension)
+                else:
+                    self.log.info('Using cached build of %s', extension.name)
+                    copy_tree(entry, location)
+
+        # The contrib sources are shared, fetch them before the builds start.
+        if contrib:
+            self._download_source(self.options['url'], 'contrib')
+        try:
+            self._parallel(build, missing)
+        finally:
+            for directory in self._downloaded_sources.values():
+                shutil.rmtree(directory, ignore_errors=True)
+            self._downloaded_sources.clear()
+
+    def _download_source(self, url, name):
+        """Extract the source archive at url, once, and return its directory."""
+
+        if url in self._downloaded_sources:
+            return self._downloaded_sources[url]
+
+        import hexagonit.recipe.download
+        directory = '%s__%s__' % (self.options['location'], name)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        opt = self.options.copy()
+        opt['url'] = url
+        opt['destination'] = directory
+        opt['strip-top-level-dir'] = 'true'
+        opt.pop('md5sum', None)
+        with self.timings.phase('download %s' % name):
+            hexagonit.recipe.download.Recipe(self.buildout, '%s-%s' % (self.name, name), opt).install()
+        self._downloaded_sources[url] = directory
+        return directory
+
+    def _build_extension(self, extension, source, jobs, staging):
+        """Build extension from source, install it in staging and return the
+        directory holding its files, relative to the location."""
+
+        make = self.options.get('make-binary', 'make')
+        pg_config = os.path.join(self.options['bin-dir'], 'pg_config')
+        env = self._build_environment()
+        for stage, cmd in extensions.make_commands(make, pg_config, jobs, staging):
+            self._run_stage('%s %s' % (stage, extension.name), cmd, source, env)
+        # make install wrote the files under their absolute path in staging.
+        return os.path.join(staging, self.options['location'].lstrip(os.sep))
+
+    def _create_extensions(self, instance):
+        sql = extensions.create_sql(self.options['location'], self._extensions())
+        if not sql:
+            return
+        for database in self.options['extension-databases'].split():
+            self.log.info('Creating extensions in %s of %s', database, instance.label)
+            self._query(instance, sql, database)
+
+    def _databases(self):
+        try:
+            return seeding.parse_databases(self.options['databases'],
+                                           self.buildout['buildout']['directory'])
+        except ValueError as e:
+            raise zc.buildout.UserError(str(e))
+
+    def _database_hashes(self, previous):
+        """Return the seed hashes of the declared databases and the seed files stat.
+
+        The seed hashes are by database name, the stat signature and hash of
+        the seed files by path. Like the binary, a seed file is only hashed again when its size, mtime
+        or inode changed since the previous fingerprint.
+        """
+
+        known = previous.get('seed-stat') or {}
+        seed_stat = {}
+
+        def hasher(path):
+            stat = os.stat(path)
+            signature = [stat.st_size, stat.st_mtime, stat.st_ino]
+            if path not in seed_stat:
+                if known.get(path, [None])[:-1] == signature:
+                    seed_stat[path] = known[path]
+                else:
+                    seed_stat[path] = signature + [hash_file(path)]
+            return seed_stat[path][-1]
+
+        try:
+            hashes = dict((database.name, seeding.seed_hash(database, hasher))
+                          for database in self._databases())
+        except (IOError, OSError, ValueError) as e:
+            raise zc.buildout.UserError("Unable to read the seed of the databases: %s" % e)
+        return hashes, seed_stat
+
+    def _psql_command(self, instance, database, *args):
+        return [os.path.join(self.options['bin-dir'], 'psql'),
+                '-h', instance.socketdir,
+                '-p', instance.port,
+                '-U', self.options['admin'],
+                '-X', '--quiet', '-v', 'ON_ERROR_STOP=1'] + list(args) + [database]
+
+    def _seed_databases(self, instance):
+        """Create the missing databases, seeding or cloning them.
+
+        A template database whose seed changed since the previous run is
+        dropped and seeded again; other existing databases are left alone.
+        """
+
+        fingerprint = self._read_fingerprint()
+        previous = fingerprint.get('databases') or {}
+        current = self._database_hashes(fingerprint)[0]
+        version = float(self._read_pg_version(instance))
+        existing = self._query(instance, 'SELECT datname FROM pg_database').split('\n')
+
+        for database in self._databases():
+            if database.name in existing:
+                if database.name not in previous or previous[database.name] == current[database.name]:
+                    continue
+                if not database.template:
+                    self.log.warning("The seed of the database %s changed, but the database "
+                                     "exists in %s: leaving it untouched",
+                                     database.name, instance.label)
+                    continue
+                self.log.info('Dropping the template database %s of %s, its seed changed',
+                              database.name, instance.label)
+                self._query(instance, seeding.template_sql(database.name, False, version))
+                self._query(instance, 'DROP DATABASE %s' % seeding.quote_ident(database.name))
+            self._seed_database(instance, database, version)
+
+    def _seed_database(self, instance, database, version):
+        if database.source:
+            self.log.info('Creating the database %s of %s from %s',
+                          database.name, instance.label, database.source)
+        else:
+            self.log.info('Seeding the database %s of %s', database.name, instance.label)
+
+        self._query(instance, seeding.create_sql(database))
+        try:
+            if not database.source:
+                for path in database.schema:
+                    self._run_sql_file(instance, database, path)
+                self._load_data(instance, database)
+                for path in database.post:
+                    self._run_sql_file(instance, database, path)
+                self._query(instance, 'ANALYZE', database.name)
+        except Exception:
+            # A half seeded database would be taken for a complete one.
+            self._query(instance, 'DROP DATABASE %s' % seeding.quote_ident(database.name))
+            raise
+
+        if database.template:
+            self._query(instance, seeding.template_sql(database.name, True, version))
+
+    def _run_sql_file(self, instance, database, path):
+        cmd = self._psql_command(instance, database.name)
+        retcode, out, err = self.timings.communicate('psql %s' % os.path.basename(path), cmd,
+                                                     seeding.file_script(path, database.owner),
+                                                     env=self._psql_environment(),
+                                                     stdin=subprocess.PIPE,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.PIPE,
+                                                     universal_newlines=True)
+        if retcode != 0:
+            raise zc.buildout.UserError("Unable to run %s in the database %s: %s" %
+                                        (path, database.name, err))
+
+    def _load_data(self, instance, database):
+        """Load the data files of database with parallel COPY.
+
+        The foreign keys of the loaded tables, and their indexes no
+        constraint depends on, are dropped first. The indexes are built again
+        in parallel once every table is loaded, then the foreign keys are
+        added back, which checks them.
+        """
+
+        files = seeding.data_files(database.data)
+        if not files:
+            return
+
+        def rows(query, fields):
+            return [line.split('\x1f', fields - 1)
+                    for line in self._query(instance, query, database.name).split('\n') if line]
+
+        tables = sorted(set(table for table, path, fmt in files))
+        # Listed while the foreign keys still protect the indexes they use.
+        indexes = rows(seeding.secondary_indexes_sql(tables), 2)
+        foreign_keys = rows(seeding.foreign_keys_sql(tables), 3)
+        for table, name, definition in foreign_keys:
+            self._query(instance, 'ALTER TABLE %s DROP CONSTRAINT %s' % (table, name), database.name)
+        if indexes:
+            self._query(instance, 'DROP INDEX %s' % ', '.join(name for name, definition in indexes),
+                        database.name)
+
+        def load(data_file):
+            table, path, fmt = data_file
+            cmd = self._psql_command(instance, database.name, '-c', seeding.copy_sql(table, fmt))
+            with open(path, 'rb') as fd:
+                retcode, out, err = self.timings.communicate('copy %s' % table, cmd,
+                                                             env=self._psql_environment(),
+                                                             stdin=fd,
+                                                             stdout=subprocess.PIPE,
+                                                             stderr=subprocess.PIPE,
+                                                             universal_newlines=True)
+            if retcode != 0:
+                raise zc.buildout.UserError("Unable to load %s into %s: %s" % (path, table, err))
+
+        def build(index):
+            name, definition = index
+            self._query(instance, definition, database.name)
+
+        self.log.info('Loading %d files into %s', len(files), database.name)
+        self._parallel(load, files)
+        if indexes:
+            self.log.info('Building %d indexes of %s', len(indexes), database.name)
+            self._parallel(build, indexes)
+        # One at a time: adding a foreign key locks the referenced table too.
+        for table, name, definition in foreign_keys:
+            self._query(instance, 'ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, name, definition),
+                        database.name)
+
+    def _settings_catalog(self):
+        """Return the definitions of the settings known by the binaries."""
+
+        binary_hash = self._binary_hash(self._read_fingerprint())[0]
+        return load_catalog(self.options['bin-dir'], self.options['settings-cache'], binary_hash,
+                            self.timings)
+
+    def _derived_settings(self, instance):
+        """Return the settings the recipe computes, as (name, value, why).
+
+        Settings explicitly set in the postgresql.conf option are left out,
+        since the user always wins.
+        """
+
+        if instance.label in self._derived:
+            return self._derived[instance.label]
+
+        derived = []
+        profile = self.options['autotune'].strip()
+        if profile:
+            max_connections = int(instance.pgconf.get('max_connections', '100').strip("'"))
+            resources = autotune.detect(instance.datadir)
+            prefix = 'autotune %s' % profile
+            if len(self.instances) > 1 and resources.memory:
+                # The instances share the memory of the host.
+                resources.memory //= len(self.instances)
+                prefix += ', 1/%d of the host memory' % len(self.instances)
+            try:
+                tuned = autotune.tune(profile, resources, max_connections=max_connections)
+            except ValueError as e:
+                raise zc.buildout.UserError(str(e))
+            derived.extend((name, value, '%s: %s' % (prefix, why))
+                           for name, value, why in tuned)
+
+        if self.replicas:
+            try:
+                if instance is self.instances[0]:
+                    derived.extend(replication.primary_settings([replica.name for replica in self.replicas],
+                                                                self.options['replication']))
+                elif instance.primary is not None:
+                    derived.extend(replication.standby_settings(instance.primary, instance.name,
+                                                                self.options['replication-user']))
+            except ValueError as e:
+                raise zc.buildout.UserError(str(e))
+
+        libraries = self._preload_libraries()
+        if libraries:
+            why = 'loaded at server start by %s' % ', '.join(libraries)
+            if 'shared_preload_libraries' in instance.pgconf:
+                libraries = extensions.merge_libraries(instance.pgconf['shared_preload_libraries'],
+                                                       libraries)
+                why += ', and the libraries of postgresql.conf'
+            derived.append(('shared_preload_libraries', ','.join(libraries), why))
+
+        if self._is_observable():
+            derived.extend(extensions.observability_settings(self.options['slow-query-threshold']))
+
+        if self.options['log-analysis'].lower() in TRUE_VALUES:
+            derived.extend(logs.analysis_settings(self.options['log-min-duration']))
+
+        archive = self._wal_archive(instance)
+        if archive:
+            if self._is_ephemeral():
+                raise zc.buildout.UserError("WAL archiving needs durable WAL, it can not "
+                                            "be used in ephemeral mode")
+            derived.extend(backup.archive_settings(archive))
+
+        if self._is_ephemeral():
+            derived.extend(ephemeral.durability_settings(parse_size(self.options['ephemeral-size']),
+                                                         replication=bool(self.replicas)))
+
+        # Later derivations win over earlier ones, and the user over all of
+        # them, except for the merged settings.
+        names = [setting[0] for setting in derived]
+        derived = [setting for index, setting in enumerate(derived)
+                   if (setting[0] not in instance.pgconf or setting[0] in MERGED_SETTINGS)
+                   and setting[0] not in names[index + 1:]]
+        for name, value, why in derived:
+            self.log.info('%s: %s = %s (%s)', instance.label, name, value, why)
+        self._derived[instance.label] = derived
+        return derived
+
+    def _wal_archive(self, instance):
+        """Return the WAL archive directory of a primary instance, if any."""
+
+        archive = self.options['wal-archive']
+        if not archive or instance.primary is not None:
+            return None
+        if len(self.instances) > 1:
+            return os.path.join(archive, instance.label)
+        return archive
+
+    def _pg_conf_text(self, instance, known=None):
+        """Return the content of the postgresql.conf option, preceded by the
+        derived settings.
+
+        known is the set of the setting names the binaries support, if
+        available: derived settings unknown to older servers are dropped.
+        Settings merged with the buildout ones come last, so that they win.
+        """
+
+        lines = []
+        merged = []
+        for name, value, why in self._derived_settings(instance):
+            # Settings of extensions (with a dot) are unknown to the binaries.
+            if known is not None and name not in known and '.' not in name:
+                self.log.info('%s is not supported by this PostgreSQL version', name)
+                continue
+            line = "# %s\n%s = '%s'\n" % (why, name, value)
+            if name in instance.pgconf:
+                merged.append(line)
+            else:
+                lines.append(line)
+
+        text = instance.conf_text
+        if lines:
+            text = "# Derived settings\n%s\n# Settings from buildout\n%s" % (''.join(lines), text)
+        if merged:
+            text = "%s\n\n# Merged settings\n%s" % (text.rstrip('\n'), ''.join(merged))
+        return text
+
+    def _make_pg_config(self, instance):
+        """Write the configuration files.
+
+        Returns True if the verbose configuration could be generated from the
+        binaries, False if it still has to be read from a running server.
+        """
+
+        from jinja2 import Template
+
+        self.log.info("Creating initial PostgreSQL configuration for %s", instance.label)
+
+        if not os.path.isdir(instance.conf_dir):
+            os.makedirs(instance.conf_dir)
+        if instance.socketdir and not os.path.isdir(instance.socketdir):
+            os.makedirs(instance.socketdir)
+        archive = self._wal_archive(instance)
+        if archive and not os.path.isdir(archive):
+            os.makedirs(archive)
+
+        pg_version = self._read_pg_version(instance)
+
+        def template_data(template_name):
+            file_name = os.path.join(current_dir, 'templates', template_name)
+            return open(file_name).read()
+
+        settings = None
+        try:
+            settings = self._settings_catalog()
+        except OSError as e:
+            if self.options['verbose-conf'] or self._derived_settings(instance):
+                self.log.warning("Unable to read the default settings from the "
+                                 "binaries: %s", e)
+
+        if settings is not None:
+            errors = pgconf.validate(pgconf.parse(instance.conf_text), settings)
+            if errors:
+                raise zc.buildout.UserError("Invalid postgresql.conf for %s:\n  %s" %
+                                            (instance.label, '\n  '.join(errors)))
+
+        verbose = False
+        if self.options['verbose-conf'] and settings is not None:
+            settings.sort(key=lambda setting: (setting.category, setting.name))
+            self._write_verbose_pg_config(instance, [(setting.name, setting.default,
+                                            setting.category, setting.short_desc)
+                                           for setting in settings])
+            verbose = True
+
+        if not verbose:
+            # Minimal configuration file used to bootstrap the server. Will be
+            # replaced with all default values soon after if verbose-conf is set.
+            known = None
+            if settings is not None:
+                known = set(setting.name for setting in settings)
+            with open(instance.config_file, 'w') as pg_fd:
+                pg_fd.write(self._pg_conf_text(instance, known))
+
+        pooler_users = []
+        if self.options['pgbouncer'].lower() in TRUE_VALUES and instance is self.instances[0]:
+            pooler_users = pooler.server_hba(self._roles())
+
+        pghba_tpl = Template(template_data('pg_hba.conf.tmpl'))
+        with open(os.path.join(instance.conf_dir, "pg_hba.conf"), 'w') as pghba_fd:
+            pghba_fd.write(pghba_tpl.render(PG_VERSION=pg_version,
+                                            superusers=self.options['superusers'].split(),
+                                            users=self.options['users'].split(),
+                                            admin=self.options['admin'],
+                                            replication_user=(self.options['replication-user']
+                                                              if self.replicas else None),
+                                            pooler_users=pooler_users,
+                                        ))
+
+        return verbose
+
+    def _running_settings(self, instance):
+        """Return the current settings of a running server.
+
+        Returns a dict of settings.Setting, ``default`` holding the current
+        value, and the names of the settings read from its postgresql.conf.
+        """
+
+        # Unit separator: unlike '|', it does not show up in values. concat_ws
+        # skips NULL arguments, every nullable column is coalesced.
+        rows = self._query(instance,
+                           "SELECT concat_ws(chr(31), name, coalesce(setting, ''), context, vartype, "
+                           "coalesce(unit, ''), coalesce(min_val, ''), coalesce(max_val, ''), "
+                           "coalesce(array_to_string(enumvals, ','), ''), "
+                           "sourcefile IS NOT DISTINCT FROM current_setting('config_file')) "
+                           "FROM pg_settings")
+        running = {}
+        from_file = []
+        for row in rows.split('\n'):
+            fields = row.split('\x1f')
+            if len(fields) != 9:
+                continue
+            name, value, context, vartype, unit, min_val, max_val, enumvals, in_file = fields
+            running[name] = Setting(name, context, '', vartype, value,
+                                    min=min_val or None, max=max_val or None,
+                                    unit=unit or None,
+                                    enumvals=enumvals.split(',') if enumvals else None)
+            if in_file == 't':
+                from_file.append(name)
+        return running, from_file
+
+    def _apply_pg_config(self, instance):
+        """Apply the new configuration files to a running server.
+
+        The changed settings are classified by their context: when all of them
+        can be applied by the server on reload, it is only reloaded, keeping
+        its connections and caches. It is restarted when a ``postmaster``
+        setting changed, unless ``config-apply`` is ``reload``.
+        """
+
+        mode = self.options['config-apply']
+        if mode == 'none':
+            self.log.info('%s is running, not applying the new configuration', instance.label)
+            return
+
+        running, from_file = self._running_settings(instance)
+        with open(instance.config_file) as fd:
+            entries = pgconf.parse(fd.read())
+        errors = pgconf.validate(entries, running.values())
+        if errors:
+            raise zc.buildout.UserError("Invalid postgresql.conf for %s:\n  %s" %
+                                        (instance.label, '\n  '.join(errors)))
+
+        changes = pgconf.diff(pgconf.settings_dict(entries), running, from_file)
+        for name, old, new, context in changes:
+            self.log.info('%s: %s changes from %s to %s (%s)', instance.label, name, old,
+                          'its default' if new is None else new, context)
+
+        restart = pgconf.needs_restart(changes)
+        if restart and mode == 'auto':
+            self.log.info('Restarting %s to apply %s', instance.label, ', '.join(restart))
+            self._pg_ctl(instance, 'restart')
+            self._wait_for_startup(instance)
+            return
+
+        # pg_hba.conf may have changed too, so reload even without changes.
+        self._query(instance, 'SELECT pg_reload_conf()')
+        if restart:
+            self.log.warning('%s must be restarted to apply %s', instance.label, ', '.join(restart))
+
+    def _live_settings(self, instance):
+        """Read the default settings from the running server.
+
+        Only used when the binaries can not describe their settings.
+        """
+
+        # http://www.postgresql.org/docs/current/static/view-pg-settings.html
+        query = "SELECT name, setting, category, short_desc FROM pg_settings "\
+                "WHERE context != 'internal' ORDER BY category, name;"
+
+        # Unit separator: unlike '|', it does not show up in values.
+        cmd = [os.path.join(self.options['bin-dir'], 'psql'),
+               '-h', instance.socketdir,
+               '-p', instance.port,
+               '-U', self.options['admin'],
+               '-X', '--field-separator', '\x1f',
+               '--no-align', '--quiet', '--tuples-only', 'template1']
+
+        retcode, out, err = self.timings.communicate('psql settings', cmd, query,
+                                                     env=self._psql_environment(),
+                                                     stdin=subprocess.PIPE,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.PIPE,
+                                                     universal_newlines=True)
+
+        if retcode != 0 or err != '':
+            raise zc.buildout.UserError("Unable to get settings from PostgreSQL: %s" %
+                                        (err,))
+
+        return [line.split('\x1f') for line in out.strip().split('\n')]
+
+    def _update_pg_config(self, instance):
+        """Update the PostgreSQL configuration file with defaults from the server.
+
+        It needs a running database server in order to retrieve default
+        values, it is only used when the binaries could not give them.
+        """
+
+        self.log.info("Updating PostgreSQL configuration of %s", instance.label)
+        self._write_verbose_pg_config(instance, self._live_settings(instance))
+
+    def _write_verbose_pg_config(self, instance, settings):
+        """Write a configuration file with all the default values first, and
+        our values just after.
+
+        settings is a list of (name, value, category, description) tuples.
+        """
+
+        self.log.info("Writing the PostgreSQL configuration file with default "
+                      "values...")
+
+        pg_fd = open(instance.config_file, 'w')
+        pg_fd.write("# Default configuration from PostgreSQL\n")
+
+        old_category = None
+        for opt, value, category, desc in settings:
+
+            if category != old_category:
+                header = "## %s ##" % category
+                dashes = "#" * len(header)
+                pg_fd.write("\n%s\n%s\n%s\n" % (dashes, header, dashes))
+                old_category = category
+
+            # Patch some values which are wrongly returned
+            if opt == 'lc_messages' and value == '':
+                value = 'C'
+
+            desc = "\n# ".join(textwrap.wrap(desc, width=78))
+
+            pg_fd.write("# %s\n%s = '%s'\n\n" % (desc, opt, value.replace("'", "''")))
+
+        self.log.info("Updating the PostgreSQL configuration with the settings "
+                      "from buildout configuration file...")
+
+        pg_fd.write("\n\n# Override default values here\n")
+        pg_fd.write(self._pg_conf_text(instance, set(setting[0] for setting in settings)))
+        pg_fd.close()
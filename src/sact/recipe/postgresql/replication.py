@@ -0,0 +1,106 @@
+"""Streaming replication between the clusters of a part.
+
+The first instance of the part acts as the primary. Replicas are seeded from
+it with ``pg_basebackup``, each one through its own replication slot, and
+configured as hot standbys streaming from the primary socket. In ``sync``
+mode the primary waits for one of the replicas to confirm each commit.
+"""
+
+import os
+
+
+MODES = ('async', 'sync')
+
+
+def replica_names(value):
+    """Parse the ``replicas`` option: a number of replicas or their names."""
+
+    value = value.strip()
+    if not value or value == '0':
+        return []
+    if value.isdigit():
+        return ['replica%d' % index for index in range(1, int(value) + 1)]
+    return value.split()
+
+
+def slot_name(replica):
+    # Slot names only allow lower case letters, numbers and underscores.
+    return ''.join(c if c.isalnum() else '_' for c in replica.lower())
+
+
+def primary_settings(replicas, mode):
+    """Settings a primary needs to feed the replicas, as (name, value, why)."""
+
+    if mode not in MODES:
+        raise ValueError("Unknown replication mode %r, use one of %s" %
+                         (mode, ', '.join(MODES)))
+
+    count = len(replicas)
+    settings = [
+        ('wal_level', 'replica', 'streaming replication to %d replicas' % count),
+        ('max_wal_senders', str(count + 2), '%d replicas, plus 2 for base backups' % count),
+        ('max_replication_slots', str(count + 2), 'one slot per replica, plus 2 spare'),
+        ('hot_standby', 'on', 'replicas answer read-only queries'),
+    ]
+    if mode == 'sync':
+        settings.append(('synchronous_standby_names',
+                         'ANY 1 (%s)' % ', '.join('"%s"' % name for name in replicas),
+                         'sync replication: one replica confirms each commit'))
+    return settings
+
+
+def primary_conninfo(primary, replica, user):
+    return 'host=%s port=%s user=%s application_name=%s' % (
+        primary.socketdir.split(',')[0].strip(), primary.port, user, replica)
+
+
+def standby_settings(primary, replica, user):
+    """Settings of a replica (PostgreSQL 12+), as (name, value, why)."""
+
+    return [
+        ('hot_standby', 'on', 'replica of %s' % primary.label),
+        ('primary_conninfo', primary_conninfo(primary, replica, user),
+         'stream from %s' % primary.label),
+        ('primary_slot_name', slot_name(replica), 'slot reserved on %s' % primary.label),
+    ]
+
+
+def mark_standby(datadir, version, primary, replica, user):
+    """Make the cluster of datadir start as a standby.
+
+    PostgreSQL 12 and later only need a standby.signal file, the connection
+    settings being regular settings; older versions read everything from
+    recovery.conf.
+    """
+
+    if version >= 12:
+        open(os.path.join(datadir, 'standby.signal'), 'w').close()
+        return
+
+    with open(os.path.join(datadir, 'recovery.conf'), 'w') as fd:
+        fd.write("standby_mode = 'on'\n")
+        fd.write("primary_conninfo = '%s'\n" % primary_conninfo(primary, replica, user))
+        fd.write("primary_slot_name = '%s'\n" % slot_name(replica))
+
+
+def basebackup_command(bin_dir, primary, datadir, replica, user):
+    """Command seeding datadir from primary, creating the replica slot."""
+
+    return [os.path.join(bin_dir, 'pg_basebackup'),
+            '-D', datadir,
+            '-h', primary.socketdir.split(',')[0].strip(),
+            '-p', primary.port,
+            '-U', user,
+            '-X', 'stream',
+            '-c', 'fast',
+            '--create-slot', '--slot', slot_name(replica),
+            '--no-password']
+
+
+def lsn_queries(version):
+    """Return the queries giving the primary LSN and the replayed LSN."""
+
+    if version >= 10:
+        return ('SELECT pg_current_wal_lsn()', 'SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn')
+    return ('SELECT pg_current_xlog_location()',
+            'SELECT pg_last_xlog_replay_location() >= %s::pg_lsn')
@@ -0,0 +1,253 @@
+"""Provisioning of the database roles declared in the recipe.
+
+All the roles are handled by a single SQL script, run in one session and one
+transaction: the declared roles are loaded into a temporary table, and a
+PL/pgSQL block creates the missing ones, aligns the attributes of the
+existing ones and grants the missing memberships. Roles which already match
+their declaration are left untouched, so the script can run on every update.
+
+The server only stores password verifiers (md5 or SCRAM-SHA-256 hashes), the
+declared passwords are checked against them in Python beforehand.
+"""
+
+import base64
+import hashlib
+import hmac
+
+
+class Role(object):
+    """A database role and the attributes we manage for it."""
+
+    def __init__(self, name, superuser=False, createdb=False, createrole=False,
+                 login=True, replication=False, connection_limit=-1,
+                 password=None, member_of=()):
+        self.name = name
+        self.superuser = superuser
+        self.createdb = createdb
+        self.createrole = createrole
+        self.login = login
+        self.replication = replication
+        self.connection_limit = connection_limit
+        self.password = password
+        self.member_of = list(member_of)
+
+    def __repr__(self):
+        return '<Role %s>' % self.name
+
+
+def parse_role(line):
+    """Parse a line of the ``roles`` option.
+
+    The syntax is the role name followed by flags (``superuser``,
+    ``createdb``, ``createrole``, ``replication``, ``nologin``) and settings
+    (``connection-limit=N``, ``password=SECRET``, ``in=ROLE1,ROLE2``).
+    """
+
+    words = line.split()
+    role = Role(words[0])
+
+    for word in words[1:]:
+        if '=' in word:
+            key, value = word.split('=', 1)
+            if key == 'connection-limit':
+                role.connection_limit = int(value)
+            elif key == 'password':
+                role.password = value
+            elif key == 'in':
+                role.member_of = [parent for parent in value.split(',') if parent]
+            else:
+                raise ValueError("Unknown role setting %r for %s" % (key, role.name))
+        elif word == 'nologin':
+            role.login = False
+        elif word in ('superuser', 'createdb', 'createrole', 'replication', 'login'):
+            setattr(role, word, True)
+        else:
+            raise ValueError("Unknown role attribute %r for %s" % (word, role.name))
+
+    return role
+
+
+def parse_roles(options):
+    """Return the roles declared by the recipe options, in order.
+
+    ``superusers`` and ``users`` declare plain roles, with the same attributes
+    ``createuser -s -d -r`` and ``createuser -S -D -R`` used to give them;
+    ``roles`` declares roles with any attributes, and wins over the two
+    others for a role declared twice.
+    """
+
+    roles = {}
+    order = []
+
+    def add(role):
+        if role.name not in roles:
+            order.append(role.name)
+        roles[role.name] = role
+
+    for name in options.get('superusers', '').split():
+        add(Role(name, superuser=True, createdb=True, createrole=True))
+    for name in options.get('users', '').split():
+        add(Role(name))
+    for line in options.get('roles', '').splitlines():
+        if line.strip() and not line.strip().startswith('#'):
+            add(parse_role(line))
+
+    admin = options.get('admin')
+    return [roles[name] for name in order if name != admin]
+
+
+def quote_literal(value):
+    if value is None:
+        return 'NULL'
+    return "'%s'" % value.replace("'", "''")
+
+
+def _b64decode(value):
+    return base64.b64decode(value.encode('ascii'))
+
+
+def password_matches(password, verifier, rolname):
+    """Tell whether password matches the verifier stored in pg_authid.
+
+    SCRAM passwords go through SASLprep on the server, which does not change
+    ASCII passwords; other passwords may be reported as different, and are
+    set again.
+    """
+
+    if not verifier:
+        return False
+    secret = password.encode('utf-8') if not isinstance(password, bytes) else password
+
+    if verifier.startswith('md5'):
+        salted = secret + rolname.encode('utf-8')
+        return verifier == 'md5' + hashlib.md5(salted).hexdigest()
+
+    if verifier.startswith('SCRAM-SHA-256$'):
+        try:
+            iterations_salt, keys = verifier[len('SCRAM-SHA-256$'):].split('$', 1)
+            iterations, salt = iterations_salt.split(':', 1)
+            stored_key = _b64decode(keys.split(':', 1)[0])
+            salted = hashlib.pbkdf2_hmac('sha256', secret, _b64decode(salt), int(iterations))
+        except (ValueError, TypeError):
+            return False
+        client_key = hmac.new(salted, b'Client Key', hashlib.sha256).digest()
+        return hashlib.sha256(client_key).digest() == stored_key
+
+    # Passwords stored in clear text by old servers.
+    return verifier == password
+
+
+def _bool(value):
+    return 'true' if value else 'false'
+
+
+PROVISIONING_SQL = """\
+CREATE TEMP TABLE sact_roles (
+    rolname name PRIMARY KEY,
+    rolsuper boolean,
+    rolcreatedb boolean,
+    rolcreaterole boolean,
+    rolcanlogin boolean,
+    rolreplication boolean,
+    rolconnlimit integer,
+    password text,
+    member_of name[],
+    password_ok boolean,
+    status text DEFAULT 'unchanged'
+) ON COMMIT DROP;
+
+INSERT INTO sact_roles (rolname, rolsuper, rolcreatedb, rolcreaterole,
+                        rolcanlogin, rolreplication, rolconnlimit,
+                        password, member_of, password_ok) VALUES
+%(values)s;
+
+DO $sact$
+DECLARE
+    r record;
+    existing record;
+    parent name;
+    attributes text;
+BEGIN
+    FOR r IN SELECT * FROM sact_roles LOOP
+        attributes :=
+            CASE WHEN r.rolsuper THEN ' SUPERUSER' ELSE ' NOSUPERUSER' END ||
+            CASE WHEN r.rolcreatedb THEN ' CREATEDB' ELSE ' NOCREATEDB' END ||
+            CASE WHEN r.rolcreaterole THEN ' CREATEROLE' ELSE ' NOCREATEROLE' END ||
+            CASE WHEN r.rolcanlogin THEN ' LOGIN' ELSE ' NOLOGIN' END ||
+            CASE WHEN r.rolreplication THEN ' REPLICATION' ELSE ' NOREPLICATION' END ||
+            ' CONNECTION LIMIT ' || r.rolconnlimit;
+
+        SELECT * INTO existing FROM pg_authid WHERE rolname = r.rolname;
+
+        IF NOT FOUND THEN
+            IF r.password IS NOT NULL THEN
+                attributes := attributes || format(' PASSWORD %%L', r.password);
+            END IF;
+            EXECUTE format('CREATE ROLE %%I', r.rolname) || attributes;
+            UPDATE sact_roles SET status = 'created' WHERE rolname = r.rolname;
+
+        ELSIF existing.rolsuper <> r.rolsuper
+           OR existing.rolcreatedb <> r.rolcreatedb
+           OR existing.rolcreaterole <> r.rolcreaterole
+           OR existing.rolcanlogin <> r.rolcanlogin
+           OR existing.rolreplication <> r.rolreplication
+           OR existing.rolconnlimit <> r.rolconnlimit
+           OR (r.password IS NOT NULL AND NOT r.password_ok) THEN
+            IF r.password IS NOT NULL THEN
+                attributes := attributes || format(' PASSWORD %%L', r.password);
+            END IF;
+            EXECUTE format('ALTER ROLE %%I', r.rolname) || attributes;
+            UPDATE sact_roles SET status = 'altered' WHERE rolname = r.rolname;
+        END IF;
+    END LOOP;
+
+    -- Memberships are granted once every role exists.
+    FOR r IN SELECT * FROM sact_roles LOOP
+        FOREACH parent IN ARRAY r.member_of LOOP
+            IF NOT EXISTS (SELECT 1
+                           FROM pg_auth_members m
+                           JOIN pg_roles g ON g.oid = m.roleid
+                           JOIN pg_roles u ON u.oid = m.member
+                           WHERE g.rolname = parent AND u.rolname = r.rolname) THEN
+                EXECUTE format('GRANT %%I TO %%I', parent, r.rolname);
+                UPDATE sact_roles SET status = 'altered'
+                WHERE rolname = r.rolname AND status = 'unchanged';
+            END IF;
+        END LOOP;
+    END LOOP;
+END
+$sact$;
+
+SELECT status, count(*) FROM sact_roles GROUP BY status;
+"""
+
+
+def provisioning_sql(roles, verifiers=None):
+    """Return the SQL script provisioning roles, to run in a transaction.
+
+    verifiers maps the names of the existing roles to their stored password
+    verifier: a declared password which does not match it is set again.
+
+    The script ends with a query returning (status, count) rows, status
+    being one of ``created``, ``altered`` and ``unchanged``.
+    """
+
+    verifiers = verifiers or {}
+    values = []
+    for role in roles:
+        password_ok = role.password is not None and \
+            password_matches(role.password, verifiers.get(role.name), role.name)
+        member_of = ', '.join(quote_literal(parent) for parent in role.member_of)
+        values.append('(%s, %s, %s, %s, %s, %s, %d, %s, ARRAY[%s]::name[], %s)' % (
+            quote_literal(role.name),
+            _bool(role.superuser),
+            _bool(role.createdb),
+            _bool(role.createrole),
+            _bool(role.login),
+            _bool(role.replication),
+            role.connection_limit,
+            quote_literal(role.password),
+            member_of,
+            _bool(password_ok)))
+
+    return PROVISIONING_SQL % {'values': ',\n'.join(values)}
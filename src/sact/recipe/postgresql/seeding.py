@@ -0,0 +1,197 @@
+"""Databases created and loaded with their fixtures by the recipe.
+
+A seeded database gets its schema from SQL files, then its data from CSV or
+COPY files, bulk loaded with ``COPY`` over several connections at once. The
+indexes of the loaded tables are dropped before the load and built again
+afterwards, which is much faster than maintaining them row by row; only the
+indexes backing constraints (primary keys, unique constraints, and the ones
+foreign keys reference) are kept. The foreign keys of the loaded tables are
+dropped during the load too, like pg_restore does: the tables are loaded in
+no particular order, and they are checked once when added back.
+
+A seeded database can be marked as a template, so that other databases are
+created from it with ``CREATE DATABASE ... TEMPLATE``, a file level copy,
+instead of being seeded again.
+"""
+
+import os
+
+from sact.recipe.postgresql.cache import hash_file, hash_inputs
+from sact.recipe.postgresql.roles import quote_literal
+
+
+DATA_FORMATS = {
+    '.csv': 'csv',
+    '.copy': 'text',
+    '.tsv': 'text',
+}
+
+
+class Database(object):
+    """A database declared in the ``databases`` option."""
+
+    def __init__(self, name, owner=None, schema=(), data=(), post=(), template=False, source=None):
+        self.name = name
+        self.owner = owner
+        self.schema = list(schema)
+        self.data = list(data)
+        self.post = list(post)
+        self.template = template
+        self.source = source
+
+    def __repr__(self):
+        return '<Database %s>' % self.name
+
+
+def parse_database(line, directory='.'):
+    """Parse a line of the ``databases`` option.
+
+    The syntax is the database name followed by ``owner=ROLE``,
+    ``schema=FILE,...``, ``data=FILE_OR_DIRECTORY,...``, ``post=FILE,...``,
+    ``from=DATABASE`` (to clone a template) and the ``template`` flag.
+    Relative paths are relative to directory.
+    """
+
+    words = line.split()
+    database = Database(words[0])
+    for word in words[1:]:
+        if word == 'template':
+            database.template = True
+            continue
+        if '=' not in word:
+            raise ValueError("Unknown database attribute %r for %s" % (word, database.name))
+
+        key, value = word.split('=', 1)
+        values = [os.path.join(directory, item) for item in value.split(',') if item]
+        if key == 'owner':
+            database.owner = value
+        elif key in ('schema', 'data', 'post'):
+            setattr(database, key, values)
+        elif key == 'from':
+            database.source = value
+        else:
+            raise ValueError("Unknown database setting %r for %s" % (key, database.name))
+
+    if database.source and (database.schema or database.data or database.post):
+        raise ValueError("%s is cloned from %s, it can not be seeded too" %
+                         (database.name, database.source))
+    return database
+
+
+def parse_databases(value, directory='.'):
+    """Parse the ``databases`` option: seeded databases come first."""
+
+    databases = [parse_database(line, directory) for line in value.splitlines()
+                 if line.strip() and not line.strip().startswith('#')]
+    return sorted(databases, key=lambda database: database.source is not None)
+
+
+def data_files(paths):
+    """Return the (table, path, format) of the data files.
+
+    Directories are expanded to the data files they contain. The table is
+    the name of the file without its extension, which may include a schema
+    (``public.users.csv``).
+    """
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            table, extension = os.path.splitext(os.path.basename(candidate))
+            if extension in DATA_FORMATS:
+                files.append((table, candidate, DATA_FORMATS[extension]))
+            elif not os.path.isdir(path):
+                raise ValueError("Unknown data format for %s, use one of %s" %
+                                 (path, ', '.join(sorted(DATA_FORMATS))))
+    return files
+
+
+def seed_hash(database, hasher=hash_file):
+    """Identify the content of a seeded database, by its inputs.
+
+    hasher returns the hash of a file, hash_file by default.
+    """
+
+    parts = [database.name, database.owner or '', database.source or '', str(database.template)]
+    for path in database.schema + database.post:
+        parts.append(hasher(path))
+    for table, path, fmt in data_files(database.data):
+        parts.extend([table, hasher(path)])
+    return hash_inputs(*parts)
+
+
+def quote_ident(name):
+    """Quote a (possibly schema qualified) name."""
+
+    return '.'.join('"%s"' % part.replace('"', '""') for part in name.split('.'))
+
+
+def create_sql(database):
+    sql = 'CREATE DATABASE %s' % quote_ident(database.name)
+    if database.source:
+        sql += ' TEMPLATE %s' % quote_ident(database.source)
+    if database.owner:
+        sql += ' OWNER %s' % quote_ident(database.owner)
+    return sql
+
+
+def file_script(path, owner=None):
+    """psql input running the SQL file path as owner.
+
+    The objects the file creates then belong to owner, not to the admin.
+    """
+
+    lines = []
+    if owner:
+        lines.append('SET ROLE %s;' % quote_ident(owner))
+    lines.append('\\i %s' % quote_literal(path))
+    return '\n'.join(lines) + '\n'
+
+
+def copy_sql(table, fmt):
+    if fmt == 'csv':
+        return 'COPY %s FROM STDIN WITH CSV HEADER' % quote_ident(table)
+    return 'COPY %s FROM STDIN' % quote_ident(table)
+
+
+def _regclasses(tables):
+    return ', '.join('%s::regclass' % quote_literal(quote_ident(table)) for table in tables)
+
+
+def secondary_indexes_sql(tables):
+    """Query listing the indexes of tables no constraint depends on.
+
+    Constraints refer to their index with ``conindid``: primary keys and
+    unique constraints to their own, foreign keys to the unique index of the
+    table they reference. Each row holds the qualified name of an index and
+    its definition.
+    """
+
+    regclasses = _regclasses(tables)
+    return ("SELECT i.indexrelid::regclass || chr(31) || pg_get_indexdef(i.indexrelid) "
+            "FROM pg_index i WHERE i.indrelid IN (%s) AND NOT EXISTS "
+            "(SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)" % regclasses)
+
+
+def foreign_keys_sql(tables):
+    """Query listing the foreign keys from or to tables.
+
+    Each row holds the qualified name of the table of a foreign key, the
+    quoted name of the constraint and its definition.
+    """
+
+    regclasses = _regclasses(tables)
+    return ("SELECT conrelid::regclass || chr(31) || quote_ident(conname) || chr(31) || "
+            "pg_get_constraintdef(oid) FROM pg_constraint WHERE contype = 'f' "
+            "AND (conrelid IN (%s) OR confrelid IN (%s))" % (regclasses, regclasses))
+
+
+def template_sql(name, is_template, version):
+    if version >= 9.5:
+        return 'ALTER DATABASE %s IS_TEMPLATE %s' % (quote_ident(name), 'true' if is_template else 'false')
+    return 'UPDATE pg_database SET datistemplate = %s WHERE datname = %s' % (
+        'true' if is_template else 'false', quote_literal(name))
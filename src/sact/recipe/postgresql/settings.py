@@ -0,0 +1,118 @@
+"""Catalog of the PostgreSQL settings, read from the binaries.
+
+``postgres --describe-config`` dumps the definition of every setting (name,
+context, category, type, default, bounds and descriptions) without needing a
+data directory nor a running server. The parsed catalog is cached per binary
+hash as gzipped JSON, so reading it again costs a few milliseconds.
+"""
+
+import errno
+import gzip
+import json
+import os
+import subprocess
+import tempfile
+
+from sact.recipe.postgresql.timing import Timings
+
+
+FIELDS = ('name', 'context', 'category', 'vartype', 'default', 'min', 'max',
+          'short_desc', 'extra_desc')
+
+
+class Setting(object):
+    """Definition of one server setting, as in the pg_settings view."""
+
+    def __init__(self, name, context, category, vartype, default,
+                 min=None, max=None, short_desc='', extra_desc='',
+                 unit=None, enumvals=None):
+        self.name = name
+        self.context = context
+        self.category = category
+        self.vartype = vartype
+        self.default = default
+        self.min = min
+        self.max = max
+        self.short_desc = short_desc
+        self.extra_desc = extra_desc
+        self.unit = unit
+        self.enumvals = enumvals
+
+    def __repr__(self):
+        return '<Setting %s = %r>' % (self.name, self.default)
+
+
+def parse_describe_config(output):
+    """Parse the tab separated output of ``postgres --describe-config``."""
+
+    settings = []
+    for line in output.split('\n'):
+        if not line.strip():
+            continue
+
+        fields = line.split('\t')
+        fields += [''] * (len(FIELDS) - len(fields))
+        values = dict(zip(FIELDS, fields))
+
+        vartype = values['vartype'].lower()
+        if vartype == 'boolean':
+            vartype = 'bool'
+            values['default'] = values['default'].lower()
+        elif vartype == 'int' or vartype == 'integer':
+            vartype = 'integer'
+
+        values['vartype'] = vartype
+        values['min'] = values['min'] or None
+        values['max'] = values['max'] or None
+        settings.append(Setting(**values))
+
+    return settings
+
+
+def describe_config(bin_dir, timings=None):
+    """Return the settings known by the postgres binary of bin_dir.
+
+    Raises OSError if the binary can not describe its settings (PostgreSQL
+    refuses to run as root, even for that).
+    """
+
+    timings = timings or Timings(None, None)
+    retcode, out, err = timings.communicate('postgres --describe-config',
+                                            [os.path.join(bin_dir, 'postgres'),
+                                             '--describe-config'],
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            universal_newlines=True)
+    if retcode != 0:
+        raise OSError("postgres --describe-config failed: %s" % err.strip())
+
+    return [setting for setting in parse_describe_config(out)
+            if setting.context != 'internal']
+
+
+def load_catalog(bin_dir, cache_dir, binary_hash, timings=None):
+    """Return the settings of the binaries, going through the cache."""
+
+    path = os.path.join(cache_dir, binary_hash + '.json.gz')
+    try:
+        with gzip.open(path, 'rb') as fd:
+            return [Setting(**values) for values in json.loads(fd.read().decode('utf-8'))]
+    except (IOError, OSError, ValueError):
+        pass
+
+    settings = describe_config(bin_dir, timings)
+
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=cache_dir)
+    os.close(fd)
+    with gzip.open(tmp, 'wb') as gz:
+        gz.write(json.dumps([vars(setting) for setting in settings],
+                            separators=(',', ':')).encode('utf-8'))
+    os.rename(tmp, path)
+
+    return settings
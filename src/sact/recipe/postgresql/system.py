@@ -0,0 +1,165 @@
+"""Discovery of the resources available to the current process."""
+
+import os
+
+
+def _read(path):
+    try:
+        with open(path) as fd:
+            return fd.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cgroup_cpu_limit():
+    """Return the CPU quota of our cgroup as a number of CPUs, or None.
+
+    Both the unified hierarchy (``cpu.max``) and the legacy one
+    (``cpu.cfs_quota_us`` / ``cpu.cfs_period_us``) are supported.
+    """
+
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, period = (cpu_max.split() + ['100000'])[:2]
+        if quota != 'max':
+            return float(quota) / float(period)
+        return None
+
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return float(quota) / float(period)
+
+    return None
+
+
+def available_cpus():
+    """Return how many CPUs we can actually keep busy, at least 1.
+
+    It takes into account the CPU affinity of the process and the cgroup CPU
+    quota, which are both lower than the host CPU count in containers.
+    """
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, int(limit + 0.5))
+
+    return max(cpus, 1)
+
+
+def _meminfo():
+    info = {}
+    content = _read('/proc/meminfo') or ''
+    for line in content.split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            words = value.split()
+            if words:
+                factor = 1024 if words[1:] == ['kB'] else 1
+                info[key] = int(words[0]) * factor
+    return info
+
+
+def cgroup_memory_limit():
+    """Return the memory limit of our cgroup in bytes, or None."""
+
+    for path in ('/sys/fs/cgroup/memory.max',
+                 '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        limit = _read(path)
+        if limit and limit != 'max':
+            limit = int(limit)
+            # cgroup v1 reports "unlimited" as a huge page-aligned value.
+            if limit < 2 ** 60:
+                return limit
+    return None
+
+
+def total_memory():
+    """Return the memory available to us in bytes, or None if unknown."""
+
+    memory = _meminfo().get('MemTotal')
+    if memory is None:
+        try:
+            memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (ValueError, OSError, AttributeError):
+            memory = None
+
+    limit = cgroup_memory_limit()
+    if limit is not None and (memory is None or limit < memory):
+        memory = limit
+    return memory
+
+
+def huge_pages():
+    """Return (number of reserved huge pages, huge page size in bytes)."""
+
+    info = _meminfo()
+    return info.get('HugePages_Total', 0), info.get('Hugepagesize', 0)
+
+
+def is_rotational(path):
+    """Tell whether path is stored on a rotational disk.
+
+    Returns None when it can not be found out, for instance on network or
+    virtual filesystems.
+    """
+
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+    device = os.stat(path).st_dev
+    sysfs = '/sys/dev/block/%d:%d' % (os.major(device), os.minor(device))
+
+    # Partitions do not have a queue, their parent device does.
+    for queue in (os.path.join(sysfs, 'queue'), os.path.join(sysfs, '..', 'queue')):
+        rotational = _read(os.path.join(queue, 'rotational'))
+        if rotational is not None:
+            return rotational == '1'
+    return None
+
+
+def filesystem_type(path):
+    """Return the type of the filesystem holding path (``tmpfs``, ``ext4``...).
+
+    path does not need to exist yet. Returns None if the mount table can not
+    be read.
+    """
+
+    content = _read('/proc/self/mounts') or _read('/proc/mounts')
+    if not content:
+        return None
+
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    path = os.path.realpath(path)
+
+    best, fstype = '', None
+    for line in content.split('\n'):
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # Spaces and such are escaped in octal in the mount table.
+        mountpoint = fields[1].replace('\\040', ' ')
+        if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) and \
+                len(mountpoint) >= len(best):
+            best, fstype = mountpoint, fields[2]
+    return fstype
+
+
+def free_space(path):
+    """Return the bytes available to us on the filesystem holding path."""
+
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
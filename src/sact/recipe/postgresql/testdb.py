@@ -0,0 +1,258 @@
+"""Isolated databases for the workers of parallel test runners.
+
+The recipe writes the connection parameters of its part to a JSON file (the
+``connection-file`` option). A test worker opens a DatabasePool on that file
+and a template database, typically one declared with the ``template`` flag
+of the ``databases`` option::
+
+    from sact.recipe.postgresql.testdb import DatabasePool
+
+    pool = DatabasePool.from_file('parts/pg/connection.json', 'fixtures')
+    with pool.database() as database:
+        connect(database.dsn)
+    pool.close()
+
+A background thread keeps ``size`` clones of the template ready, so that
+acquiring a database does not wait for ``CREATE DATABASE``, and drops the
+released databases. Databases are named after the template and the process
+id, so that workers never collide; the databases of processes which are no
+longer running, such as crashed workers, are dropped when a pool opens. The
+test processes must run on the host of the cluster.
+"""
+
+import contextlib
+import errno
+import hashlib
+import itertools
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+
+# Numbers the databases of all the pools of the process, so that pools on
+# the same template never pick the same name.
+_counter = itertools.count(1)
+
+
+def read_connection_info(path):
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def template_tag(template):
+    """Shorten template for database names, which are limited to 63 bytes."""
+
+    if len(template) <= 40:
+        return template
+    # Long templates sharing their first characters must not collide.
+    return '%s_%s' % (template[:31], hashlib.md5(template.encode('utf-8')).hexdigest()[:8])
+
+
+def leftovers_pattern(tag):
+    """Match the names of the databases of the pools on tag, capturing the pid."""
+
+    return re.compile(r'^%s_p(\d+)_\d+$' % re.escape(tag))
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class Database(object):
+    """A database handed to a test, with its connection parameters."""
+
+    def __init__(self, name, host, port, user):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.user = user
+
+    @property
+    def params(self):
+        return dict(host=self.host, port=self.port, user=self.user, dbname=self.name)
+
+    @property
+    def dsn(self):
+        return 'host=%s port=%d user=%s dbname=%s' % (self.host, self.port, self.user, self.name)
+
+    def __repr__(self):
+        return '<Database %s>' % self.name
+
+
+class DatabasePool(object):
+    """A warm pool of databases cloned from template.
+
+    acquire() returns a ready Database, release() hands it back to be dropped
+    in the background; close() waits for the background work and drops the
+    remaining databases. prefix replaces the template in the database names,
+    which always end with the process id and a counter.
+    """
+
+    def __init__(self, info, template, size=2, prefix=None):
+        self.info = info
+        self.template = template
+        self.size = size
+        # Workers sharing a prefix (e.g. a run id) still get names of their own.
+        tag = prefix or template_tag(template)
+        self.prefix = '%s_p%d' % (tag, os.getpid())
+        self._leftovers = leftovers_pattern(tag)
+        self.host = info['host'].split(',')[0].strip()
+        self.port = int(info['port'])
+        self.user = info['user']
+
+        self._lock = threading.Condition()
+        self._ready = []
+        self._released = []
+        self._cloning = 0
+        self._error = None
+        self._closing = False
+
+        self.drop_leftovers()
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def from_file(cls, path, template=None, size=2, prefix=None):
+        """Open a pool on the part whose connection file is path.
+
+        template defaults to the only template database of the part.
+        """
+
+        info = read_connection_info(path)
+        if template is None:
+            if len(info['templates']) != 1:
+                raise ValueError("The part has %d template databases, choose one of: %s" %
+                                 (len(info['templates']), ', '.join(info['templates'])))
+            template = info['templates'][0]
+        return cls(info, template, size, prefix)
+
+    def query(self, sql):
+        cmd = [os.path.join(self.info['bin_dir'], 'psql'),
+               '-h', self.host, '-p', str(self.port), '-U', self.user,
+               '-X', '--quiet', '--no-align', '--tuples-only', '-v', 'ON_ERROR_STOP=1',
+               '-c', sql, self.info['database']]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(err.strip())
+        return [line for line in out.split('\n') if line]
+
+    def drop(self, name):
+        # Tests may leave connections behind, they would block DROP DATABASE.
+        self.query("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                   "WHERE datname = '%s' AND pid <> pg_backend_pid()" % name.replace("'", "''"))
+        self.query('DROP DATABASE IF EXISTS %s' % quote_ident(name))
+
+    def drop_leftovers(self):
+        """Drop the databases left behind by the processes no longer running.
+
+        The databases of running processes, including the other pools of
+        this one, are in use and left alone.
+        """
+
+        for name in self.query('SELECT datname FROM pg_database'):
+            match = self._leftovers.match(name)
+            if match is not None and not process_running(int(match.group(1))):
+                self.drop(name)
+
+    def clone(self):
+        name = '%s_%d' % (self.prefix, next(_counter))
+        self.query('CREATE DATABASE %s TEMPLATE %s' % (quote_ident(name), quote_ident(self.template)))
+        return Database(name, self.host, self.port, self.user)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._closing and not self._released and \
+                        len(self._ready) + self._cloning >= self.size:
+                    self._lock.wait()
+                if self._closing and not self._released:
+                    return
+                # Refilling the pool comes first: a test may be waiting.
+                if not self._closing and len(self._ready) + self._cloning < self.size:
+                    self._cloning += 1
+                    action, database = 'clone', None
+                else:
+                    action, database = 'drop', self._released.pop(0)
+
+            try:
+                if action == 'clone':
+                    database = self.clone()
+                else:
+                    self.drop(database.name)
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                    self._closing = True
+                    self._lock.notify_all()
+                return
+            finally:
+                if action == 'clone':
+                    with self._lock:
+                        self._cloning -= 1
+                        if database is not None:
+                            self._ready.append(database)
+                        self._lock.notify_all()
+
+    def acquire(self, timeout=None):
+        """Return a database of the pool, waiting for one if it is empty."""
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while not self._ready:
+                if self._error is not None:
+                    raise RuntimeError("Unable to clone %s: %s" % (self.template, self._error))
+                if self._closing:
+                    raise RuntimeError("The pool is closed")
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError("No database of %s ready in %ss" % (self.template, timeout))
+                self._lock.wait(remaining)
+            database = self._ready.pop(0)
+            self._lock.notify_all()
+            return database
+
+    def release(self, database):
+        """Give back a database: it is dropped in the background."""
+
+        with self._lock:
+            self._released.append(database)
+            self._lock.notify_all()
+
+    @contextlib.contextmanager
+    def database(self, timeout=None):
+        database = self.acquire(timeout)
+        try:
+            yield database
+        finally:
+            self.release(database)
+
+    def close(self):
+        """Stop the background thread and drop every database of the pool."""
+
+        with self._lock:
+            self._closing = True
+            self._lock.notify_all()
+        self._thread.join()
+        for database in self._ready + self._released:
+            self.drop(database.name)
+        self._ready, self._released = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,59 @@
+"""Tests of the settings derived from the hardware."""
+
+import unittest
+
+from sact.recipe.postgresql import autotune
+from sact.recipe.postgresql.autotune import MB, Resources
+
+
+def values(settings):
+    return dict((name, value) for name, value, explanation in settings)
+
+
+class TuneTests(unittest.TestCase):
+
+    def test_oltp(self):
+        settings = values(autotune.tune('oltp', Resources(8, 16384 * MB, huge_pages=2048,
+                                                          huge_page_size=2 * MB,
+                                                          rotational=False)))
+        self.assertEqual(settings['shared_buffers'], '4096MB')
+        self.assertEqual(settings['effective_cache_size'], '12288MB')
+        self.assertEqual(settings['maintenance_work_mem'], '1024MB')
+        # (16384 - 4096) / (100 * 3) / 4 workers
+        self.assertEqual(settings['work_mem'], '10MB')
+        self.assertEqual(settings['wal_buffers'], '16MB')
+        self.assertEqual(settings['huge_pages'], 'try')
+        self.assertEqual(settings['random_page_cost'], '1.1')
+        self.assertEqual(settings['max_worker_processes'], '8')
+        self.assertEqual(settings['max_parallel_workers_per_gather'], '4')
+
+    def test_ci(self):
+        settings = values(autotune.tune('ci', Resources(2, 2048 * MB, rotational=True)))
+        self.assertEqual(settings['shared_buffers'], '128MB')
+        self.assertEqual(settings['maintenance_work_mem'], '64MB')
+        self.assertEqual(settings['work_mem'], '6MB')
+        self.assertEqual(settings['synchronous_commit'], 'off')
+        self.assertEqual(settings['random_page_cost'], '4.0')
+        self.assertEqual(settings['max_parallel_workers_per_gather'], '1')
+        self.assertNotIn('wal_buffers', settings)
+        self.assertNotIn('huge_pages', settings)
+
+    def test_olap_without_memory(self):
+        settings = values(autotune.tune('olap', Resources(16, None), max_connections=20))
+        self.assertNotIn('shared_buffers', settings)
+        self.assertNotIn('random_page_cost', settings)
+        self.assertEqual(settings['default_statistics_target'], '500')
+        self.assertEqual(settings['max_parallel_workers_per_gather'], '8')
+        self.assertEqual(settings['max_wal_size'], '16384MB')
+
+    def test_too_few_huge_pages(self):
+        settings = values(autotune.tune('mixed', Resources(4, 8192 * MB, huge_pages=10,
+                                                           huge_page_size=2 * MB)))
+        self.assertNotIn('huge_pages', settings)
+
+    def test_unknown_profile(self):
+        self.assertRaises(ValueError, autotune.tune, 'web', Resources(4, 8192 * MB))
+
+
+if __name__ == '__main__':
+    unittest.main()
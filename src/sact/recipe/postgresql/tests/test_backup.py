@@ -0,0 +1,83 @@
+"""Tests of the backup and restore commands and of the backups lookup."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import backup
+
+
+CONFIG = dict(bin_dir='/pg/bin', socketdir='/tmp/pg, /run/pg', port=5433, user='postgres',
+              directory=None, databases=[], jobs=None, compression=None)
+
+
+class CommandTests(unittest.TestCase):
+
+    def test_dump_command(self):
+        self.assertEqual(backup.dump_command(CONFIG, 'app', '/backups/1/app', 4, 'zstd:3'),
+                         ['/pg/bin/pg_dump', '-h', '/tmp/pg', '-p', '5433', '-U', 'postgres',
+                          '--format=directory', '--jobs=4', '--file=/backups/1/app',
+                          '--compress=zstd:3', 'app'])
+
+    def test_restore_command(self):
+        cmd = backup.restore_command(CONFIG, '/backups/1/app', 2, clean=True)
+        self.assertEqual(cmd[-4:], ['--dbname=postgres', '--clean', '--if-exists', '/backups/1/app'])
+        self.assertIn('--jobs=2', cmd)
+
+    def test_archive_settings(self):
+        settings = dict((name, value) for name, value, why in backup.archive_settings('/wal'))
+        self.assertEqual(settings['archive_mode'], 'on')
+        self.assertEqual(settings['archive_command'],
+                         'test ! -f "/wal/%f" && cp "%p" "/wal/%f"')
+
+    def test_throughput(self):
+        self.assertEqual(backup.throughput(10 * 1024 * 1024, 2), 5.0)
+        self.assertEqual(backup.throughput(1024, 0), None)
+
+
+class UserDatabasesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.psql = backup._psql
+
+    def tearDown(self):
+        backup._psql = self.psql
+
+    def test_databases(self):
+        backup._psql = lambda config, query: 'app\nreports'
+        self.assertEqual(backup.user_databases(CONFIG), ['app', 'reports'])
+
+    def test_no_database(self):
+        backup._psql = lambda config, query: ''
+        self.assertEqual(backup.user_databases(CONFIG), [])
+
+
+class FindBackupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make(self, name):
+        os.makedirs(os.path.join(self.directory, name))
+        open(os.path.join(self.directory, name, backup.MANIFEST), 'w').close()
+
+    def test_latest(self):
+        self.make('20240101-100000')
+        self.make('20240102-090000')
+        # Interrupted backups have no manifest.
+        os.makedirs(os.path.join(self.directory, '20240103-080000'))
+        self.assertEqual(backup.find_backup(self.directory, 'latest'),
+                         os.path.join(self.directory, '20240102-090000'))
+
+    def test_by_name(self):
+        self.make('20240101-100000')
+        self.assertEqual(backup.find_backup(self.directory, '20240101-100000'),
+                         os.path.join(self.directory, '20240101-100000'))
+
+    def test_no_backup(self):
+        self.assertRaises(ValueError, backup.find_backup, self.directory, 'latest')
+        self.assertRaises(ValueError, backup.find_backup, self.directory, 'missing')
@@ -0,0 +1,109 @@
+"""Tests of the pgbench workloads, latency percentiles and baselines."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import bench
+
+
+class WorkloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_builtin(self):
+        self.assertEqual(bench.workload_arguments('select-only'), ['-S'])
+
+    def test_relative_script(self):
+        with open('custom.sql', 'w') as fd:
+            fd.write('SELECT 1;\n')
+        args = bench.workload_arguments('custom.sql')
+        self.assertEqual(args, ['-f', os.path.join(os.path.realpath(self.directory), 'custom.sql')])
+
+        # pgbench runs in another directory, where the script must be found.
+        os.chdir(tempfile.gettempdir())
+        self.assertTrue(os.path.isfile(args[1]))
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, bench.workload_arguments, 'missing.sql')
+
+
+class LatencyTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        generator = random.Random(42)
+        latencies = [generator.expovariate(1 / 5.0) for index in range(20000)]
+        histogram = bench.LatencyHistogram()
+        for latency in latencies:
+            histogram.add(latency)
+
+        latencies.sort()
+        self.assertEqual(histogram.count, len(latencies))
+        self.assertAlmostEqual(histogram.average, sum(latencies) / len(latencies))
+        for rank in bench.PERCENTILES:
+            exact = latencies[int(round(rank / 100.0 * (len(latencies) - 1)))]
+            self.assertAlmostEqual(histogram.percentile(rank) / exact, 1, delta=0.01)
+        self.assertEqual(histogram.percentile(100), latencies[-1])
+        self.assertEqual(histogram.percentile(0), latencies[0])
+
+    def test_bounded_memory(self):
+        histogram = bench.LatencyHistogram()
+        for index in range(100000):
+            histogram.add(1 + index % 1000 / 100.0)
+        self.assertTrue(len(histogram.buckets) < 300)
+
+    def test_empty(self):
+        histogram = bench.LatencyHistogram()
+        self.assertEqual(histogram.percentile(95), None)
+        self.assertEqual(histogram.average, None)
+
+    def test_read_latencies(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'pgbench_log.123'), 'w') as fd:
+                fd.write('0 1 1500 0 1700000000 100\n'
+                         '0 2 skipped 0 1700000000 200\n'
+                         '1 1 2500 0 1700000000 300\n')
+            with open(os.path.join(directory, 'pgbench_log.123.1'), 'w') as fd:
+                fd.write('2 1 500 0 1700000000 400\n')
+            histogram = bench.read_latencies(directory)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual((histogram.min, histogram.max), (0.5, 2.5))
+        self.assertAlmostEqual(histogram.percentile(50), 1.5, delta=0.015)
+
+
+def report(tps, p95, settings=None):
+    return dict(version='16.2', settings=settings or {'work_mem': '4MB'},
+                results=[dict(workload='select-only', clients=4, tps=tps,
+                              latency=dict(p95=p95))])
+
+
+class CompareTests(unittest.TestCase):
+
+    def test_within_threshold(self):
+        self.assertEqual(bench.compare(report(980.0, 2.05), report(1000.0, 2.0), 0.05), [])
+
+    def test_tps_drop(self):
+        regressions = bench.compare(report(900.0, 2.0), report(1000.0, 2.0), 0.05)
+        self.assertEqual(regressions, ['select-only with 4 clients: 900.0 tps, baseline 1000.0 tps'])
+
+    def test_latency_rise(self):
+        regressions = bench.compare(report(1000.0, 2.5), report(1000.0, 2.0), 0.05)
+        self.assertEqual(regressions,
+                         ['select-only with 4 clients: p95 latency 2.50 ms, baseline 2.00 ms'])
+
+    def test_new_workload(self):
+        baseline = report(1000.0, 2.0)
+        baseline['results'] = []
+        self.assertEqual(bench.compare(report(10.0, 50.0), baseline, 0.05), [])
@@ -0,0 +1,65 @@
+"""Tests of the manifests of the binary bundles."""
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import bundle
+from sact.recipe.postgresql.timing import Timings
+
+
+class BundleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.location, 'bin'))
+        postgres = os.path.join(self.location, 'bin', 'postgres')
+        with open(postgres, 'w') as fd:
+            fd.write('#!/bin/sh\necho "postgres (PostgreSQL) 16.2"\n')
+        os.chmod(postgres, os.stat(postgres).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def write_manifest(self):
+        content = bundle.manifest(self.location, '16.2', 'a' * 64)
+        with open(os.path.join(self.location, bundle.MANIFEST), 'w') as fd:
+            json.dump(content, fd)
+        return content
+
+    def test_server_version_is_timed(self):
+        timings = Timings(None, 'pg')
+        self.assertEqual(bundle.server_version(self.location, timings), '16.2')
+        self.assertEqual([(record['name'], record['status']) for record in timings.records],
+                         [('postgres', 0)])
+
+    def test_verify(self):
+        content = self.write_manifest()
+        self.assertEqual(sorted(content['files']), ['bin/postgres'])
+        self.assertEqual(bundle.verify(self.location)['version'], '16.2')
+
+    def test_verify_changed_file(self):
+        self.write_manifest()
+        with open(os.path.join(self.location, 'bin', 'postgres'), 'a') as fd:
+            fd.write('# patched\n')
+        self.assertRaises(bundle.BundleError, bundle.verify, self.location)
+
+    def test_verify_missing_file(self):
+        self.write_manifest()
+        os.remove(os.path.join(self.location, 'bin', 'postgres'))
+        self.assertRaises(bundle.BundleError, bundle.verify, self.location)
+
+    def test_not_a_bundle(self):
+        self.assertEqual(bundle.verify(self.location), None)
+
+    def test_not_elf(self):
+        self.assertFalse(bundle.is_elf(os.path.join(self.location, 'bin', 'postgres')))
+        self.assertFalse(bundle.is_elf(os.path.join(self.location, 'missing')))
+
+    def test_run_failure(self):
+        self.assertRaises(bundle.BundleError, bundle._run, ['false'], Timings(None, 'pg'))
+        self.assertRaises(bundle.BundleError, bundle._run,
+                          [os.path.join(self.location, 'missing')], Timings(None, 'pg'))
@@ -0,0 +1,89 @@
+"""Tests of the content-addressed cache directories."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import cache
+
+
+class HelpersTests(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(cache.parse_size(''), None)
+        self.assertEqual(cache.parse_size('512'), 512)
+        self.assertEqual(cache.parse_size('512MB'), 512 * 1024 ** 2)
+        self.assertEqual(cache.parse_size(' 10 g '), 10 * 1024 ** 3)
+        self.assertRaises(ValueError, cache.parse_size, '10 GiB')
+
+    def test_hash_inputs(self):
+        self.assertEqual(cache.hash_inputs('a', b'b'), cache.hash_inputs(b'a', 'b'))
+        self.assertNotEqual(cache.hash_inputs('ab', 'c'), cache.hash_inputs('a', 'bc'))
+
+
+class CacheDirectoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, 'source')
+        os.makedirs(os.path.join(self.source, 'bin'))
+        with open(os.path.join(self.source, 'bin', 'postgres'), 'w') as fd:
+            fd.write('x' * 100)
+        os.symlink('postgres', os.path.join(self.source, 'bin', 'postmaster'))
+        self.root = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_publish_and_lookup(self):
+        directory = cache.CacheDirectory(self.root)
+        self.assertEqual(directory.lookup('key'), None)
+
+        path = directory.publish('key', self.source, version='16.2')
+        self.assertEqual(directory.lookup('key'), path)
+        self.assertEqual(os.readlink(os.path.join(path, 'bin', 'postmaster')), 'postgres')
+        with open(os.path.join(self.root, 'key.json')) as fd:
+            info = json.load(fd)
+        # The file, and the 8 bytes of the link.
+        self.assertEqual((info['key'], info['size'], info['version']), ('key', 108, '16.2'))
+        self.assertEqual(directory.publish('key', self.tmp), path)
+
+        directory.remove('key')
+        self.assertEqual(directory.lookup('key'), None)
+        self.assertEqual(sorted(os.listdir(self.root)), ['.locks'])
+
+    def test_lookup_ignores_entries_without_metadata(self):
+        directory = cache.CacheDirectory(self.root)
+        os.makedirs(directory.path('key'))
+        self.assertEqual(directory.lookup('key'), None)
+        directory.publish('key', self.source)
+        self.assertTrue(os.path.exists(os.path.join(directory.path('key'), 'bin', 'postgres')))
+
+    def test_evict_least_recently_used(self):
+        directory = cache.CacheDirectory(self.root, max_size=250)
+        for index, key in enumerate(('old', 'used', 'new')):
+            directory.publish(key, self.source)
+            os.utime(os.path.join(self.root, key + '.json'), (1000 + index, 1000 + index))
+        # 'old' was evicted when 'new' went over 250 bytes.
+        self.assertEqual([key for last_use, size, key in directory.entries()], ['used', 'new'])
+
+        directory.lookup('used')
+        directory.max_size = 150
+        directory.evict()
+        self.assertEqual([key for last_use, size, key in directory.entries()], ['used'])
+
+    def test_evict_skips_locked_entries(self):
+        directory = cache.CacheDirectory(self.root)
+        directory.publish('busy', self.source)
+        directory.publish('free', self.source)
+        os.utime(os.path.join(self.root, 'busy.json'), (1000, 1000))
+        directory.max_size = 100
+        with directory.lock('busy'):
+            directory.evict()
+        self.assertEqual([key for last_use, size, key in directory.entries()], ['busy'])
+
+
+if __name__ == '__main__':
+    unittest.main()
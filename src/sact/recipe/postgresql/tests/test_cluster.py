@@ -0,0 +1,61 @@
+"""Tests of the creation of database clusters."""
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import cluster
+from sact.recipe.postgresql.timing import Timings
+
+
+class ClusterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.bin_dir = tempfile.mkdtemp()
+        self.calls = os.path.join(self.bin_dir, 'calls')
+
+    def tearDown(self):
+        shutil.rmtree(self.bin_dir)
+
+    def write_pg_resetwal(self, help):
+        script = os.path.join(self.bin_dir, 'pg_resetwal')
+        with open(script, 'w') as fd:
+            fd.write('#!/bin/sh\n'
+                     'if [ "$1" = --help ]; then echo "%s"; exit 0; fi\n'
+                     'echo "$@" >> %s\n' % (help, self.calls))
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+    def test_initdb_arguments(self):
+        self.assertEqual(cluster.initdb_arguments({'locale': 'C', 'ephemeral': 'yes',
+                                                   'initdb-options': '-k --no-instructions'}),
+                         ['--locale=C', '--no-sync', '-k', '--no-instructions'])
+
+    def test_new_system_identifier(self):
+        first, second = cluster.new_system_identifier(), cluster.new_system_identifier()
+        self.assertNotEqual(first, second)
+        self.assertTrue(0 < first < 2 ** 64)
+
+    def test_reset_system_identifier(self):
+        self.write_pg_resetwal('  --system-identifier=SYSID  set system identifier')
+        timings = Timings(None, None)
+        self.assertTrue(cluster.reset_system_identifier(self.bin_dir, '/data',
+                                                        timings=timings))
+        with open(self.calls) as fd:
+            args = fd.read().split()
+        self.assertTrue(args[0].startswith('--system-identifier='))
+        self.assertEqual(args[1:], ['-D', '/data'])
+        self.assertEqual([record['name'] for record in timings.records],
+                         ['pg_resetwal --help', 'pg_resetwal'])
+
+    def test_reset_system_identifier_unsupported(self):
+        self.write_pg_resetwal('  -x, --next-transaction-id=XID  set next transaction ID')
+        self.assertFalse(cluster.reset_system_identifier(self.bin_dir, '/data'))
+        self.assertFalse(os.path.exists(self.calls))
+        os.remove(os.path.join(self.bin_dir, 'pg_resetwal'))
+        self.assertFalse(cluster.reset_system_identifier(self.bin_dir, '/data'))
+
+
+if __name__ == '__main__':
+    unittest.main()
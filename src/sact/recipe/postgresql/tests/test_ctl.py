@@ -0,0 +1,62 @@
+"""Tests of the control script of the clusters."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import ctl
+
+
+# Not running on any host: pids are limited to 2 ** 22.
+DEAD_PID = 2 ** 22 + 1
+
+
+class StatusTests(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.config = dict(datadir=self.datadir, bin_dir='/pg/bin', timeout=1,
+                           poll_interval=0.01, poll_max=0.1)
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def write_pid_file(self, pid, status='ready'):
+        with open(os.path.join(self.datadir, 'postmaster.pid'), 'w') as fd:
+            fd.write('%d\n%s\n1700000000\n5432\n/tmp\nlocalhost\n  5432001  0\n%s\n' %
+                     (pid, self.datadir, status))
+
+    def test_not_running(self):
+        self.assertEqual(ctl.status(self.config), ctl.NOT_RUNNING)
+        self.assertEqual(ctl.reload(self.config), ctl.NOT_RUNNING)
+        self.assertEqual(ctl.stop(self.config), 0)
+
+    def test_stale_pid_file(self):
+        self.write_pid_file(DEAD_PID)
+        self.assertEqual(ctl.status(self.config), ctl.NOT_RUNNING)
+
+    def test_running(self):
+        self.write_pid_file(os.getpid())
+        self.assertEqual(ctl.status(self.config), 0)
+
+    def test_usage(self):
+        self.assertEqual(ctl.main(self.config, ['frobnicate']), 2)
+        self.assertEqual(ctl.main(self.config, ['status']), ctl.NOT_RUNNING)
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_no_buildout_import(self):
+        """The control script does not pay for importing the recipe."""
+
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, sact.recipe.postgresql.ctl; '
+             'print(sorted(name for name in sys.modules if name.startswith("zc.") '
+             'or name == "sact.recipe.postgresql.recipe"))'],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+            universal_newlines=True)
+        self.assertEqual(out.strip(), '[]')
@@ -0,0 +1,153 @@
+"""Tests of the resumable downloads, against a local HTTP server."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from sact.recipe.postgresql import download
+
+
+ARCHIVE = os.urandom(64 * 1024 + 17)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.ranges = True
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path='/archive.tar.gz'):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        requested = self.headers.get('Range')
+        self.server.requests.append((self.path, requested))
+        if self.path != '/archive.tar.gz':
+            self.send_error(404)
+            return
+
+        start, end = 0, len(ARCHIVE) - 1
+        if requested and self.server.ranges:
+            first, last = requested.split('=', 1)[1].split('-')
+            start = int(first)
+            if last:
+                end = min(int(last), end)
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(ARCHIVE)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(ARCHIVE[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive')
+        self.min_chunk_size = download.MIN_CHUNK_SIZE
+        download.MIN_CHUNK_SIZE = 1024
+
+    def tearDown(self):
+        download.MIN_CHUNK_SIZE = self.min_chunk_size
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def write(self, path, data):
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+    def test_resume(self):
+        self.write(self.path, ARCHIVE[:1000])
+        download.fetch_chunked(self.server.url(), self.path, 5, 1)
+        self.assertEqual(self.read(self.path), ARCHIVE)
+        self.assertEqual(self.server.requests, [('/archive.tar.gz', 'bytes=1000-')])
+
+    def test_resume_chunks(self):
+        download.fetch_chunked(self.server.url(), self.path, 5, 4)
+        self.assertEqual(self.read(self.path), ARCHIVE)
+        self.assertEqual(os.listdir(self.directory), ['archive'])
+
+        # An interrupted download: the first range is complete, the second
+        # one half fetched.
+        step = -(-len(ARCHIVE) // 4)
+        os.remove(self.path)
+        self.write(self.path + '.layout', ('%d 4' % len(ARCHIVE)).encode('ascii'))
+        self.write(self.path + '.0', ARCHIVE[:step])
+        self.write(self.path + '.1', ARCHIVE[step:step + 100])
+        del self.server.requests[:]
+        download.fetch_chunked(self.server.url(), self.path, 5, 4)
+        self.assertEqual(self.read(self.path), ARCHIVE)
+        self.assertEqual(sorted(requested for path, requested in self.server.requests),
+                         sorted(['bytes=0-0',
+                                 'bytes=%d-%d' % (step + 100, 2 * step - 1),
+                                 'bytes=%d-%d' % (2 * step, 3 * step - 1),
+                                 'bytes=%d-%d' % (3 * step, len(ARCHIVE) - 1)]))
+
+    def test_layout_changed(self):
+        # Ranges left by a download in 3 chunks of another archive.
+        self.write(self.path + '.layout', b'1000 3')
+        for index in range(3):
+            self.write('%s.%d' % (self.path, index), b'x' * 334)
+        download.fetch_chunked(self.server.url(), self.path, 5, 4)
+        self.assertEqual(self.read(self.path), ARCHIVE)
+        self.assertEqual(os.listdir(self.directory), ['archive'])
+
+    def test_no_range_support(self):
+        self.server.ranges = False
+        self.write(self.path, b'garbage')
+        download.fetch_chunked(self.server.url(), self.path, 5, 4)
+        self.assertEqual(self.read(self.path), ARCHIVE)
+
+    def test_mirror_fallback(self):
+        cache = download.ArchiveCache(self.directory)
+        sha256 = hashlib.sha256(ARCHIVE).hexdigest()
+        path = cache.fetch([self.server.url('/missing.tar.gz'), self.server.url()], sha256)
+        self.assertEqual(path, os.path.join(self.directory, 'sha256', sha256))
+        self.assertEqual(self.read(path), ARCHIVE)
+
+        # Later lookups do not touch the network.
+        del self.server.requests[:]
+        self.assertEqual(cache.fetch([self.server.url()], sha256), path)
+        self.assertEqual(self.server.requests, [])
+
+    def test_hash_mismatch(self):
+        cache = download.ArchiveCache(self.directory)
+        self.assertRaises(download.DownloadError, cache.fetch, [self.server.url()], '0' * 64)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'partial')), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'sha256')))
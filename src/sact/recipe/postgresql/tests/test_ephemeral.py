@@ -0,0 +1,49 @@
+"""Tests of the ephemeral cluster profile."""
+
+import unittest
+
+from sact.recipe.postgresql import ephemeral, system
+from sact.recipe.postgresql.ephemeral import MB
+
+
+class EphemeralTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fstype, self.free = 'tmpfs', 1024 * MB
+        self._filesystem_type, self._free_space = system.filesystem_type, system.free_space
+        system.filesystem_type = lambda path: self.fstype
+        system.free_space = lambda path: self.free
+
+    def tearDown(self):
+        system.filesystem_type, system.free_space = self._filesystem_type, self._free_space
+
+    def test_default_directory(self):
+        first = ephemeral.default_directory('pg', '/srv/a/parts/pg')
+        self.assertTrue(first.startswith('/dev/shm/sact.recipe.postgresql/pg-'))
+        self.assertNotEqual(first, ephemeral.default_directory('pg', '/srv/b/parts/pg'))
+
+    def test_check_volatile(self):
+        ephemeral.check_volatile('/dev/shm/pg')
+        self.fstype = 'ext4'
+        self.assertRaises(ValueError, ephemeral.check_volatile, '/srv/pg')
+        self.fstype = None
+        self.assertRaises(ValueError, ephemeral.check_volatile, '/srv/pg')
+
+    def test_check_room(self):
+        ephemeral.check_room('/dev/shm/pg', 512 * MB)
+        self.assertRaises(ValueError, ephemeral.check_room, '/dev/shm/pg', 2048 * MB)
+
+    def test_durability_settings(self):
+        settings = dict((name, value) for name, value, why in
+                        ephemeral.durability_settings(size=512 * MB))
+        self.assertEqual((settings['fsync'], settings['wal_level']), ('off', 'minimal'))
+        self.assertEqual(settings['max_wal_size'], '128MB')
+
+        settings = dict((name, value) for name, value, why in
+                        ephemeral.durability_settings(size=64 * MB, replication=True))
+        self.assertNotIn('wal_level', settings)
+        self.assertEqual(settings['max_wal_size'], '32MB')
+
+
+if __name__ == '__main__':
+    unittest.main()
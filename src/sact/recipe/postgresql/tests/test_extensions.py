@@ -0,0 +1,73 @@
+"""Tests of the extensions option and of the libraries loaded at start."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import extensions
+
+
+class ParseExtensionsTests(unittest.TestCase):
+
+    def test_parse(self):
+        parsed = extensions.parse_extensions('''
+            pg_stat_statements
+            pg_trgm preload
+            hypopg https://example.com/hypopg-1.4.0.tar.gz
+            pg_cron /src/pg_cron.tar.gz no-preload
+        ''')
+        self.assertEqual([(extension.name, extension.url, extension.preload, extension.contrib)
+                          for extension in parsed],
+                         [('pg_stat_statements', None, True, True),
+                          ('pg_trgm', None, True, True),
+                          ('hypopg', 'https://example.com/hypopg-1.4.0.tar.gz', False, False),
+                          ('pg_cron', '/src/pg_cron.tar.gz', False, False)])
+
+    def test_invalid_line(self):
+        self.assertRaises(ValueError, extensions.parse_extensions, 'hypopg latest')
+
+    def test_build_key(self):
+        extension = extensions.Extension('hypopg', 'https://example.com/hypopg.tar.gz')
+        self.assertNotEqual(extensions.build_key('binary-a', extension),
+                            extensions.build_key('binary-b', extension))
+
+
+class MergeLibrariesTests(unittest.TestCase):
+
+    def test_user_libraries_first(self):
+        self.assertEqual(extensions.merge_libraries('pg_cron, "timescaledb"',
+                                                    ['pg_stat_statements', 'auto_explain']),
+                         ['pg_cron', 'timescaledb', 'pg_stat_statements', 'auto_explain'])
+
+    def test_no_duplicates(self):
+        self.assertEqual(extensions.merge_libraries('auto_explain,pg_stat_statements',
+                                                    ['pg_stat_statements', 'auto_explain']),
+                         ['auto_explain', 'pg_stat_statements'])
+
+    def test_empty_value(self):
+        self.assertEqual(extensions.merge_libraries('', ['pg_stat_statements']),
+                         ['pg_stat_statements'])
+
+
+class InstalledTests(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def touch(self, *parts):
+        path = os.path.join(self.location, *parts)
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def test_create_sql_skips_libraries(self):
+        self.touch('share', 'postgresql', 'extension', 'pg_trgm.control')
+        self.touch('lib', 'auto_explain.so')
+        declared = [extensions.Extension('pg_trgm'), extensions.Extension('auto_explain')]
+        self.assertTrue(all(extensions.is_installed(self.location, extension)
+                            for extension in declared))
+        self.assertEqual(extensions.create_sql(self.location, declared),
+                         'CREATE EXTENSION IF NOT EXISTS "pg_trgm";\n')
@@ -0,0 +1,49 @@
+"""Tests of the clusters managed by one part."""
+
+import unittest
+
+from sact.recipe.postgresql import instance, pgconf
+
+
+BASE_TEXT = ("data_directory = '/var/pg'\n"
+             "port = 5433\n"
+             "unix_socket_directories = '/run/pg'\n"
+             "shared_buffers = 128MB\n")
+
+
+class InstanceTests(unittest.TestCase):
+
+    def test_instance_names(self):
+        self.assertEqual(instance.instance_names(' '), [None])
+        self.assertEqual(instance.instance_names('3'), ['1', '2', '3'])
+        self.assertEqual(instance.instance_names('main\nreports'), ['main', 'reports'])
+
+    def test_instance_conf(self):
+        base = pgconf.settings_dict(pgconf.parse(BASE_TEXT))
+        text = instance.instance_conf(BASE_TEXT, base, 'reports', 2,
+                                      overrides='shared_buffers = 1GB\n')
+        settings = pgconf.settings_dict(pgconf.parse(text))
+        self.assertEqual(settings['data_directory'], '/var/pg/reports')
+        self.assertEqual(settings['port'], '5435')
+        self.assertEqual(settings['unix_socket_directories'], '/run/pg/reports')
+        self.assertEqual(settings['shared_buffers'], '1GB')
+        self.assertTrue(text.startswith(BASE_TEXT + '\n# Instance reports\n'))
+
+    def test_instance_conf_explicit_paths(self):
+        base = {'data_directory': "'/var/pg'", 'unix_socket_directory': "'/tmp'"}
+        text = instance.instance_conf('', base, 'b', 1, datadir='/data/b', socketdir='/sock')
+        settings = pgconf.settings_dict(pgconf.parse(text))
+        self.assertEqual(settings, {'data_directory': '/data/b', 'port': '5433',
+                                    'unix_socket_directory': '/sock'})
+
+    def test_instance(self):
+        main = instance.Instance(None, BASE_TEXT, {'data_directory': "'/var/pg'",
+                                                   'unix_socket_directory': "'/tmp'"},
+                                 '/etc/pg', '/var/log/pg.log')
+        self.assertEqual((main.label, main.datadir, main.socketdir, main.port),
+                         ('main', '/var/pg', '/tmp', '5432'))
+        self.assertEqual(main.config_file, '/etc/pg/postgresql.conf')
+
+
+if __name__ == '__main__':
+    unittest.main()
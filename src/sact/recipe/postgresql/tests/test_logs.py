@@ -0,0 +1,143 @@
+"""Tests of the streaming log analyzer."""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import logs
+
+
+def record(message, database='app', query=''):
+    fields = [''] * 23
+    fields[logs.DATABASE] = database
+    fields[logs.MESSAGE] = message
+    fields[logs.QUERY] = query
+    return fields
+
+
+def csv_line(fields):
+    return ','.join('"%s"' % field.replace('"', '""') for field in fields) + '\n'
+
+
+class FingerprintTests(unittest.TestCase):
+
+    def test_constants(self):
+        self.assertEqual(logs.fingerprint("SELECT * FROM users  WHERE id = 42 AND name = 'it''s'; "),
+                         'SELECT * FROM users WHERE id = ? AND name = ?')
+        self.assertEqual(logs.fingerprint('select t1.a from t1 where b = $1 -- comment'),
+                         'select t1.a from t1 where b = ?')
+
+    def test_lists(self):
+        self.assertEqual(logs.fingerprint('SELECT 1 FROM t WHERE id IN (1, 2, 3)'),
+                         'SELECT ? FROM t WHERE id IN (...)')
+        self.assertEqual(logs.fingerprint("INSERT INTO t VALUES (1, 'a'), (2, 'b'), (3, 'c')"),
+                         'INSERT INTO t VALUES (...)')
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_bucket(self):
+        self.assertEqual(logs.BUCKETS[logs.bucket(0.05)], 0.1)
+        self.assertEqual(logs.BUCKETS[logs.bucket(1)], 1)
+        self.assertEqual(logs.BUCKETS[logs.bucket(7)], 10)
+        self.assertEqual(logs.BUCKETS[logs.bucket(10 ** 6)], float('inf'))
+
+    def test_percentile(self):
+        histogram = [0] * len(logs.BUCKETS)
+        self.assertEqual(logs.histogram_percentile(histogram, 50), None)
+        for duration in [0.4] * 90 + [40] * 9 + [4000]:
+            histogram[logs.bucket(duration)] += 1
+        self.assertEqual(logs.histogram_percentile(histogram, 50), 0.5)
+        self.assertEqual(logs.histogram_percentile(histogram, 95), 50)
+        self.assertEqual(logs.histogram_percentile(histogram, 100), 5000)
+        self.assertEqual(logs.format_histogram(histogram),
+                         '<=0.5ms:90  <=50ms:9  <=5s:1')
+
+
+class ReadTests(unittest.TestCase):
+
+    def test_multiline_and_partial_records(self):
+        first = csv_line(record('duration: 1.0 ms  statement: SELECT\n1'))
+        second = csv_line(record('checkpoint starting: time'))
+        data = (first + second + '"partial').encode('utf-8')
+        records = list(logs.read_records(io.BytesIO(data)))
+        self.assertEqual([fields[logs.MESSAGE] for offset, fields in records],
+                         ['duration: 1.0 ms  statement: SELECT\n1',
+                          'checkpoint starting: time'])
+        self.assertEqual([offset for offset, fields in records],
+                         [len(first), len(first) + len(second)])
+
+    def test_read_new(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'postgresql.csv')
+        with open(path, 'w') as fd:
+            fd.write(csv_line(record('duration: 2.0 ms  statement: SELECT 1')))
+
+        analyzer, positions = logs.Analyzer(), {}
+        self.assertEqual(logs.read_new(analyzer, directory, positions), 1)
+        self.assertEqual(logs.read_new(analyzer, directory, positions), 0)
+        with open(path, 'a') as fd:
+            fd.write(csv_line(record('duration: 4.0 ms  statement: SELECT 2')))
+        self.assertEqual(logs.read_new(analyzer, directory, positions), 1)
+        self.assertEqual([(stat['calls'], stat['total']) for stat in analyzer.top()],
+                         [(2, 6.0)])
+
+        os.remove(path)
+        logs.read_new(analyzer, directory, positions)
+        self.assertEqual(positions, {})
+
+
+class AnalyzerTests(unittest.TestCase):
+
+    def test_statements(self):
+        analyzer = logs.Analyzer()
+        for message in ('duration: 10.0 ms  statement: SELECT 1',
+                        'duration: 30.0 ms  statement: SELECT 2',
+                        'duration: 5.0 ms  parse <unnamed>: SELECT $1',
+                        'duration: 50.0 ms  execute <unnamed>: UPDATE t SET a = $1'):
+            analyzer.feed(record(message))
+        analyzer.feed(record('temporary file: path "base/pgsql_tmp/1", size 8192',
+                             query='UPDATE t SET a = 3'))
+
+        top = analyzer.top()
+        self.assertEqual([(stat['query'], stat['calls'], stat['total']) for stat in top],
+                         [('UPDATE t SET a = ?', 1, 50.0), ('SELECT ?', 2, 40.0)])
+        self.assertEqual(analyzer.top('mean')[0]['query'], 'UPDATE t SET a = ?')
+        self.assertEqual(top[0]['temp_bytes'], 8192)
+        self.assertEqual(analyzer.temp_files, dict(count=1, bytes=8192, max=8192))
+
+    def test_fingerprints_are_bounded(self):
+        analyzer = logs.Analyzer()
+        for index in range(logs.MAX_FINGERPRINTS + 10):
+            analyzer.feed(record('duration: 1.0 ms  statement: SELECT * FROM t%d' % index))
+        self.assertEqual(len(analyzer.statements), logs.MAX_FINGERPRINTS + 1)
+        self.assertEqual(analyzer.statements[logs.OTHER]['calls'], 10)
+
+    def test_events(self):
+        analyzer = logs.Analyzer()
+        for message in ('checkpoint starting: time wait',
+                        'checkpoint complete: wrote 100 buffers (0.6%); write=1.5 s, '
+                        'sync=0.5 s, total=2.5 s; sync files=3',
+                        'process 12 still waiting for ShareLock on transaction 7 after 1000.0 ms',
+                        'process 12 acquired ShareLock on transaction 7 after 1500.0 ms',
+                        'deadlock detected',
+                        'automatic vacuum of table "app.public.t": index scans: 0\n'
+                        'elapsed: 0.25 s'):
+            analyzer.feed(record(message))
+
+        self.assertEqual(analyzer.checkpoints['reasons'], {'time': 1, 'wait': 1})
+        self.assertEqual((analyzer.checkpoints['count'], analyzer.checkpoints['buffers'],
+                          analyzer.checkpoints['max']), (1, 100, 2.5))
+        self.assertEqual(analyzer.locks, dict(waits=1, acquired=1, wait_ms=1500.0,
+                                              max_ms=1500.0, deadlocks=1))
+        self.assertEqual(analyzer.autovacuum['tables'], {'app.public.t': [1, 0.25]})
+
+        restored = logs.Analyzer(analyzer.state())
+        self.assertEqual(restored.state(), analyzer.state())
+
+
+if __name__ == '__main__':
+    unittest.main()
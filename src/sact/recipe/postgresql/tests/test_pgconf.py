@@ -0,0 +1,123 @@
+"""Tests of the postgresql.conf parser and of the comparison of settings."""
+
+import unittest
+
+from sact.recipe.postgresql import pgconf
+from sact.recipe.postgresql.settings import Setting
+
+
+def setting(name, vartype, default, context='sighup', unit=None, min=None, max=None,
+            enumvals=None):
+    return Setting(name, context, 'Test', vartype, default, min=min, max=max, unit=unit,
+                   enumvals=enumvals)
+
+
+CATALOG = [
+    setting('shared_buffers', 'integer', '16384', 'postmaster', unit='8kB',
+            min='16', max='1073741823'),
+    setting('work_mem', 'integer', '4096', 'user', unit='kB', min='64', max='2147483647'),
+    setting('fsync', 'bool', 'on'),
+    setting('log_min_duration_statement', 'integer', '-1', 'superuser', unit='ms',
+            min='-1', max='2147483647'),
+    setting('wal_level', 'enum', 'replica', 'postmaster',
+            enumvals=['minimal', 'replica', 'logical']),
+    setting('random_page_cost', 'real', '4', 'user', min='0', max='1.79769e+308'),
+    setting('application_name', 'string', '', 'user'),
+]
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_unquote(self):
+        self.assertEqual(pgconf.unquote('128MB'), '128MB')
+        self.assertEqual(pgconf.unquote("'it''s'"), "it's")
+        self.assertEqual(pgconf.unquote(r"'a\tb\\c\101'"), 'a\tb\\cA')
+
+    def test_parse(self):
+        text = ("# comment\n"
+                "\n"
+                "Shared_Buffers = 128MB   # trailing comment\n"
+                "work_mem 8MB\n"
+                "application_name = 'my # app'\n"
+                "include_if_exists = 'local.conf'\n")
+        self.assertEqual(pgconf.parse(text),
+                         [('shared_buffers', '128MB', 3),
+                          ('work_mem', '8MB', 4),
+                          ('application_name', 'my # app', 5),
+                          ('include_if_exists', 'local.conf', 6)])
+
+    def test_parse_error(self):
+        self.assertRaises(pgconf.ConfigError, pgconf.parse, "fsync =\n")
+
+    def test_settings_dict(self):
+        entries = pgconf.parse("work_mem = 4MB\ninclude = 'a.conf'\nwork_mem = 8MB\n")
+        self.assertEqual(pgconf.settings_dict(entries), {'work_mem': '8MB'})
+
+
+class NormalizeTests(unittest.TestCase):
+
+    def test_bool(self):
+        self.assertEqual(pgconf.normalize('Yes', 'bool'), 'on')
+        self.assertEqual(pgconf.normalize('0', 'bool'), 'off')
+        self.assertRaises(pgconf.ConfigError, pgconf.normalize, 'maybe', 'bool')
+
+    def test_units(self):
+        self.assertEqual(pgconf.normalize('128MB', 'integer', '8kB'), 16384)
+        self.assertEqual(pgconf.normalize('16384', 'integer', '8kB'), 16384)
+        self.assertEqual(pgconf.normalize('1min', 'integer', 'ms'), 60000)
+        self.assertEqual(pgconf.normalize('1.5', 'real'), 1.5)
+        self.assertRaises(pgconf.ConfigError, pgconf.normalize, '1s', 'integer', 'kB')
+        self.assertRaises(pgconf.ConfigError, pgconf.normalize, '1parsec', 'integer', 'kB')
+        self.assertRaises(pgconf.ConfigError, pgconf.normalize, 'lots', 'integer', 'kB')
+
+    def test_enum(self):
+        self.assertEqual(pgconf.normalize(' Logical ', 'enum'), 'logical')
+
+
+class ValidateTests(unittest.TestCase):
+
+    def test_valid(self):
+        entries = pgconf.parse("shared_buffers = 1GB\nfsync = off\nwal_level = LOGICAL\n"
+                               "auto_explain.log_min_duration = 10\n")
+        self.assertEqual(pgconf.validate(entries, CATALOG), [])
+
+    def test_errors(self):
+        entries = pgconf.parse("shared_bufers = 1GB\n"
+                               "fsync = sometimes\n"
+                               "work_mem = 1kB\n"
+                               "wal_level = archive\n")
+        self.assertEqual(pgconf.validate(entries, CATALOG),
+                         ['line 1: unknown setting shared_bufers',
+                          "line 2: fsync: 'sometimes' is not a boolean",
+                          'line 3: work_mem = 1kB is out of range [64, 2147483647]',
+                          'line 4: wal_level = archive is not one of '
+                          'minimal, replica, logical'])
+
+
+class DiffTests(unittest.TestCase):
+
+    def setUp(self):
+        self.running = dict((item.name, item) for item in CATALOG)
+
+    def test_same_values_in_other_units(self):
+        self.assertEqual(pgconf.diff({'shared_buffers': '128MB', 'fsync': 'true',
+                                      'random_page_cost': '4.0'}, self.running), [])
+
+    def test_changes_and_resets(self):
+        changes = pgconf.diff({'shared_buffers': '256MB', 'work_mem': '8MB',
+                               'pg_stat_statements.max': '1000'},
+                              self.running, from_file=['fsync', 'shared_buffers'])
+        self.assertEqual(changes,
+                         [('shared_buffers', '16384', '256MB', 'postmaster'),
+                          ('work_mem', '4096', '8MB', 'user'),
+                          ('fsync', 'on', None, 'sighup')])
+        self.assertEqual(pgconf.needs_restart(changes), ['shared_buffers'])
+
+    def test_reload_only(self):
+        changes = pgconf.diff({'log_min_duration_statement': '250ms'}, self.running)
+        self.assertEqual(changes, [('log_min_duration_statement', '-1', '250ms', 'superuser')])
+        self.assertEqual(pgconf.needs_restart(changes), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
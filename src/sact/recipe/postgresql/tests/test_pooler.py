@@ -0,0 +1,98 @@
+"""Tests of the authentication files of the pooler."""
+
+import os
+import unittest
+
+from jinja2 import Template
+
+from sact.recipe.postgresql import pooler
+from sact.recipe.postgresql.roles import Role
+
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+
+
+def render(name, **context):
+    with open(os.path.join(TEMPLATES, name)) as fd:
+        return Template(fd.read()).render(**context)
+
+
+def hba_entries(text):
+    """Parse hba lines as (type, database, user, method)."""
+
+    entries = []
+    for line in text.splitlines():
+        words = line.split()
+        if not words or words[0].startswith(('#', ';')):
+            continue
+        method = words[3] if words[0] == 'local' else words[4]
+        entries.append((words[0], words[1], words[2], method))
+    return entries
+
+
+def first_match(entries, type, user):
+    for entry_type, database, entry_user, method in entries:
+        if entry_type == type and entry_user in (user, 'all'):
+            return method
+    return None
+
+
+class PoolerAuthTests(unittest.TestCase):
+
+    def setUp(self):
+        self.roles = [Role('postgres'),
+                      Role('app', password='secret'),
+                      Role('owner', superuser=True, password='s3cret'),
+                      Role('reader'),
+                      Role('group', login=False, password='unused')]
+
+    def test_auth_file(self):
+        self.assertEqual(pooler.auth_file(self.roles),
+                         '"postgres" ""\n"app" "secret"\n"owner" "s3cret"\n"reader" ""\n')
+
+    def test_client_hba(self):
+        entries = pooler.client_hba(self.roles, 'postgres')
+        self.assertEqual(entries, [('local', 'postgres', '', 'trust'),
+                                   ('local', 'app', '', 'md5'),
+                                   ('host', 'app', '0.0.0.0/0', 'md5'),
+                                   ('host', 'app', '::/0', 'md5'),
+                                   ('local', 'owner', '', 'md5'),
+                                   ('host', 'owner', '0.0.0.0/0', 'md5'),
+                                   ('host', 'owner', '::/0', 'md5')])
+
+    def test_never_trusted_over_tcp(self):
+        rendered = hba_entries(render('pgbouncer_hba.conf.tmpl',
+                                      entries=pooler.client_hba(self.roles, 'postgres')))
+        for type, database, user, method in rendered:
+            if type == 'host':
+                self.assertEqual(method, 'md5')
+                self.assertNotEqual(user, 'postgres')
+        self.assertEqual(first_match(rendered, 'local', 'reader'), None)
+
+    def test_files_work_together(self):
+        """Every role the pooler lets in can log in to the cluster through it."""
+
+        client = hba_entries(render('pgbouncer_hba.conf.tmpl',
+                                    entries=pooler.client_hba(self.roles, 'postgres')))
+        server = hba_entries(render('pg_hba.conf.tmpl', PG_VERSION='16',
+                                    admin='postgres', superusers=['owner'], users=['app'],
+                                    replication_user=None,
+                                    pooler_users=pooler.server_hba(self.roles)))
+        secrets = dict(line.replace('"', '').split(' ')
+                       for line in pooler.auth_file(self.roles).splitlines())
+
+        users = set(user for type, database, user, method in client)
+        self.assertEqual(users, set(['postgres', 'app', 'owner']))
+        for user in users:
+            # pgbouncer logs in on the socket of the cluster, as another Unix user.
+            method = first_match(server, 'local', user)
+            if method == 'md5':
+                self.assertTrue(secrets[user])
+            else:
+                self.assertEqual(method, 'trust')
+
+    def test_no_pooler(self):
+        server = hba_entries(render('pg_hba.conf.tmpl', PG_VERSION='16',
+                                    admin='postgres', superusers=[], users=['app'],
+                                    replication_user=None, pooler_users=[]))
+        self.assertEqual(first_match(server, 'local', 'app'), 'ident')
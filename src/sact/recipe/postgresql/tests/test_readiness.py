@@ -0,0 +1,104 @@
+"""Tests of the detection of a ready server."""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from sact.recipe.postgresql import readiness
+
+
+class PidFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.datadir)
+
+    def write_pid_file(self, pid, status=None):
+        lines = [str(pid), self.datadir, '1700000000', '5432', '/tmp', '*', '  1234  5678']
+        if status is not None:
+            lines.append(status.ljust(8))
+        with open(os.path.join(self.datadir, 'postmaster.pid'), 'w') as fd:
+            fd.write('\n'.join(lines) + '\n')
+
+    def test_missing(self):
+        self.assertEqual(readiness.server_pid(self.datadir), None)
+        self.assertEqual(readiness.pid_file_status(self.datadir), None)
+
+    def test_running(self):
+        self.write_pid_file(os.getpid(), 'ready')
+        self.assertEqual(readiness.server_pid(self.datadir), os.getpid())
+        self.assertEqual(readiness.pid_file_status(self.datadir), 'ready')
+
+    def test_before_postgresql_10(self):
+        self.write_pid_file(os.getpid())
+        self.assertEqual(readiness.pid_file_status(self.datadir), None)
+
+    def test_stale(self):
+        child = os.fork()
+        if not child:
+            os._exit(0)
+        os.waitpid(child, 0)
+        self.write_pid_file(child, 'ready')
+        self.assertEqual(readiness.server_pid(self.datadir), None)
+
+    def test_socket_path(self):
+        self.assertEqual(readiness.socket_path('/run/pg, /tmp', '5433'),
+                         '/run/pg/.s.PGSQL.5433')
+
+
+class ProbeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, '.s.PGSQL.5432')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+        self.received = []
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def answer(self, response):
+        def serve():
+            conn = self.server.accept()[0]
+            self.received.append(conn.recv(4096))
+            conn.sendall(response)
+            conn.close()
+        thread = threading.Thread(target=serve)
+        thread.start()
+        return thread
+
+    def probe(self, response):
+        thread = self.answer(response)
+        try:
+            return readiness.probe_socket(self.path, 'postgres')
+        finally:
+            thread.join()
+
+    def test_authentication_request(self):
+        self.assertTrue(self.probe(b'R\x00\x00\x00\x08\x00\x00\x00\x00'))
+        self.assertIn(b'user\x00postgres\x00database\x00template1\x00', self.received[0])
+
+    def test_starting_up(self):
+        self.assertFalse(self.probe(b'E\x00\x00\x00\x20SFATAL\x00C57P03\x00\x00'))
+
+    def test_other_error(self):
+        self.assertTrue(self.probe(b'E\x00\x00\x00\x20SFATAL\x00C28000\x00\x00'))
+
+    def test_no_server(self):
+        self.assertFalse(readiness.probe_socket(self.path + '.missing', 'postgres'))
+
+    def test_wait_until_ready_timeout(self):
+        self.assertRaises(readiness.NotReady, readiness.wait_until_ready, self.directory,
+                          '/nonexistent', 5432, 'postgres', timeout=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
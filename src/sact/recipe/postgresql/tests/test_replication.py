@@ -0,0 +1,73 @@
+"""Tests of the replication settings and commands."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import replication
+from sact.recipe.postgresql.instance import Instance
+
+
+def primary():
+    return Instance('main', '', {'data_directory': "'/var/pg'", 'port': '5433',
+                                 'unix_socket_directories': "'/run/pg, /tmp'"},
+                    '/etc/pg', '/var/log/pg.log')
+
+
+class ReplicationTests(unittest.TestCase):
+
+    def test_replica_names(self):
+        self.assertEqual(replication.replica_names(''), [])
+        self.assertEqual(replication.replica_names('0'), [])
+        self.assertEqual(replication.replica_names('2'), ['replica1', 'replica2'])
+        self.assertEqual(replication.replica_names('east west'), ['east', 'west'])
+
+    def test_slot_name(self):
+        self.assertEqual(replication.slot_name('East-1'), 'east_1')
+
+    def test_primary_settings(self):
+        settings = dict((name, value) for name, value, why in
+                        replication.primary_settings(['a', 'b'], 'sync'))
+        self.assertEqual(settings['max_wal_senders'], '4')
+        self.assertEqual(settings['max_replication_slots'], '4')
+        self.assertEqual(settings['synchronous_standby_names'], 'ANY 1 ("a", "b")')
+        settings = [name for name, value, why in replication.primary_settings(['a'], 'async')]
+        self.assertNotIn('synchronous_standby_names', settings)
+        self.assertRaises(ValueError, replication.primary_settings, ['a'], 'quorum')
+
+    def test_standby_settings(self):
+        settings = dict((name, value) for name, value, why in
+                        replication.standby_settings(primary(), 'East-1', 'replicator'))
+        self.assertEqual(settings['primary_conninfo'],
+                         'host=/run/pg port=5433 user=replicator application_name=East-1')
+        self.assertEqual(settings['primary_slot_name'], 'east_1')
+
+    def test_mark_standby(self):
+        datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, datadir)
+        replication.mark_standby(datadir, 16, primary(), 'r1', 'replicator')
+        self.assertEqual(os.listdir(datadir), ['standby.signal'])
+
+        os.remove(os.path.join(datadir, 'standby.signal'))
+        replication.mark_standby(datadir, 9.6, primary(), 'r1', 'replicator')
+        with open(os.path.join(datadir, 'recovery.conf')) as fd:
+            self.assertEqual(fd.read(),
+                             "standby_mode = 'on'\n"
+                             "primary_conninfo = 'host=/run/pg port=5433 user=replicator "
+                             "application_name=r1'\n"
+                             "primary_slot_name = 'r1'\n")
+
+    def test_basebackup_command(self):
+        cmd = replication.basebackup_command('/pg/bin', primary(), '/var/pg/r1', 'r1', 'rep')
+        self.assertEqual(cmd[:7], ['/pg/bin/pg_basebackup', '-D', '/var/pg/r1',
+                                   '-h', '/run/pg', '-p', '5433'])
+        self.assertEqual(cmd[-4:], ['--create-slot', '--slot', 'r1', '--no-password'])
+
+    def test_lsn_queries(self):
+        self.assertEqual(replication.lsn_queries(16)[0], 'SELECT pg_current_wal_lsn()')
+        self.assertEqual(replication.lsn_queries(9.6)[0], 'SELECT pg_current_xlog_location()')
+
+
+if __name__ == '__main__':
+    unittest.main()
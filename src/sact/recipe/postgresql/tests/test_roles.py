@@ -0,0 +1,87 @@
+"""Tests of the parsing and provisioning of the declared roles."""
+
+import base64
+import hashlib
+import hmac
+import unittest
+
+from sact.recipe.postgresql import roles
+
+
+def scram_verifier(password, salt=b'0123456789abcdef', iterations=4096):
+    """Compute a SCRAM-SHA-256 verifier the way the server stores it."""
+
+    salted = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    client_key = hmac.new(salted, b'Client Key', hashlib.sha256).digest()
+    server_key = hmac.new(salted, b'Server Key', hashlib.sha256).digest()
+    b64 = lambda data: base64.b64encode(data).decode('ascii')
+    return 'SCRAM-SHA-256$%d:%s$%s:%s' % (iterations, b64(salt),
+                                          b64(hashlib.sha256(client_key).digest()),
+                                          b64(server_key))
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_parse_role(self):
+        role = roles.parse_role('app createdb nologin connection-limit=5 password=s3cr=t in=a,b')
+        self.assertEqual((role.name, role.createdb, role.login, role.superuser),
+                         ('app', True, False, False))
+        self.assertEqual(role.connection_limit, 5)
+        self.assertEqual(role.password, 's3cr=t')
+        self.assertEqual(role.member_of, ['a', 'b'])
+
+    def test_parse_role_errors(self):
+        self.assertRaises(ValueError, roles.parse_role, 'app owner')
+        self.assertRaises(ValueError, roles.parse_role, 'app owner=me')
+
+    def test_parse_roles(self):
+        declared = roles.parse_roles({'admin': 'postgres',
+                                      'superusers': 'postgres root',
+                                      'users': 'app reader',
+                                      'roles': '# comment\n\napp createdb password=x\n'})
+        self.assertEqual([role.name for role in declared], ['root', 'app', 'reader'])
+        self.assertTrue(declared[0].superuser and declared[0].createrole)
+        self.assertTrue(declared[1].createdb)
+        self.assertEqual(declared[1].password, 'x')
+        self.assertFalse(declared[2].createdb)
+
+
+class PasswordTests(unittest.TestCase):
+
+    def test_md5(self):
+        verifier = 'md5' + hashlib.md5(b'secretapp').hexdigest()
+        self.assertTrue(roles.password_matches('secret', verifier, 'app'))
+        self.assertFalse(roles.password_matches('secret', verifier, 'other'))
+        self.assertFalse(roles.password_matches('wrong', verifier, 'app'))
+
+    def test_scram(self):
+        verifier = scram_verifier('secret')
+        self.assertTrue(roles.password_matches('secret', verifier, 'app'))
+        self.assertFalse(roles.password_matches('wrong', verifier, 'app'))
+        self.assertFalse(roles.password_matches('secret', 'SCRAM-SHA-256$broken', 'app'))
+
+    def test_missing_or_clear_text(self):
+        self.assertFalse(roles.password_matches('secret', None, 'app'))
+        self.assertTrue(roles.password_matches('secret', 'secret', 'app'))
+
+
+class ProvisioningTests(unittest.TestCase):
+
+    def test_values(self):
+        declared = [roles.Role('app', createdb=True, password="it's",
+                               member_of=['readers']),
+                    roles.Role('readers', login=False)]
+        sql = roles.provisioning_sql(declared)
+        self.assertIn("('app', false, true, false, true, false, -1, 'it''s', "
+                      "ARRAY['readers']::name[], false)", sql)
+        self.assertIn("('readers', false, false, false, false, false, -1, NULL, "
+                      "ARRAY[]::name[], false)", sql)
+
+    def test_matching_password_is_kept(self):
+        declared = [roles.Role('app', password='secret')]
+        sql = roles.provisioning_sql(declared, {'app': scram_verifier('secret')})
+        self.assertIn("'secret', ARRAY[]::name[], true)", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
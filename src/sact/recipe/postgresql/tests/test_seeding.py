@@ -0,0 +1,104 @@
+"""Tests of the declaration and seeding of databases."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import seeding
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_parse_database(self):
+        database = seeding.parse_database('app owner=web schema=a.sql,b.sql data=fixtures '
+                                          'template', '/buildout')
+        self.assertEqual(database.owner, 'web')
+        self.assertEqual(database.schema, ['/buildout/a.sql', '/buildout/b.sql'])
+        self.assertEqual(database.data, ['/buildout/fixtures'])
+        self.assertTrue(database.template)
+
+    def test_parse_errors(self):
+        self.assertRaises(ValueError, seeding.parse_database, 'app big')
+        self.assertRaises(ValueError, seeding.parse_database, 'app size=1')
+        self.assertRaises(ValueError, seeding.parse_database, 'copy from=app schema=a.sql')
+
+    def test_clones_come_last(self):
+        databases = seeding.parse_databases('copy from=app\n# comment\napp schema=a.sql\n')
+        self.assertEqual([database.name for database in databases], ['app', 'copy'])
+
+
+class DataFilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in ('users.csv', 'public.accounts.copy', 'README', 'b.tsv'):
+            open(os.path.join(self.directory, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_directory_order(self):
+        users = os.path.join(self.directory, 'users.csv')
+        self.assertEqual(seeding.data_files([users, self.directory]),
+                         [('users', users, 'csv'),
+                          ('b', os.path.join(self.directory, 'b.tsv'), 'text'),
+                          ('public.accounts', os.path.join(self.directory, 'public.accounts.copy'),
+                           'text'),
+                          ('users', users, 'csv')])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, seeding.data_files,
+                          [os.path.join(self.directory, 'README')])
+
+    def test_seed_hash(self):
+        hashes = {}
+        hasher = lambda path: hashes.setdefault(path, os.path.basename(path))
+        database = seeding.Database('app', schema=['/schema.sql'], data=[self.directory])
+        first = seeding.seed_hash(database, hasher)
+        self.assertEqual(seeding.seed_hash(database, hasher), first)
+        self.assertEqual(sorted(hashes), ['/schema.sql'] + [
+            os.path.join(self.directory, name)
+            for name in ('b.tsv', 'public.accounts.copy', 'users.csv')])
+
+        hashes['/schema.sql'] = 'changed'
+        self.assertNotEqual(seeding.seed_hash(database, hasher), first)
+        database.owner = 'web'
+        self.assertNotEqual(seeding.seed_hash(database, lambda path: path), first)
+
+
+class SqlTests(unittest.TestCase):
+
+    def test_quote_ident(self):
+        self.assertEqual(seeding.quote_ident('public.my"table'), '"public"."my""table"')
+
+    def test_create_sql(self):
+        self.assertEqual(seeding.create_sql(seeding.Database('copy', owner='web', source='app')),
+                         'CREATE DATABASE "copy" TEMPLATE "app" OWNER "web"')
+
+    def test_file_script(self):
+        self.assertEqual(seeding.file_script("/it's.sql", 'web'),
+                         'SET ROLE "web";\n\\i \'/it\'\'s.sql\'\n')
+
+    def test_copy_sql(self):
+        self.assertEqual(seeding.copy_sql('public.users', 'csv'),
+                         'COPY "public"."users" FROM STDIN WITH CSV HEADER')
+        self.assertEqual(seeding.copy_sql('users', 'text'), 'COPY "users" FROM STDIN')
+
+    def test_constraint_queries(self):
+        regclasses = "'\"users\"'::regclass, '\"public\".\"accounts\"'::regclass"
+        tables = ['users', 'public.accounts']
+        self.assertIn('i.indrelid IN (%s)' % regclasses, seeding.secondary_indexes_sql(tables))
+        self.assertIn('c.conindid = i.indexrelid', seeding.secondary_indexes_sql(tables))
+        self.assertIn("contype = 'f' AND (conrelid IN (%s) OR confrelid IN (%s))" % (
+            regclasses, regclasses), seeding.foreign_keys_sql(tables))
+
+    def test_template_sql(self):
+        self.assertEqual(seeding.template_sql('app', True, 16),
+                         'ALTER DATABASE "app" IS_TEMPLATE true')
+        self.assertEqual(seeding.template_sql('app', False, 9.4),
+                         "UPDATE pg_database SET datistemplate = false WHERE datname = 'app'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Tests of the settings catalog read from the binaries."""
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from sact.recipe.postgresql import settings
+from sact.recipe.postgresql.timing import Timings
+
+
+OUTPUT = ('shared_buffers\tpostmaster\tResource Usage / Memory\tINTEGER\t1024\t16\t1073741823\t'
+          'Sets the number of shared memory buffers.\t\n'
+          'fsync\tsighup\tWrite-Ahead Log / Settings\tBOOLEAN\tTRUE\t\t\t'
+          'Forces synchronization of updates to disk.\tThe server will use fsync().\n'
+          '\n'
+          'block_size\tinternal\tPreset Options\tINTEGER\t8192\t8192\t8192\tBlock size.\n'
+          'application_name\tuser\tReporting and Logging\tSTRING\t\n')
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_parse_describe_config(self):
+        parsed = settings.parse_describe_config(OUTPUT)
+        self.assertEqual([setting.name for setting in parsed],
+                         ['shared_buffers', 'fsync', 'block_size', 'application_name'])
+
+        shared_buffers, fsync = parsed[:2]
+        self.assertEqual((shared_buffers.vartype, shared_buffers.default,
+                          shared_buffers.min, shared_buffers.max),
+                         ('integer', '1024', '16', '1073741823'))
+        self.assertEqual((fsync.vartype, fsync.default, fsync.min, fsync.max),
+                         ('bool', 'true', None, None))
+        self.assertEqual(fsync.extra_desc, 'The server will use fsync().')
+        self.assertEqual((parsed[3].default, parsed[3].short_desc), ('', ''))
+
+
+class CatalogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.postgres = os.path.join(self.tmp, 'postgres')
+        self.output = os.path.join(self.tmp, 'output')
+        with open(self.output, 'w') as fd:
+            fd.write(OUTPUT)
+        with open(self.postgres, 'w') as fd:
+            fd.write('#!/bin/sh\ncat %s\n' % self.output)
+        os.chmod(self.postgres, os.stat(self.postgres).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_describe_config_skips_internal_settings(self):
+        self.assertEqual([setting.name for setting in settings.describe_config(self.tmp)],
+                         ['shared_buffers', 'fsync', 'application_name'])
+
+    def test_describe_config_error(self):
+        os.remove(self.output)
+        self.assertRaises(OSError, settings.describe_config, self.tmp)
+
+    def test_load_catalog_cache(self):
+        cache_dir = os.path.join(self.tmp, 'cache')
+        timings = Timings(None, None)
+        first = settings.load_catalog(self.tmp, cache_dir, 'abc', timings)
+        self.assertEqual(os.listdir(cache_dir), ['abc.json.gz'])
+
+        os.remove(self.output)
+        second = settings.load_catalog(self.tmp, cache_dir, 'abc', timings)
+        self.assertEqual([vars(setting) for setting in second],
+                         [vars(setting) for setting in first])
+        self.assertEqual(len(timings.records), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
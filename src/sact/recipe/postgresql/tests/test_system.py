@@ -0,0 +1,78 @@
+"""Tests of the discovery of the resources of the host."""
+
+import unittest
+
+from sact.recipe.postgresql import system
+
+
+class SystemTestCase(unittest.TestCase):
+    """Serve the files read by the system module from self.files."""
+
+    def setUp(self):
+        self.files = {}
+        self._read = system._read
+        system._read = self.files.get
+
+    def tearDown(self):
+        system._read = self._read
+
+
+class CpuTests(SystemTestCase):
+
+    def test_no_cgroup_limit(self):
+        self.assertEqual(system.cgroup_cpu_limit(), None)
+        self.files['/sys/fs/cgroup/cpu.max'] = 'max 100000'
+        self.assertEqual(system.cgroup_cpu_limit(), None)
+
+    def test_cgroup_v2_limit(self):
+        self.files['/sys/fs/cgroup/cpu.max'] = '150000 100000'
+        self.assertEqual(system.cgroup_cpu_limit(), 1.5)
+
+    def test_cgroup_v1_limit(self):
+        self.files['/sys/fs/cgroup/cpu/cpu.cfs_quota_us'] = '200000'
+        self.files['/sys/fs/cgroup/cpu/cpu.cfs_period_us'] = '100000'
+        self.assertEqual(system.cgroup_cpu_limit(), 2.0)
+        self.files['/sys/fs/cgroup/cpu/cpu.cfs_quota_us'] = '-1'
+        self.assertEqual(system.cgroup_cpu_limit(), None)
+
+    def test_available_cpus(self):
+        cpus = system.available_cpus()
+        self.assertTrue(cpus >= 1)
+        self.files['/sys/fs/cgroup/cpu.max'] = '50000 100000'
+        self.assertEqual(system.available_cpus(), 1)
+        self.files['/sys/fs/cgroup/cpu.max'] = '%d 100000' % ((cpus + 10) * 100000)
+        self.assertEqual(system.available_cpus(), cpus)
+
+
+class MemoryTests(SystemTestCase):
+
+    def test_meminfo(self):
+        self.files['/proc/meminfo'] = ('MemTotal:       16384 kB\n'
+                                       'HugePages_Total:     512\n'
+                                       'Hugepagesize:       2048 kB')
+        self.assertEqual(system.total_memory(), 16384 * 1024)
+        self.assertEqual(system.huge_pages(), (512, 2048 * 1024))
+
+    def test_cgroup_limit(self):
+        self.files['/proc/meminfo'] = 'MemTotal:       16384 kB'
+        self.files['/sys/fs/cgroup/memory.max'] = '1048576'
+        self.assertEqual(system.total_memory(), 1048576)
+        self.files['/sys/fs/cgroup/memory.max'] = 'max'
+        self.files['/sys/fs/cgroup/memory/memory.limit_in_bytes'] = str(2 ** 63 - 4096)
+        self.assertEqual(system.cgroup_memory_limit(), None)
+        self.assertEqual(system.total_memory(), 16384 * 1024)
+
+
+class FilesystemTests(SystemTestCase):
+
+    def test_filesystem_type(self):
+        self.assertEqual(system.filesystem_type('/'), None)
+        self.files['/proc/self/mounts'] = ('/dev/sda1 / ext4 rw 0 0\n'
+                                           'tmpfs /dev/shm tmpfs rw 0 0\n')
+        self.assertEqual(system.filesystem_type('/dev/shm/sact/not/created/yet'), 'tmpfs')
+        self.assertEqual(system.filesystem_type('/dev/shmem'), 'ext4')
+        self.assertEqual(system.filesystem_type('/'), 'ext4')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Tests of the naming and of the leftovers of the test database pools."""
+
+import os
+import re
+import threading
+import unittest
+
+from sact.recipe.postgresql import testdb
+
+
+# Not running on any host: pids are limited to 2 ** 22.
+DEAD_PID = 2 ** 22 + 1
+
+
+class FakePool(testdb.DatabasePool):
+    """A pool whose server is a set of database names."""
+
+    def __init__(self, databases, *args, **kwargs):
+        self.databases = databases
+        self.statements = []
+        self._server_lock = threading.Lock()
+        info = dict(host='/tmp', port='5432', user='postgres', bin_dir='/usr/bin',
+                    database='template1')
+        testdb.DatabasePool.__init__(self, info, *args, **kwargs)
+
+    def query(self, sql):
+        with self._server_lock:
+            self.statements.append(sql)
+            if sql.startswith('SELECT datname'):
+                return sorted(self.databases)
+            match = re.match(r'CREATE DATABASE "([^"]+)"', sql)
+            if match:
+                self.databases.add(match.group(1))
+            match = re.match(r'DROP DATABASE IF EXISTS "([^"]+)"', sql)
+            if match:
+                self.databases.discard(match.group(1))
+            return []
+
+
+class NamingTests(unittest.TestCase):
+
+    def test_template_tag(self):
+        self.assertEqual(testdb.template_tag('fixtures'), 'fixtures')
+        long_a, long_b = 'x' * 45 + 'a', 'x' * 45 + 'b'
+        self.assertEqual(len(testdb.template_tag(long_a)), 40)
+        self.assertNotEqual(testdb.template_tag(long_a), testdb.template_tag(long_b))
+
+    def test_leftovers_pattern(self):
+        pattern = testdb.leftovers_pattern('fixtures')
+        self.assertEqual(pattern.match('fixtures_p123_4').group(1), '123')
+        self.assertEqual(pattern.match('fixtures_p123'), None)
+        self.assertEqual(pattern.match('fixtures_extra_p123_4'), None)
+        self.assertEqual(pattern.match('fixtures'), None)
+
+    def test_process_running(self):
+        self.assertTrue(testdb.process_running(os.getpid()))
+        self.assertFalse(testdb.process_running(DEAD_PID))
+
+
+class PoolTests(unittest.TestCase):
+
+    def test_names_include_the_pid(self):
+        for prefix in (None, 'run42'):
+            pool = FakePool(set(), 'fixtures', size=1, prefix=prefix)
+            try:
+                database = pool.acquire(timeout=5)
+                self.assertTrue(re.match(r'^%s_p%d_\d+$' % (prefix or 'fixtures', os.getpid()),
+                                         database.name), database.name)
+                pool.release(database)
+            finally:
+                pool.close()
+            self.assertEqual(pool.databases, set())
+
+    def test_drop_leftovers_of_dead_processes_only(self):
+        alive = 'run42_p%d_1' % os.getpid()
+        dead = 'run42_p%d_1' % DEAD_PID
+        databases = set([alive, dead, 'run42_other', 'fixtures'])
+        pool = FakePool(databases, 'fixtures', size=0, prefix='run42')
+        pool.close()
+        self.assertEqual(databases, set([alive, 'run42_other', 'fixtures']))
+
+    def test_pools_on_the_same_template(self):
+        databases = set()
+        first = FakePool(databases, 'fixtures', size=2)
+        second = FakePool(databases, 'fixtures', size=2)
+        try:
+            names = [first.acquire(timeout=5).name, first.acquire(timeout=5).name,
+                     second.acquire(timeout=5).name, second.acquire(timeout=5).name]
+            self.assertEqual(len(set(names)), 4)
+            self.assertTrue(set(names) <= databases)
+        finally:
+            first.close()
+            second.close()
@@ -0,0 +1,85 @@
+"""Tests of the timings of phases and commands."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from sact.recipe.postgresql.timing import Timings
+
+
+class TimingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'var', 'timings.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_phases_and_commands(self):
+        timings = Timings(self.path, 'pg')
+        with timings.phase('binaries'):
+            retcode, out, err = timings.communicate('echo', [sys.executable, '-c', 'print(42)'],
+                                                    stdout=subprocess.PIPE,
+                                                    universal_newlines=True)
+            self.assertEqual((retcode, out), (0, '42\n'))
+            self.assertEqual(timings.call('false', [sys.executable, '-c', 'exit(3)']), 3)
+        self.assertRaises(KeyError, self.failing_phase, timings)
+
+        self.assertEqual([(record['kind'], record['name'], record['phase'], record['status'])
+                          for record in timings.records],
+                         [('command', 'echo', 'binaries', 0),
+                          ('command', 'false', 'binaries', 3),
+                          ('phase', 'binaries', None, 'ok'),
+                          ('phase', 'broken', None, 'error')])
+        self.assertEqual(timings.records[0]['output_bytes'], 3)
+        self.assertEqual(timings.last_record()['name'], 'broken')
+
+        with open(self.path) as fd:
+            written = [json.loads(line) for line in fd]
+        self.assertEqual(written, timings.records)
+        self.assertEqual(set(record['run'] for record in written), set([timings.run_id]))
+
+    def failing_phase(self, timings):
+        with timings.phase('broken'):
+            raise KeyError('broken')
+
+    def test_phases_are_per_thread(self):
+        timings = Timings(None, 'pg')
+
+        def worker():
+            timings.record('command', 'make', 0.0, 1.0, 1.0, 0)
+
+        with timings.phase('binaries'):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        self.assertEqual([(record['name'], record['phase']) for record in timings.records],
+                         [('make', None), ('binaries', None)])
+        self.assertEqual(timings.last_record()['name'], 'binaries')
+
+    def test_unwritable_path(self):
+        open(os.path.join(self.tmp, 'var'), 'w').close()
+        timings = Timings(self.path, 'pg')
+        timings.record('phase', 'binaries', 0.0, 1.0, 1.0, 'ok')
+        self.assertEqual(timings.path, None)
+        self.assertEqual(len(timings.records), 1)
+
+    def test_summary(self):
+        timings = Timings(None, 'pg')
+        self.assertEqual(timings.summary(), '')
+        timings.record('command', 'initdb', 100.0, 2.0, 1.5, 0)
+        timings.record('phase', 'cluster', 99.0, 4.5, 2.0, 'ok')
+        lines = timings.summary().split('\n')
+        self.assertEqual([line.split()[:2] for line in lines[1:3]],
+                         [['phase', 'cluster'], ['command', 'initdb']])
+        self.assertEqual(lines[-1], 'total 4.50s')
+
+
+if __name__ == '__main__':
+    unittest.main()
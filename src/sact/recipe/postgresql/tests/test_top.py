@@ -0,0 +1,52 @@
+"""Tests of the ranking of the statements of pg_stat_statements."""
+
+import unittest
+
+from sact.recipe.postgresql import top
+
+
+def stat(queryid, calls, total_time, blks_read=0, blks_written=0, io_time=0.0, temp=0):
+    return dict(queryid=queryid, database='app', user='app', query='SELECT %s' % queryid,
+                calls=calls, total_time=total_time, rows=calls, shared_blks_hit=0,
+                shared_blks_read=blks_read, shared_blks_written=blks_written,
+                temp_blks_read=temp, temp_blks_written=0, io_time=io_time)
+
+
+def snapshot(*stats):
+    return dict(taken=0, statements=dict(('%s/app/app' % item['queryid'], item)
+                                         for item in stats))
+
+
+class TopTests(unittest.TestCase):
+
+    def test_delta(self):
+        previous = snapshot(stat('1', 10, 100.0), stat('2', 5, 50.0))
+        current = snapshot(stat('1', 15, 160.0), stat('2', 5, 50.0), stat('3', 2, 8.0))
+        stats = dict((item['queryid'], item) for item in top.delta(current, previous))
+        # Statement 2 did not run in between.
+        self.assertEqual(sorted(stats), ['1', '3'])
+        self.assertEqual((stats['1']['calls'], stats['1']['total_time']), (5, 60.0))
+        self.assertEqual(stats['1']['mean_time'], 12.0)
+
+    def test_reset_in_between(self):
+        previous = snapshot(stat('1', 10, 100.0))
+        current = snapshot(stat('1', 3, 30.0))
+        self.assertEqual(top.delta(current, previous)[0]['calls'], 3)
+
+    def test_io_ranks_blocks(self):
+        stats = top.delta(snapshot(stat('reads', 1, 1.0, blks_read=500, io_time=5.0),
+                                   stat('writes', 1, 1.0, blks_written=800, io_time=1.0),
+                                   stat('slow', 1, 1.0, blks_read=10, io_time=900.0)))
+        self.assertEqual([item['queryid'] for item in top.top(stats, 'io')],
+                         ['writes', 'reads', 'slow'])
+        self.assertEqual([item['queryid'] for item in top.top(stats, 'io-time')],
+                         ['slow', 'reads', 'writes'])
+
+    def test_sort_keys_documented(self):
+        self.assertEqual(sorted(name for name, help in top.SORT_HELP), sorted(top.SORT_KEYS))
+
+    def test_snapshot_query(self):
+        query = top.snapshot_query(set(['calls', 'total_exec_time', 'rows', 'blk_read_time']))
+        self.assertIn('coalesce(s.total_exec_time, 0)', query)
+        self.assertIn('coalesce(s.blk_read_time, 0)', query)
+        self.assertNotIn('total_time,', query)
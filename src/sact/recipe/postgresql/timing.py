@@ -0,0 +1,137 @@
+"""Timing of the phases of the recipe and of the commands it runs.
+
+Each finished phase or command is appended as one JSON object per line to a
+timings file, so that the setup time of many buildouts can be collected and
+compared. A record looks like::
+
+    {"run": "...", "part": "pg", "kind": "command", "name": "make",
+     "phase": "binaries", "start": 1700000000.0, "wall": 42.1, "cpu": 160.3,
+     "status": 0, "output_bytes": 120345}
+
+``cpu`` is the user and system time of the recipe process and its children:
+when phases run concurrently, it includes the CPU time of the other phases.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import threading
+import time
+import uuid
+
+
+def cpu_time():
+    """User and system time of this process and of its waited-for children."""
+
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+class Timings(object):
+    """Record the timings of one run of the recipe."""
+
+    def __init__(self, path, part, log=None):
+        self.path = path
+        self.part = part
+        self.log = log or logging.getLogger(__name__)
+        self.run_id = uuid.uuid4().hex
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _current_phase(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def record(self, kind, name, start, wall, cpu, status, output_bytes=None):
+        record = dict(run=self.run_id, part=self.part, kind=kind, name=name,
+                      phase=self._current_phase(), start=round(start, 3),
+                      wall=round(wall, 3), cpu=round(cpu, 3), status=status,
+                      output_bytes=output_bytes)
+        self._local.last = record
+        with self._lock:
+            self.records.append(record)
+            if not self.path:
+                return
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with open(self.path, 'a') as fd:
+                    fd.write(json.dumps(record, sort_keys=True) + '\n')
+            except (IOError, OSError) as e:
+                self.log.warning('Unable to write the timings to %s: %s', self.path, e)
+                self.path = None
+
+    def last_record(self):
+        """Return the last record made by the current thread."""
+
+        return getattr(self._local, 'last', None)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as the phase name.
+
+        Phases and commands started within the block, in the same thread,
+        are recorded as part of it.
+        """
+
+        start, cpu = time.time(), cpu_time()
+        status = 'error'
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        try:
+            yield
+            status = 'ok'
+        finally:
+            stack.pop()
+            self.record('phase', name, start, time.time() - start, cpu_time() - cpu, status)
+
+    def communicate(self, name, cmd, input=None, **kwargs):
+        """Run cmd like Popen(cmd, **kwargs).communicate(input), timing it.
+
+        Returns the exit status and the outputs of the command.
+        """
+
+        start, cpu = time.time(), cpu_time()
+        proc = subprocess.Popen(cmd, **kwargs)
+        out, err = proc.communicate(input)
+        output_bytes = sum(len(data) for data in (out, err) if data)
+        self.record('command', name, start, time.time() - start, cpu_time() - cpu,
+                    proc.returncode, output_bytes)
+        return proc.returncode, out, err
+
+    def call(self, name, cmd, **kwargs):
+        """Run cmd like subprocess.call(cmd, **kwargs), timing it.
+
+        The output goes to the terminal, it is not counted.
+        """
+
+        start, cpu = time.time(), cpu_time()
+        retcode = subprocess.call(cmd, **kwargs)
+        self.record('command', name, start, time.time() - start, cpu_time() - cpu, retcode)
+        return retcode
+
+    def summary(self):
+        """Return the phases and commands of the run, slowest first, as text."""
+
+        if not self.records:
+            return ''
+        total = max(record['start'] + record['wall'] for record in self.records) - \
+            min(record['start'] for record in self.records)
+        lines = ['%-9s %-32s %9s %9s %7s' % ('kind', 'name', 'wall', 'cpu', 'status')]
+        for record in sorted(self.records, key=lambda record: -record['wall']):
+            name = record['name']
+            if record['phase']:
+                name = '%s/%s' % (record['phase'], name)
+            lines.append('%-9s %-32s %8.2fs %8.2fs %7s' % (record['kind'], name[:32],
+                                                          record['wall'], record['cpu'],
+                                                          record['status']))
+        lines.append('total %.2fs' % total)
+        return '\n'.join(lines)
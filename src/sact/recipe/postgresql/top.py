@@ -0,0 +1,196 @@
+"""Top queries of a cluster, from pg_stat_statements.
+
+The recipe generates ``bin/<part>-top``, which calls main() with the
+connection parameters of the part. Without options it ranks the statements
+by the counters accumulated since the last reset; ``--interval`` takes two
+snapshots and ranks the deltas, and ``--save``/``--since`` store a snapshot
+and compare with it later. ``--json`` prints the same data for dashboards.
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+
+# Ranking keys, as functions of a statement's (delta) counters.
+SORT_KEYS = {
+    'total': lambda stat: stat['total_time'],
+    'mean': lambda stat: stat['mean_time'],
+    'calls': lambda stat: stat['calls'],
+    'io': lambda stat: stat['shared_blks_read'] + stat['shared_blks_written'],
+    'io-time': lambda stat: stat['io_time'],
+    'temp': lambda stat: stat['temp_blks_read'] + stat['temp_blks_written'],
+}
+
+SORT_HELP = (
+    ('total', 'total execution time'),
+    ('mean', 'mean execution time'),
+    ('calls', 'number of calls'),
+    ('io', 'shared blocks read and written'),
+    ('io-time', 'time reading and writing blocks, with track_io_timing'),
+    ('temp', 'temporary blocks read and written'),
+)
+
+COUNTERS = ('calls', 'total_time', 'rows', 'shared_blks_hit', 'shared_blks_read',
+            'shared_blks_written', 'temp_blks_read', 'temp_blks_written', 'io_time')
+
+# Column names changed over the versions: the first existing one is used.
+COLUMNS = (
+    ('calls', ('calls',)),
+    ('total_time', ('total_exec_time', 'total_time')),
+    ('rows', ('rows',)),
+    ('shared_blks_hit', ('shared_blks_hit',)),
+    ('shared_blks_read', ('shared_blks_read',)),
+    ('shared_blks_written', ('shared_blks_written',)),
+    ('temp_blks_read', ('temp_blks_read',)),
+    ('temp_blks_written', ('temp_blks_written',)),
+    ('read_time', ('shared_blk_read_time', 'blk_read_time')),
+    ('write_time', ('shared_blk_write_time', 'blk_write_time')),
+)
+
+
+class Client(object):
+    """Run queries through psql with the connection parameters of config."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def query(self, sql):
+        cmd = [os.path.join(self.config['bin_dir'], 'psql'),
+               '-h', self.config['socketdir'].split(',')[0].strip(),
+               '-p', str(self.config['port']),
+               '-U', self.config['user'],
+               '-X', '--no-align', '--quiet', '--tuples-only',
+               '--field-separator', '\x1f', '-v', 'ON_ERROR_STOP=1',
+               '-c', sql, self.config['database']]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(err.strip())
+        return [line.split('\x1f') for line in out.split('\n') if line]
+
+
+def snapshot_query(columns):
+    """Build the query reading pg_stat_statements, given its columns."""
+
+    select = []
+    for name, candidates in COLUMNS:
+        found = [column for column in candidates if column in columns]
+        select.append('coalesce(s.%s, 0)' % found[0] if found else '0')
+    return ("SELECT s.queryid, d.datname, r.rolname, %s, "
+            "regexp_replace(s.query, '\\s+', ' ', 'g') "
+            "FROM pg_stat_statements s "
+            "LEFT JOIN pg_database d ON d.oid = s.dbid "
+            "LEFT JOIN pg_roles r ON r.oid = s.userid" % ', '.join(select))
+
+
+def take_snapshot(client):
+    """Return the statements as a dict, keyed by (queryid, database, user)."""
+
+    columns = set(row[0] for row in client.query(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = 'pg_stat_statements'::regclass AND attnum > 0"))
+    stats = {}
+    for row in client.query(snapshot_query(columns)):
+        queryid, database, user = row[:3]
+        values = [float(value) for value in row[3:3 + len(COLUMNS)]]
+        stat = dict(zip([name for name, candidates in COLUMNS], values))
+        stat['io_time'] = stat.pop('read_time') + stat.pop('write_time')
+        stat.update(queryid=queryid, database=database, user=user,
+                    query=row[3 + len(COLUMNS)])
+        stats['%s/%s/%s' % (queryid, database, user)] = stat
+    return dict(taken=time.time(), statements=stats)
+
+
+def delta(current, previous=None):
+    """Return the statements of current, minus their counters in previous.
+
+    Statements whose counters went backwards were reset in between, their
+    current counters are kept as they are.
+    """
+
+    before = (previous or {}).get('statements', {})
+    result = []
+    for key, stat in current['statements'].items():
+        stat = dict(stat)
+        old = before.get(key)
+        if old is not None and old['calls'] <= stat['calls']:
+            for counter in COUNTERS:
+                stat[counter] -= old[counter]
+        if stat['calls'] <= 0:
+            continue
+        stat['mean_time'] = stat['total_time'] / stat['calls']
+        result.append(stat)
+    return result
+
+
+def top(stats, sort='total', limit=10):
+    return sorted(stats, key=SORT_KEYS[sort], reverse=True)[:limit]
+
+
+def format_table(stats, width=60):
+    lines = ['%10s %12s %10s %10s %10s %10s  %s' % (
+        'calls', 'total ms', 'mean ms', 'io ms', 'blks read', 'temp blks', 'query')]
+    for stat in stats:
+        query = stat['query']
+        if len(query) > width:
+            query = query[:width - 3] + '...'
+        lines.append('%10d %12.1f %10.2f %10.1f %10d %10d  %s' % (
+            stat['calls'], stat['total_time'], stat['mean_time'], stat['io_time'],
+            stat['shared_blks_read'], stat['temp_blks_read'] + stat['temp_blks_written'], query))
+    return '\n'.join(lines)
+
+
+def main(config, args=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-s', '--sort', default='total', choices=sorted(SORT_KEYS),
+                      help="ranking: %s [default: %%default]" %
+                      ', '.join('%s (%s)' % item for item in SORT_HELP))
+    parser.add_option('-n', '--limit', type='int', default=10,
+                      help="number of statements to show [default: %default]")
+    parser.add_option('-i', '--interval', type='float',
+                      help="rank the activity of the next INTERVAL seconds")
+    parser.add_option('--since', metavar='FILE',
+                      help="rank the activity since the snapshot saved in FILE")
+    parser.add_option('--save', metavar='FILE', help="save the current snapshot in FILE")
+    parser.add_option('--json', action='store_true', help="print JSON")
+    parser.add_option('--reset', action='store_true', help="reset the statistics")
+    options = parser.parse_args(args)[0]
+
+    client = Client(config)
+    try:
+        if options.reset:
+            client.query('SELECT pg_stat_statements_reset()')
+            print("Statistics reset")
+            return 0
+
+        previous = None
+        if options.since:
+            with open(options.since) as fd:
+                previous = json.load(fd)
+        elif options.interval:
+            previous = take_snapshot(client)
+            time.sleep(options.interval)
+        current = take_snapshot(client)
+    except RuntimeError as e:
+        print("Unable to read pg_stat_statements: %s" % e)
+        return 1
+
+    if options.save:
+        with open(options.save, 'w') as fd:
+            json.dump(current, fd)
+
+    stats = top(delta(current, previous), options.sort, options.limit)
+    if options.json:
+        json.dump(dict(taken=current['taken'],
+                       since=previous['taken'] if previous else None,
+                       sort=options.sort,
+                       statements=stats), sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print(format_table(stats))
+    return 0